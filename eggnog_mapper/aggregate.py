@@ -0,0 +1,517 @@
+"""
+Columnar (vectorized) summarization of eggNOG annotation tables.
+
+The reference implementation in eggnog_to_feature_table.scan_and_summarize_output walks the
+annotation table one row at a time. The functions here produce the same per-contig summaries
+and feature counts with grouped pandas / NumPy operations instead, so the only Python-level
+loops are over contigs at output time.
+
+A "contig run" is a block of consecutive annotation rows that share the same contig id, which
+is what the reference loop treats as one contig.
+"""
+import numpy
+import pandas
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Mapping, Set, Tuple
+from counts import FeatureCounts
+from interning import (
+    ContigIndex,
+    ContigSet,
+    ContigValues
+)
+
+# (min_contig_length, min_contig_coverage)
+Threshold = Tuple[int, int]
+
+
+def contig_ids_from_query_names(query_names: pandas.Series) -> pandas.Series:
+    """
+    Derives the contig id for each annotation row by dropping the trailing "_<annotation>"
+    part of the query name, e.g. "1085605_contig_1_32" -> "1085605_contig_1".
+    Query names without an underscore map to an empty string, as in the reference loop.
+
+    :param query_names: Series of query_name strings
+    :returns: Series of contig id strings, with the same index
+    """
+    return query_names.str.rpartition("_")[0]
+
+
+def contig_id_codes(annotation_data: pandas.DataFrame) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    Returns an integer code for the contig of each annotation row, and the contig ids the codes
+    stand for. Uses the categorical contig_id column added by annotations.read_annotation_chunks
+    if it's there, otherwise derives the contig ids from the query names.
+
+    :returns: tuple of (codes, contig ids) arrays
+    """
+    if "contig_id" in annotation_data.columns:
+        contig_ids = annotation_data["contig_id"].array
+        return contig_ids.codes, contig_ids.categories.to_numpy(dtype=object)
+    return pandas.factorize(contig_ids_from_query_names(annotation_data["query_name"]).to_numpy(dtype=object), use_na_sentinel=False)
+
+
+# GO terms rolled up to their ancestors (see go_ontology.py), counted from the GO column
+PROPAGATED_CATEGORY = "GO_propagated"
+# categories counted from another category's annotation column
+CATEGORY_COLUMNS = {PROPAGATED_CATEGORY: "GO"}
+
+
+# optional annotation column with a weight for each gene (see gene_abundance.py), features
+# then count the summed weights of their genes rather than the number of genes
+WEIGHT_COLUMN = "gene_weight"
+
+
+def category_column(input_cat: str) -> str:
+    """
+    Returns the annotation column a category is counted from.
+    """
+    return CATEGORY_COLUMNS.get(input_cat, input_cat)
+
+
+def _split_category(values: pandas.Series, input_cat: str) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    Explodes a comma-separated category column into (row position, feature) pairs, keeping
+    the order that features appear in within the table.
+
+    :param values: the category column
+    :param input_cat: category name, COG entries of a single character are dropped
+    :returns: tuple of (row positions, features) arrays
+    """
+    hits = values.notna().to_numpy()
+    split_values = values[hits].astype(str).str.split(",")
+    lengths = split_values.str.len().to_numpy()
+    positions = numpy.repeat(numpy.flatnonzero(hits), lengths)
+    features = split_values.explode().to_numpy(dtype=object)
+    if input_cat == "COG":
+        keep = pandas.Series(features).str.len().to_numpy() > 1
+        positions = positions[keep]
+        features = features[keep]
+    return positions, features
+
+
+class ContigAggregates:
+    """
+    Per-contig aggregates for a block of annotation rows.
+
+    contigs - DataFrame with one row per contig run, columns:
+        contig_id, gene_count, consensus_taxonomy, consensus_taxonomy_frequency
+    non_hits - dict category -> array with the number of genes in each run without a hit
+    features - dict category -> DataFrame with columns run, feature, count. Rows are sorted
+        by run, then by the first appearance of the feature within that run. With gene
+        weights, count is the summed weight of the genes instead.
+    """
+    def __init__(self, contigs: pandas.DataFrame, non_hits: Dict[str, numpy.ndarray], features: Dict[str, pandas.DataFrame]):
+        self.contigs = contigs
+        self.non_hits = non_hits
+        self.features = features
+        self._codes = {}
+
+    def contig_codes(self, index: ContigIndex) -> numpy.ndarray:
+        """
+        Returns the code of each run's contig in the given index (-1 if it's not in it). The
+        codes are only looked up once per index.
+        """
+        if id(index) not in self._codes:
+            self._codes[id(index)] = (index, index.codes(self.contigs["contig_id"].to_numpy(dtype=object)))
+        return self._codes[id(index)][1]
+
+    def __getstate__(self):
+        # codes are cheap to redo, and the index may be large, so they aren't sent to workers
+        return dict(self.__dict__, _codes={})
+
+
+def _consensus_taxonomy(runs: numpy.ndarray, taxonomic_scope: pandas.Series, gene_counts: numpy.ndarray, taxonomy_consensus_threshold: float) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    Finds the consensus taxonomy of every contig run at once. For each run, the most frequent
+    taxonomic scope is chosen, with ties going to the scope that appears first on the contig.
+    If its frequency is below the threshold, both the taxonomy and its frequency are "NA".
+
+    :returns: tuple of (consensus taxonomy, consensus frequency) object arrays, one per run
+    """
+    # a categorical column is factorized from its codes, without hashing the strings
+    scope_codes, scopes = pandas.factorize(taxonomic_scope if isinstance(taxonomic_scope.dtype, pandas.CategoricalDtype) else taxonomic_scope.to_numpy(dtype=object), use_na_sentinel=False)
+    n_scopes = max(len(scopes), 1)
+    # (run, scope) pairs, numbered in order of first appearance, with their gene counts
+    pair_codes, pairs = pandas.factorize(runs * n_scopes + scope_codes)
+    pair_counts = numpy.bincount(pair_codes, minlength=len(pairs))
+    pair_runs = pairs // n_scopes
+    # sort by run, then highest count, then first appearance, and take the first pair of each run
+    order = numpy.lexsort((numpy.arange(len(pairs)), -pair_counts, pair_runs))
+    first_of_run = numpy.ones(len(order), dtype=bool)
+    first_of_run[1:] = pair_runs[order][1:] != pair_runs[order][:-1]
+    best = order[first_of_run]
+    best_runs = pair_runs[best]
+    freq = pair_counts[best] / gene_counts[best_runs]
+    passing = freq >= taxonomy_consensus_threshold
+
+    consensus_taxonomy = numpy.full(len(gene_counts), "NA", dtype=object)
+    consensus_frequency = numpy.full(len(gene_counts), "NA", dtype=object)
+    consensus_taxonomy[best_runs[passing]] = numpy.asarray(scopes, dtype=object)[pairs[best[passing]] % n_scopes]
+    consensus_frequency[best_runs[passing]] = [round(f, 2) for f in freq[passing].tolist()]
+    return consensus_taxonomy, consensus_frequency
+
+
+def summarize_contigs(annotation_data: pandas.DataFrame, categories: List[str], taxonomy_consensus_threshold: float, go_closure=None) -> ContigAggregates:
+    """
+    Computes the per-contig aggregates for every requested category in one pass over the
+    annotation table.
+
+    :param annotation_data: annotation DataFrame, with at least query_name, taxonomic_scope (unless
+        the taxonomy is skipped) and the requested category columns, and optionally the
+        gene_weight column
+    :param categories: list of eggNOG categories to count
+    :param taxonomy_consensus_threshold: frequency threshold for the contig consensus taxonomy,
+        or None to skip the consensus, leaving the taxonomy columns "NA"
+    :param go_closure: go_ontology.GOClosure to roll the GO terms of each gene up with, needed
+        for the GO_propagated category
+    :returns: ContigAggregates
+    """
+    codes, contig_ids = contig_id_codes(annotation_data)
+    if len(codes):
+        new_run = numpy.empty(len(codes), dtype=bool)
+        new_run[0] = True
+        new_run[1:] = codes[1:] != codes[:-1]
+    else:
+        new_run = numpy.zeros(0, dtype=bool)
+    runs = numpy.cumsum(new_run) - 1
+    gene_counts = numpy.bincount(runs, minlength=int(new_run.sum()))
+
+    if taxonomy_consensus_threshold is None:
+        consensus_taxonomy = numpy.full(len(gene_counts), "NA", dtype=object)
+        consensus_frequency = numpy.full(len(gene_counts), "NA", dtype=object)
+    else:
+        consensus_taxonomy, consensus_frequency = _consensus_taxonomy(runs, annotation_data["taxonomic_scope"], gene_counts, taxonomy_consensus_threshold)
+    contigs = pandas.DataFrame({
+        "contig_id": contig_ids[codes[new_run]] if len(contig_ids) else numpy.zeros(0, dtype=object),
+        "gene_count": gene_counts,
+        "consensus_taxonomy": pandas.Series(consensus_taxonomy, dtype=object),
+        "consensus_taxonomy_frequency": pandas.Series(consensus_frequency, dtype=object)
+    })
+
+    weights = annotation_data[WEIGHT_COLUMN].to_numpy() if WEIGHT_COLUMN in annotation_data.columns else None
+    non_hits = {}
+    features = {}
+    for input_cat in categories:
+        values = annotation_data[category_column(input_cat)]
+        non_hits[input_cat] = numpy.bincount(runs, weights=values.isna().to_numpy(), minlength=len(gene_counts)).astype(numpy.int64)
+        positions, feature_values = _split_category(values, input_cat)
+        if input_cat == PROPAGATED_CATEGORY:
+            positions, feature_values = go_closure.propagate(positions, feature_values)
+        pairs = pandas.DataFrame({"run": runs[positions], "feature": feature_values})
+        if weights is None:
+            features[input_cat] = pairs.groupby(["run", "feature"], sort=False).size().reset_index(name="count")
+        else:
+            pairs["count"] = weights[positions]
+            features[input_cat] = pairs.groupby(["run", "feature"], sort=False)["count"].sum().reset_index()
+    return ContigAggregates(contigs, non_hits, features)
+
+
+def _run_values(aggregates: ContigAggregates, values: Mapping[str, float]) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    # (value, has value) of each run's contig
+    values = ContigValues.from_mapping(values)
+    return values.take(aggregates.contig_codes(values.index))
+
+
+def intern_contig_state(
+    coverages: Mapping[str, float],
+    contigs_allowed: Set[str],
+    contig_length_data: Mapping[str, int]
+) -> Tuple[ContigValues, ContigSet, ContigValues]:
+    """
+    Puts the coverages, allowed contigs and contig lengths on one ContigIndex, that of the
+    contig lengths (extended with any allowed contigs that have no length), so the contigs of
+    each chunk only have to be looked up once. Plain dicts and sets are converted.
+
+    :returns: tuple of (coverages, contigs_allowed, contig_length_data)
+    """
+    contig_length_data = ContigValues.from_mapping(contig_length_data)
+    index = contig_length_data.index
+    if isinstance(contigs_allowed, ContigSet):
+        index = index.union(contigs_allowed.index.ids[contigs_allowed.mask])
+    else:
+        index = index.union(list(contigs_allowed))
+    return (
+        ContigValues.from_mapping(coverages, index),
+        ContigSet.from_set(contigs_allowed, index),
+        ContigValues.from_mapping(contig_length_data, index)
+    )
+
+
+def select_contigs(aggregates: ContigAggregates, cov_method: str, coverages: Mapping[str, float], contigs_allowed: Set[str]) -> numpy.ndarray:
+    """
+    Returns a boolean mask over contig runs that should be included in the outputs.
+    Contigs have to be allowed, and in weighted mode also need a coverage value.
+    """
+    contigs_allowed = ContigSet.from_set(contigs_allowed)
+    selected = contigs_allowed.take(aggregates.contig_codes(contigs_allowed.index))
+    if cov_method == "weighted":
+        selected = selected & _run_values(aggregates, coverages)[1]
+    return selected
+
+
+def threshold_masks(
+    aggregates: ContigAggregates,
+    coverages: Mapping[str, float],
+    contig_length_data: Mapping[str, int],
+    thresholds: List[Threshold]
+) -> List[numpy.ndarray]:
+    """
+    Returns a boolean mask over contig runs for each (min_contig_length, min_contig_coverage)
+    threshold. As with filter_contig_lengths and import_coverage_data, contigs shorter than the
+    minimum length or with a coverage below the minimum are left out. Contigs without a
+    coverage value aren't filtered on coverage.
+    """
+    lengths, has_length = _run_values(aggregates, contig_length_data)
+    lengths = numpy.where(has_length, lengths, -1)
+    contig_coverages, has_coverage = _run_values(aggregates, coverages)
+    contig_coverages = numpy.where(has_coverage, contig_coverages, numpy.inf)
+    return [(lengths >= min_length) & (contig_coverages >= min_coverage) for min_length, min_coverage in thresholds]
+
+
+def contig_summary_lines(
+    aggregates: ContigAggregates,
+    input_cats: List[str],
+    cov_method: str,
+    coverages: Mapping[str, float],
+    contig_length_data: Mapping[str, int],
+    selected: numpy.ndarray
+) -> Dict[str, List[str]]:
+    """
+    Builds the lines of the contig summary table for the selected contig runs, formatted the
+    same way as the reference loop. The contig length, coverage and taxonomy columns are the
+    same for every category, so they are only formatted once.
+
+    :returns: dict category -> list of summary lines
+    """
+    contigs = aggregates.contigs[selected]
+    gene_counts = contigs["gene_count"].to_numpy()
+    lengths, has_length = _run_values(aggregates, contig_length_data)
+    leading = [
+        contigs["contig_id"].tolist(),
+        [length if found else "NA" for length, found in zip(lengths[selected].tolist(), has_length[selected].tolist())]
+    ]
+    if cov_method == "weighted":
+        leading.append(_run_values(aggregates, coverages)[0][selected].tolist())
+    leading = ["\t".join(str(value) for value in row) + "\t" for row in zip(*leading)]
+    trailing = [
+        f"\t{taxonomy}\t{frequency}\n" for taxonomy, frequency in zip(
+            contigs["consensus_taxonomy"].tolist(),
+            contigs["consensus_taxonomy_frequency"].tolist()
+        )
+    ]
+
+    summary_lines = {}
+    for input_cat in input_cats:
+        feature_hit_freq = 1 - (aggregates.non_hits[input_cat][selected] / gene_counts)
+        summary_lines[input_cat] = [
+            f"{head}{round(freq, 2)}{tail}" for head, freq, tail in zip(leading, feature_hit_freq.tolist(), trailing)
+        ]
+    return summary_lines
+
+
+def selected_feature_counts(
+    aggregates: ContigAggregates,
+    input_cat: str,
+    cov_method: str,
+    coverages: Mapping[str, float],
+    selected: numpy.ndarray
+) -> Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+    """
+    Returns the (optionally coverage weighted) feature counts of the selected contig runs, as
+    arrays of (contig number, feature, count) ready for FeatureCounts.add_contigs. Contigs are
+    numbered by their position among the selected runs.
+    """
+    features = aggregates.features[input_cat]
+    features = features[selected[features["run"].to_numpy()]]
+    runs = features["run"].to_numpy()
+    counts = features["count"].to_numpy()
+    if cov_method == "weighted":
+        counts = counts * _run_values(aggregates, coverages)[0][runs]
+    return (numpy.cumsum(selected) - 1)[runs], features["feature"].to_numpy(), counts
+
+
+def add_feature_counts(
+    feature_counts: FeatureCounts,
+    aggregates: ContigAggregates,
+    input_cat: str,
+    cov_method: str,
+    coverages: Mapping[str, float],
+    selected: numpy.ndarray
+):
+    """
+    Adds the (optionally coverage weighted) feature counts of the selected contig runs to a
+    running FeatureCounts total.
+    """
+    feature_counts.add_contigs(*selected_feature_counts(aggregates, input_cat, cov_method, coverages, selected))
+
+
+def count_features(
+    aggregates: ContigAggregates,
+    input_cat: str,
+    cov_method: str,
+    coverages: Mapping[str, float],
+    selected: numpy.ndarray
+) -> Dict[str, int]:
+    """
+    Totals the (optionally coverage weighted) feature counts over the selected contig runs.
+
+    The result is ordered like the reference loop's running Counter sum: features from later
+    contigs come first, and features from the same contig keep their order of appearance.
+    Features with a total of zero are dropped.
+    """
+    feature_counts = FeatureCounts()
+    add_feature_counts(feature_counts, aggregates, input_cat, cov_method, coverages, selected)
+    return feature_counts.to_dict()
+
+
+def _selected_taxa(aggregates: ContigAggregates, selected: numpy.ndarray) -> numpy.ndarray:
+    return aggregates.contigs["consensus_taxonomy"].to_numpy(dtype=object)[selected]
+
+
+def summarize_chunk(
+    annotation_data: pandas.DataFrame,
+    input_cats: List[str],
+    cov_method: str,
+    coverages: Mapping[str, float],
+    contigs_allowed: Set[str],
+    contig_length_data: Mapping[str, int],
+    taxonomy_consensus_threshold: float,
+    thresholds: List[Threshold] = None,
+    go_closure=None,
+    return_aggregates: bool = False
+):
+    """
+    Summarizes one chunk of the annotation table, which has to end on a contig boundary. The
+    chunk can also be given as already computed ContigAggregates (e.g. from a contig store).
+
+    If thresholds are given, contigs_allowed shouldn't be filtered on length or coverage yet.
+    The chunk is then aggregated once, and the outputs for each (min_contig_length,
+    min_contig_coverage) threshold are cut from those aggregates (see threshold_masks).
+
+    :returns: tuple of
+        summary_lines - dict category -> list of contig summary lines
+        feature_counts - dict category -> (contig number, feature, count) arrays to add to the
+            running FeatureCounts total of that category
+        contig_taxa - array with the consensus taxonomy of each contig number
+        or, if thresholds are given, a list of these tuples, one per threshold
+        or, if return_aggregates is True, a tuple of the above and the chunk's ContigAggregates
+    """
+    if isinstance(annotation_data, ContigAggregates):
+        aggregates = annotation_data
+    else:
+        aggregates = summarize_contigs(annotation_data, input_cats, taxonomy_consensus_threshold, go_closure)
+    chunk_result = _summarize_aggregates(aggregates, input_cats, cov_method, coverages, contigs_allowed, contig_length_data, thresholds)
+    return (chunk_result, aggregates) if return_aggregates else chunk_result
+
+
+def _summarize_aggregates(aggregates, input_cats, cov_method, coverages, contigs_allowed, contig_length_data, thresholds):
+    selected = select_contigs(aggregates, cov_method, coverages, contigs_allowed)
+    if thresholds is None:
+        summary_lines = contig_summary_lines(aggregates, input_cats, cov_method, coverages, contig_length_data, selected)
+        feature_counts = {
+            input_cat: selected_feature_counts(aggregates, input_cat, cov_method, coverages, selected)
+            for input_cat in input_cats
+        }
+        return summary_lines, feature_counts, _selected_taxa(aggregates, selected)
+
+    masks = [selected & mask for mask in threshold_masks(aggregates, coverages, contig_length_data, thresholds)]
+    # summary lines are formatted once, for every contig kept by any of the thresholds
+    kept = numpy.logical_or.reduce(masks)
+    kept_lines = {
+        input_cat: numpy.array(lines, dtype=object)
+        for input_cat, lines in contig_summary_lines(aggregates, input_cats, cov_method, coverages, contig_length_data, kept).items()
+    }
+    results = []
+    for mask in masks:
+        summary_lines = {input_cat: kept_lines[input_cat][mask[kept]].tolist() for input_cat in input_cats}
+        feature_counts = {
+            input_cat: selected_feature_counts(aggregates, input_cat, cov_method, coverages, mask)
+            for input_cat in input_cats
+        }
+        results.append((summary_lines, feature_counts, _selected_taxa(aggregates, mask)))
+    return results
+
+
+def _summarize_shard(shard_args: tuple):
+    # unpacks the arguments for summarize_chunk when running in a worker process
+    return summarize_chunk(*shard_args)
+
+
+def _shard_args(annotation_chunks, input_cats, cov_method, coverages, contigs_allowed, contig_length_data, taxonomy_consensus_threshold, thresholds, go_closure, return_aggregates=False):
+    """
+    Yields the summarize_chunk arguments for each chunk, with the coverage, length and filter
+    data cut down to just the contigs in that chunk, on an index of those contigs.
+    """
+    coverages, contigs_allowed, contig_length_data = intern_contig_state(coverages, contigs_allowed, contig_length_data)
+    for annotation_data in annotation_chunks:
+        if isinstance(annotation_data, ContigAggregates):
+            chunk_contigs = pandas.unique(annotation_data.contigs["contig_id"].to_numpy(dtype=object))
+        else:
+            chunk_contigs = contig_id_codes(annotation_data)[1]
+        chunk_index = ContigIndex(chunk_contigs)
+        yield (
+            annotation_data,
+            input_cats,
+            cov_method,
+            coverages.reindex(chunk_index),
+            contigs_allowed.reindex(chunk_index),
+            contig_length_data.reindex(chunk_index),
+            taxonomy_consensus_threshold,
+            thresholds,
+            go_closure,
+            return_aggregates
+        )
+
+
+def _sink_aggregates(chunk_result, aggregates_sink):
+    # hands the aggregates a chunk was summarized from to aggregates_sink
+    if aggregates_sink is None:
+        return chunk_result
+    chunk_result, aggregates = chunk_result
+    aggregates_sink(aggregates)
+    return chunk_result
+
+
+def summarize_chunks(
+    annotation_chunks: Iterable[pandas.DataFrame],
+    input_cats: List[str],
+    cov_method: str,
+    coverages: Mapping[str, float],
+    contigs_allowed: Set[str],
+    contig_length_data: Mapping[str, int],
+    taxonomy_consensus_threshold: float,
+    processes: int = 1,
+    thresholds: List[Threshold] = None,
+    go_closure=None,
+    aggregates_sink: Callable[[ContigAggregates], None] = None
+) -> Iterator:
+    """
+    Runs summarize_chunk over every chunk and yields the results in input order.
+
+    With more than one process, the chunks are summarized as shards in a process pool. Each
+    worker only receives its shard along with the coverage, length and filter data for the
+    contigs in it. At most two shards per process are in flight at a time, so memory stays
+    bounded while streaming. As results are yielded in input order, merging them gives the
+    same output as a serial run. A GO closure loaded from an OBO file is sent to the workers
+    as its path, and memory-mapped from its cache by each of them.
+
+    If aggregates_sink is given, it's called with the ContigAggregates of each chunk, in input
+    order, before its results are yielded (e.g. ContigStoreWriter.add). The aggregates are
+    computed along with the results, in the workers.
+    """
+    return_aggregates = aggregates_sink is not None
+    if processes <= 1:
+        coverages, contigs_allowed, contig_length_data = intern_contig_state(coverages, contigs_allowed, contig_length_data)
+        for annotation_data in annotation_chunks:
+            yield _sink_aggregates(summarize_chunk(annotation_data, input_cats, cov_method, coverages, contigs_allowed, contig_length_data, taxonomy_consensus_threshold, thresholds, go_closure, return_aggregates), aggregates_sink)
+        return
+    shards = _shard_args(annotation_chunks, input_cats, cov_method, coverages, contigs_allowed, contig_length_data, taxonomy_consensus_threshold, thresholds, go_closure, return_aggregates)
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        pending = deque()
+        for shard in shards:
+            pending.append(executor.submit(_summarize_shard, shard))
+            if len(pending) >= 2 * processes:
+                yield _sink_aggregates(pending.popleft().result(), aggregates_sink)
+        while pending:
+            yield _sink_aggregates(pending.popleft().result(), aggregates_sink)
@@ -0,0 +1,483 @@
+"""
+Tools for reading eggNOG annotation files
+
+Annotation files are read from their path, except for standard input ("-"), named pipes and
+gzip or zstd compressed files, which are read front to back as a stream (see
+open_annotation_stream), so they can be summarized while they're being written.
+"""
+import csv
+import gzip
+import io
+import os
+import sys
+import numpy
+import pandas
+from typing import Dict, Iterator, List, NamedTuple, Tuple
+from aggregate import (
+    category_column,
+    contig_ids_from_query_names
+)
+
+# columns of the eggNOG annotation file, in order
+ANNOTATION_COLUMNS = [
+    "query_name", "seed_eggNOG_ortholog", "seed_ortholog_evalue", "seed_ortholog_score", "best_tax_level",
+    "Preferred_name", "GO", "EC", "KEGG_ko", "KEGG_Pathway", "KEGG_Module", "KEGG_Reaction", "KEGG_rclass",
+    "BRITE", "KEGG_TC", "CAZy", "BiGG_Reaction", "taxonomic_scope", "eggNOG_OGs", "best_eggNOG_OG", "COG",
+    "eggNOG_free_text_desc"
+]
+
+# header names used by eggNOG-mapper v1 and v2 files -> our column names. v2 files have no
+# taxonomic scope, the closest is the level the annotations were taken from (max_annot_lvl)
+HEADER_COLUMNS = {
+    "query": "query_name",
+    "seed_ortholog": "seed_eggNOG_ortholog",
+    "evalue": "seed_ortholog_evalue",
+    "score": "seed_ortholog_score",
+    "GOs": "GO",
+    "taxonomic scope": "taxonomic_scope",
+    "max_annot_lvl": "taxonomic_scope",
+    "eggNOG OGs": "eggNOG_OGs",
+    "best eggNOG OG": "best_eggNOG_OG",
+    "COG Functional cat.": "COG",
+    "COG_category": "COG",
+    "eggNOG free text desc.": "eggNOG_free_text_desc",
+    "Description": "eggNOG_free_text_desc"
+}
+
+# values read as missing, the pandas defaults, so both parsers agree
+NA_VALUES = [
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null"
+]
+# eggNOG-mapper v2 writes "-" for a missing annotation
+V2_NA_VALUES = NA_VALUES + ["-"]
+
+PARSERS = ["c", "pyarrow"]
+
+# bytes of the file sampled to estimate the row size for pyarrow's block size
+_SAMPLE_BYTES = 1 << 20
+
+# annotation file name for standard input
+STDIN = "-"
+# leading bytes of compressed files
+_COMPRESSION_MAGIC = {b"\x1f\x8b": "gzip", b"\x28\xb5\x2f\xfd": "zstd"}
+# bytes read from a stream at a time
+_STREAM_BLOCK = 1 << 20
+
+
+class AnnotationLayout(NamedTuple):
+    """
+    columns - names of the columns of the file, in order
+    skip_rows - number of comment and header lines at the start of the file
+    data_end - byte offset of the "#" lines at the end of the file (such as the run summary of
+        v2 files), or None if there aren't any
+    version - eggNOG-mapper version of the file's header, 2 for a "#query" header, otherwise 1
+    """
+    columns: List[str]
+    skip_rows: int
+    data_end: int = None
+    version: int = 1
+
+    @property
+    def na_values(self) -> List[str]:
+        """
+        Values read as missing.
+        """
+        return V2_NA_VALUES if self.version == 2 else NA_VALUES
+
+
+class _BoundedReader(io.RawIOBase):
+    # the first `size` bytes of a binary file
+    def __init__(self, f, size: int):
+        self._f = f
+        self._remaining = size
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        n = self._f.readinto(memoryview(buffer)[:max(min(len(buffer), self._remaining), 0)])
+        self._remaining -= n
+        return n
+
+    def close(self):
+        self._f.close()
+        super().close()
+
+
+class _CommentFilter(io.RawIOBase):
+    # a text stream without its "#" lines, starting with the bytes in pending. Only whole lines
+    # are passed on, and blocks without a "#" line are passed on as they are
+    def __init__(self, f, pending: bytes = b"", close_source: bool = True):
+        self._f = f
+        self._carry = pending
+        self._out = memoryview(b"")
+        self._eof = False
+        self._close_source = close_source
+
+    def readable(self) -> bool:
+        return True
+
+    def _fill(self) -> bool:
+        while not len(self._out):
+            if self._eof:
+                return False
+            # read1 returns what's available, rather than waiting for a whole block
+            block = self._f.read1(_STREAM_BLOCK)
+            if block:
+                data = self._carry + block
+                end = data.rfind(b"\n") + 1
+                data, self._carry = data[:end], data[end:]
+            else:
+                data, self._carry = self._carry, b""
+                self._eof = True
+            if data.startswith(b"#") or b"\n#" in data:
+                data = b"".join(line for line in data.splitlines(keepends=True) if not line.startswith(b"#"))
+            self._out = memoryview(data)
+        return True
+
+    def readinto(self, buffer) -> int:
+        if not self._fill():
+            return 0
+        n = min(len(buffer), len(self._out))
+        buffer[:n] = self._out[:n]
+        self._out = self._out[n:]
+        return n
+
+    def close(self):
+        if self._close_source:
+            self._f.close()
+        super().close()
+
+
+def _compression(head: bytes) -> str:
+    for magic, compression in _COMPRESSION_MAGIC.items():
+        if head.startswith(magic):
+            return compression
+    return None
+
+
+def is_annotation_stream(input_annotation_file: str) -> bool:
+    """
+    Whether the annotation file has to be read as a stream: standard input ("-"), a named pipe
+    (or anything else that isn't a regular file) or a gzip or zstd compressed file.
+    """
+    if input_annotation_file == STDIN:
+        return True
+    if not os.path.isfile(input_annotation_file):
+        return os.path.exists(input_annotation_file)
+    with open(input_annotation_file, "rb") as f:
+        return _compression(f.read(4)) is not None
+
+
+def open_annotation_stream(input_annotation_file: str):
+    """
+    Opens an annotation file, or standard input for "-", as a binary stream, decompressing
+    gzip and zstd (requires zstandard) data.
+
+    :raises ValueError: if the data is zstd compressed and zstandard isn't installed
+    """
+    f = sys.stdin.buffer if input_annotation_file == STDIN else open(input_annotation_file, "rb")
+    compression = _compression(f.peek(4)[:4])
+    if compression == "gzip":
+        return gzip.GzipFile(fileobj=f, mode="rb")
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError(f"Reading zstd compressed annotations ({input_annotation_file}) requires the zstandard package")
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True))
+    return f
+
+
+def _header_columns(line: str) -> Tuple[List[str], int]:
+    # column names and file version of a "#query_name" (v1) or "#query" (v2) header line, or
+    # None for other "#" lines
+    names = [name.strip() for name in line[1:].rstrip("\r\n").split("\t")]
+    if names[0] in ("query_name", "query"):
+        return [HEADER_COLUMNS.get(name, name) for name in names], 2 if names[0] == "query" else 1
+    return None
+
+
+def _open_stream_data(input_annotation_file: str) -> Tuple[AnnotationLayout, io.BufferedReader]:
+    """
+    Opens an annotation stream and reads its leading "#" lines for the columns. Returns its
+    layout and the rest of the stream to parse, without any "#" lines.
+    """
+    f = open_annotation_stream(input_annotation_file)
+    columns, version = ANNOTATION_COLUMNS, 1
+    while True:
+        line = f.readline()
+        if not line.startswith(b"#"):
+            break
+        columns, version = _header_columns(line.decode()) or (columns, version)
+    # standard input is left open
+    data = io.BufferedReader(_CommentFilter(f, line, close_source=input_annotation_file != STDIN), _STREAM_BLOCK)
+    return AnnotationLayout(columns, 0, None, version), data
+
+
+def _trailing_comments_offset(input_annotation_file: str) -> int:
+    # byte offset of the block of "#" lines at the end of the file, if there is one
+    with open(input_annotation_file, "rb") as f:
+        size = f.seek(0, os.SEEK_END)
+        start = max(size - _SAMPLE_BYTES, 0)
+        f.seek(start)
+        tail = f.read()
+    offset = len(tail)
+    lines = tail.splitlines(keepends=True)
+    for line in reversed(lines[1:] if start else lines):
+        if not (line.startswith(b"#") or not line.strip()):
+            break
+        offset -= len(line)
+    return start + offset if start + offset < size else None
+
+
+def annotation_layout(input_annotation_file: str) -> AnnotationLayout:
+    """
+    Finds the columns of an annotation file from the leading "#" lines. eggNOG-mapper v1 and v2
+    files have a "#query_name" or "#query" header line among them, with the column names.
+    Files without a header have the ANNOTATION_COLUMNS. In v2 files ("#query" header), "-"
+    values are read as missing. "#" lines at the end of the file are
+    found too, so they can be left out of the read.
+
+    :param input_annotation_file: annotation file path
+    :returns: AnnotationLayout
+    """
+    columns, version = ANNOTATION_COLUMNS, 1
+    skip_rows = 0
+    with open(input_annotation_file) as f:
+        for line in f:
+            if not line.startswith("#"):
+                break
+            skip_rows += 1
+            columns, version = _header_columns(line) or (columns, version)
+    return AnnotationLayout(columns, skip_rows, _trailing_comments_offset(input_annotation_file), version)
+
+
+def required_columns(categories: List[str], taxonomy: bool = True) -> List[str]:
+    """
+    Returns the annotation columns needed to summarize the given categories, in file order.
+
+    :param categories: list of eggNOG categories
+    :param taxonomy: whether the taxonomic_scope column is needed for the consensus taxonomy
+    :returns: list of column names
+    """
+    needed = set(["query_name"] + (["taxonomic_scope"] if taxonomy else []) + [category_column(cat) for cat in categories])
+    return [col for col in ANNOTATION_COLUMNS if col in needed]
+
+
+def _column_dtypes(columns: List[str]) -> Dict[str, str]:
+    # the taxonomic scopes are a handful of values repeated on every row
+    return {col: "category" if col == "taxonomic_scope" else "str" for col in columns}
+
+
+def _usecols(input_annotation_file: str, layout: AnnotationLayout, categories: List[str], taxonomy: bool) -> List[str]:
+    usecols = required_columns(categories, taxonomy)
+    missing = [col for col in usecols if col not in layout.columns]
+    if missing:
+        raise ValueError(f"Annotation file {input_annotation_file} has no {', '.join(missing)} column")
+    return usecols
+
+
+def _drop_comments(annotation_data: pandas.DataFrame, columns: List[str] = None) -> pandas.DataFrame:
+    # drops "#" lines after the data, such as the run summary at the end of v2 files, and puts
+    # the columns in the usual order
+    comments = annotation_data["query_name"].str.startswith("#", na=False).to_numpy()
+    if comments.any():
+        annotation_data = annotation_data[~comments].reset_index(drop=True)
+    if columns is not None and list(annotation_data.columns) != columns:
+        annotation_data = annotation_data[columns]
+    return annotation_data
+
+
+def _open_data(input_annotation_file: str, layout: AnnotationLayout):
+    # the file, or just the part before the "#" lines at its end, which the pandas parser can't
+    # skip when a chunk has nothing else
+    if layout.data_end is None:
+        return input_annotation_file
+    return io.BufferedReader(_BoundedReader(open(input_annotation_file, "rb"), layout.data_end))
+
+
+def _open_source(input_annotation_file: str) -> Tuple[AnnotationLayout, object]:
+    # the layout and the data to parse: a path or bounded reader for files, the comment-free
+    # rest of the stream for streams (see is_annotation_stream)
+    if is_annotation_stream(input_annotation_file):
+        return _open_stream_data(input_annotation_file)
+    layout = annotation_layout(input_annotation_file)
+    return layout, _open_data(input_annotation_file, layout)
+
+
+def _close_source(data):
+    if not isinstance(data, str):
+        data.close()
+
+
+def _pyarrow_source(input_annotation_file: str, layout: AnnotationLayout, data):
+    # pyarrow reads files itself, skipping the comment lines, and streams from the open data
+    if isinstance(data, str) or layout.data_end is not None:
+        return input_annotation_file
+    return data
+
+
+def _read_csv_args(input_annotation_file: str, layout: AnnotationLayout, usecols: List[str] = None) -> dict:
+    args = dict(
+        delimiter="\t",
+        header=None,
+        names=layout.columns,
+        skiprows=layout.skip_rows,
+        quoting=csv.QUOTE_NONE,
+        na_values=layout.na_values,
+        keep_default_na=False
+    )
+    if usecols is not None:
+        args.update(usecols=usecols, dtype=_column_dtypes(usecols))
+    return args
+
+
+def _pyarrow_options(layout: AnnotationLayout, usecols: List[str], block_size: int = None):
+    import pyarrow
+    import pyarrow.csv
+
+    def skip_comments(row):
+        return "skip" if row.text.startswith("#") else "error"
+
+    types = {col: pyarrow.dictionary(pyarrow.int32(), pyarrow.string()) if dtype == "category" else pyarrow.string() for col, dtype in _column_dtypes(usecols).items()}
+    read_options = pyarrow.csv.ReadOptions(column_names=layout.columns, skip_rows=layout.skip_rows, use_threads=True)
+    if block_size:
+        read_options.block_size = block_size
+    return dict(
+        read_options=read_options,
+        parse_options=pyarrow.csv.ParseOptions(delimiter="\t", quote_char=False, invalid_row_handler=skip_comments),
+        convert_options=pyarrow.csv.ConvertOptions(include_columns=usecols, column_types=types, null_values=layout.na_values, strings_can_be_null=True)
+    )
+
+
+def _bytes_per_row(input_annotation_file: str) -> float:
+    with open(input_annotation_file, "rb") as f:
+        sample = f.read(_SAMPLE_BYTES)
+    return len(sample) / max(sample.count(b"\n"), 1)
+
+
+def read_annotations(input_annotation_file: str, categories: List[str] = None, taxonomy: bool = True, parser: str = "c") -> pandas.DataFrame:
+    """
+    Reads a whole annotation file into a DataFrame. Header and comment lines are skipped.
+
+    With categories, only the needed columns are parsed, as strings, except for taxonomic_scope,
+    which is categorical.
+
+    :param input_annotation_file: annotation file path, or "-" for standard input
+    :param categories: if given, only the columns needed for these categories are read
+    :param taxonomy: with categories, whether to read the taxonomic_scope column
+    :param parser: "c" for the pandas parser, or "pyarrow" to parse on multiple threads with
+        pyarrow (requires pyarrow and categories)
+    :returns: DataFrame with the annotation data
+    """
+    if input_annotation_file != STDIN:
+        input_annotation_file = os.path.abspath(input_annotation_file)
+    layout, data = _open_source(input_annotation_file)
+    try:
+        usecols = _usecols(input_annotation_file, layout, categories, taxonomy) if categories is not None else None
+        if parser == "pyarrow" and usecols is not None:
+            import pyarrow.csv
+            annotation_data = pyarrow.csv.read_csv(_pyarrow_source(input_annotation_file, layout, data), **_pyarrow_options(layout, usecols)).to_pandas()
+        else:
+            annotation_data = pandas.read_csv(data, **_read_csv_args(input_annotation_file, layout, usecols))
+    finally:
+        _close_source(data)
+    return _drop_comments(annotation_data, usecols)
+
+
+def _raw_chunks(input_annotation_file: str, layout: AnnotationLayout, data, usecols: List[str], chunk_size: int, parser: str) -> Iterator[pandas.DataFrame]:
+    # chunks of about chunk_size rows, not yet cut on contig boundaries
+    if parser == "pyarrow":
+        import pyarrow
+        import pyarrow.csv
+        source = _pyarrow_source(input_annotation_file, layout, data)
+        # a stream can't be sampled, and the default blocks keep up with it as it's written
+        block_size = int(min(max(chunk_size * _bytes_per_row(input_annotation_file), 1 << 20), 1 << 30)) if source is input_annotation_file else None
+        reader = pyarrow.csv.open_csv(source, **_pyarrow_options(layout, usecols, block_size))
+        batches = []
+        rows = 0
+        for batch in reader:
+            batches.append(batch)
+            rows += batch.num_rows
+            if rows >= chunk_size:
+                yield pyarrow.Table.from_batches(batches).to_pandas()
+                batches = []
+                rows = 0
+        if batches:
+            yield pyarrow.Table.from_batches(batches).to_pandas()
+        return
+    with pandas.read_csv(data, chunksize=chunk_size, **_read_csv_args(input_annotation_file, layout, usecols)) as reader:
+        yield from reader
+
+
+def _concat_chunks(first: pandas.DataFrame, second: pandas.DataFrame) -> pandas.DataFrame:
+    # concatenates two chunks, keeping categorical columns categorical
+    combined = pandas.concat([first, second], ignore_index=True)
+    for col in first.columns:
+        if isinstance(first[col].dtype, pandas.CategoricalDtype) and not isinstance(combined[col].dtype, pandas.CategoricalDtype):
+            combined[col] = pandas.api.types.union_categoricals([first[col], second[col]])
+    return combined
+
+
+def _with_contig_ids(annotation_data: pandas.DataFrame, codes: numpy.ndarray, contig_ids: numpy.ndarray) -> pandas.DataFrame:
+    annotation_data = annotation_data.copy()
+    annotation_data["contig_id"] = pandas.Categorical.from_codes(codes, pandas.Index(contig_ids, dtype=object))
+    return annotation_data
+
+
+def read_annotation_chunks(input_annotation_file: str, categories: List[str], chunk_size: int, taxonomy: bool = True, parser: str = "c") -> Iterator[pandas.DataFrame]:
+    """
+    Streams an annotation file in chunks of about chunk_size rows, only parsing the columns
+    needed for the given categories (see read_annotations).
+
+    Chunks always end on a contig boundary: the genes of the contig at the end of each chunk
+    are held back and prepended to the next one. As the genes of a contig are contiguous in
+    the file, every contig is complete within a single chunk, and memory use is bounded by
+    the chunk size plus the largest contig rather than by the whole file.
+
+    Each chunk has a fresh 0-based index, and an extra categorical contig_id column with the
+    contig of each row. If chunk_size is 0, the whole file is returned as a single chunk.
+
+    Streams (standard input, named pipes, compressed files) are read as the data arrives, so
+    each chunk is yielded as soon as its contigs are complete.
+
+    :param input_annotation_file: annotation file path, or "-" for standard input
+    :param categories: list of eggNOG categories to read
+    :param chunk_size: number of rows to read at a time
+    :param taxonomy: whether to read the taxonomic_scope column
+    :param parser: "c" or "pyarrow", see read_annotations
+    :returns: iterator of DataFrames
+    """
+    if not chunk_size:
+        annotation_data = read_annotations(input_annotation_file, categories, taxonomy, parser)
+        codes, contig_ids = pandas.factorize(contig_ids_from_query_names(annotation_data["query_name"]).to_numpy(dtype=object))
+        yield _with_contig_ids(annotation_data, codes, contig_ids)
+        return
+    if input_annotation_file != STDIN:
+        input_annotation_file = os.path.abspath(input_annotation_file)
+    layout, data = _open_source(input_annotation_file)
+    try:
+        usecols = _usecols(input_annotation_file, layout, categories, taxonomy)
+        held_back = None
+        for chunk in _raw_chunks(input_annotation_file, layout, data, usecols, chunk_size, parser):
+            chunk = _drop_comments(chunk, usecols)
+            if held_back is not None:
+                chunk = _concat_chunks(held_back, chunk)
+            if len(chunk) == 0:
+                continue
+            codes, contig_ids = pandas.factorize(contig_ids_from_query_names(chunk["query_name"]).to_numpy(dtype=object))
+            other_contigs = (codes != codes[-1]).nonzero()[0]
+            if len(other_contigs) == 0:
+                # the chunk is all one contig, keep reading until it ends
+                held_back = chunk
+                continue
+            boundary = other_contigs[-1] + 1
+            held_back = chunk.iloc[boundary:].reset_index(drop=True)
+            yield _with_contig_ids(chunk.iloc[:boundary].reset_index(drop=True), codes[:boundary], contig_ids)
+    finally:
+        _close_source(data)
+    if held_back is not None and len(held_back):
+        codes, contig_ids = pandas.factorize(contig_ids_from_query_names(held_back["query_name"]).to_numpy(dtype=object))
+        yield _with_contig_ids(held_back, codes, contig_ids)
@@ -0,0 +1,264 @@
+"""
+A persisted store of the per-contig aggregates of an annotation file.
+
+Everything that's learned per contig while summarizing the annotations (gene counts, consensus
+taxonomy, non-hit counts and feature counts per category) is saved in a directory of column
+files next to the outputs. Coverage weighting, binary mode, length and coverage thresholds,
+contig filters and cross-reference tables are all applied after this step, so a later run
+that only changes those can rebuild every output from the store without reading the
+annotation file again (see eggnog_store.py).
+
+Store layout, in <output_dir>/<sample>_contig_store/:
+    manifest.json - format version, the annotation file it was built from (path, size and
+        mtime), the taxonomy consensus threshold and the stored categories, and the GO OBO
+        file the GO_propagated counts were rolled up with
+    contig_id.txt, consensus_taxonomy.txt - one value per line, with consensus_taxonomy.npy
+        holding the codes of each contig run (-1 for a missing scope)
+    gene_count.npy, consensus_taxonomy_frequency.npy (NaN for "NA")
+    <category>.non_hits.npy, <category>.run.npy, <category>.feature.npy (codes into
+        <category>.feature.txt), <category>.count.npy
+"""
+import os
+import json
+import shutil
+import numpy
+import pandas
+from typing import Iterable, List, Optional
+from aggregate import (
+    PROPAGATED_CATEGORY,
+    ContigAggregates
+)
+from go_ontology import obo_key
+
+STORE_VERSION = 1
+STORE_SUFFIX = "_contig_store"
+MANIFEST = "manifest.json"
+
+
+def contig_store_path(output_dir: str, input_annotation: str) -> str:
+    """
+    Returns the store directory for an annotation file, named like the other outputs.
+    """
+    return os.path.join(output_dir, f"{os.path.basename(input_annotation).split('_')[0]}{STORE_SUFFIX}")
+
+
+def _source_key(path: str) -> dict:
+    stat = os.stat(path)
+    return {"path": os.path.abspath(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _write_lines(f, values: Iterable[str]):
+    # ids and features come from tab-separated lines, so can't contain line breaks
+    f.write("".join(f"{value}\n" for value in values))
+
+
+def _write_strings(path: str, values: Iterable[str]):
+    with open(path, "w") as f:
+        _write_lines(f, values)
+
+
+def _read_strings(path: str) -> List[str]:
+    with open(path) as f:
+        return f.read().split("\n")[:-1]
+
+
+def _load_coded(store_dir: str, name: str) -> numpy.ndarray:
+    codes = numpy.load(os.path.join(store_dir, f"{name}.npy"))
+    uniques = numpy.array(_read_strings(os.path.join(store_dir, f"{name}.txt")) + [numpy.nan], dtype=object)
+    # code -1 picks the trailing NaN
+    return uniques[codes]
+
+
+def read_store_manifest(store_dir: str) -> Optional[dict]:
+    """
+    Returns the store manifest, or None if there's no readable store in store_dir.
+    """
+    try:
+        with open(os.path.join(store_dir, MANIFEST)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return manifest if manifest.get("version") == STORE_VERSION else None
+
+
+def store_is_current(store_dir: str, input_annotation: str, categories: List[str], taxonomy_consensus_threshold: float, go_obo: Optional[str] = None) -> bool:
+    """
+    Whether the store in store_dir was built from the annotation file as it is now (same size
+    and mtime), with the same taxonomy consensus threshold, and has all the given categories.
+    GO_propagated counts also have to be rolled up with the go_obo file as it is now.
+    """
+    manifest = read_store_manifest(store_dir)
+    if manifest is None or not os.path.exists(input_annotation):
+        return False
+    annotation_key = _source_key(input_annotation)
+    if PROPAGATED_CATEGORY in categories and (go_obo is None or not os.path.exists(go_obo) or manifest.get("go_obo") != obo_key(go_obo)):
+        return False
+    return (
+        {key: manifest["annotation"][key] for key in ("size", "mtime_ns")} == {key: annotation_key[key] for key in ("size", "mtime_ns")}
+        and manifest["taxonomy_consensus_threshold"] == taxonomy_consensus_threshold
+        and set(categories) <= set(manifest["categories"])
+    )
+
+
+class ContigStoreWriter:
+    """
+    Writes a contig store one chunk of aggregates at a time, so that the store of an annotation
+    file can be built while it's streamed, without keeping the aggregates of the whole file.
+    Each column is appended to a raw .part file, and only gets its .npy header once the store
+    is finished. Contig runs are renumbered as chunks are added.
+
+    Any store already in store_dir is replaced. The manifest is written last, by finish, so a
+    partly written store is never taken as valid. Used as a context manager, the .part files
+    of an unfinished store are removed on exit.
+    """
+    def __init__(self, store_dir: str, categories: List[str]):
+        self.store_dir = store_dir
+        self.categories = list(categories)
+        self.contig_runs = 0
+        os.makedirs(store_dir, exist_ok=True)
+        manifest_path = os.path.join(store_dir, MANIFEST)
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+        self._contig_ids = open(os.path.join(store_dir, "contig_id.txt"), "w")
+        # column name -> [part file, dtype, length]
+        self._columns = {}
+        # coded column name -> dict value -> code, in order of first appearance
+        self._codes = {}
+        for name, dtype in self._column_types():
+            self._columns[name] = [open(self._path(name, ".npy.part"), "wb"), numpy.dtype(dtype), 0]
+            if dtype == numpy.int32:
+                self._codes[name] = {}
+
+    def _column_types(self):
+        yield "gene_count", numpy.int64
+        yield "consensus_taxonomy", numpy.int32
+        yield "consensus_taxonomy_frequency", numpy.float64
+        for input_cat in self.categories:
+            yield f"{input_cat}.non_hits", numpy.int64
+            yield f"{input_cat}.run", numpy.int64
+            yield f"{input_cat}.count", numpy.int64
+            yield f"{input_cat}.feature", numpy.int32
+
+    def _path(self, name: str, suffix: str) -> str:
+        return os.path.join(self.store_dir, f"{name}{suffix}")
+
+    def _append(self, name: str, values: numpy.ndarray):
+        column = self._columns[name]
+        column[0].write(numpy.ascontiguousarray(values, dtype=column[1]).tobytes())
+        column[2] += len(values)
+
+    def _append_coded(self, name: str, values: numpy.ndarray):
+        # codes are kept across chunks, so they're the same as factorizing the whole column
+        codes, uniques = pandas.factorize(values)
+        known = self._codes[name]
+        chunk_codes = numpy.array([known.setdefault(value, len(known)) for value in uniques.tolist()] + [-1], dtype=numpy.int32)
+        # code -1 (a missing value) picks the trailing -1
+        self._append(name, chunk_codes[codes])
+
+    def add(self, aggregates: ContigAggregates):
+        """
+        Appends the aggregates of the next chunk of the annotation file.
+        """
+        contigs = aggregates.contigs
+        _write_lines(self._contig_ids, contigs["contig_id"].tolist())
+        self._append("gene_count", contigs["gene_count"].to_numpy(dtype=numpy.int64))
+        self._append_coded("consensus_taxonomy", contigs["consensus_taxonomy"].to_numpy(dtype=object))
+        self._append("consensus_taxonomy_frequency", pandas.to_numeric(contigs["consensus_taxonomy_frequency"], errors="coerce").to_numpy(dtype=numpy.float64))
+        for input_cat in self.categories:
+            features = aggregates.features[input_cat]
+            self._append(f"{input_cat}.non_hits", aggregates.non_hits[input_cat])
+            self._append(f"{input_cat}.run", features["run"].to_numpy(dtype=numpy.int64) + self.contig_runs)
+            self._append(f"{input_cat}.count", features["count"].to_numpy(dtype=numpy.int64))
+            self._append_coded(f"{input_cat}.feature", features["feature"].to_numpy(dtype=object))
+        self.contig_runs += len(contigs)
+
+    def finish(self, input_annotation: str, taxonomy_consensus_threshold: float, go_obo: Optional[str] = None):
+        """
+        Writes out the .npy columns and value lists of the chunks added so far, then the
+        manifest.
+
+        :param input_annotation: annotation file the store was built from
+        :param taxonomy_consensus_threshold: threshold the consensus taxonomy was computed with
+        :param go_obo: OBO file the GO_propagated counts were rolled up with, if stored
+        """
+        self._contig_ids.close()
+        for name, (part, dtype, length) in self._columns.items():
+            part.close()
+            with open(self._path(name, ".npy"), "wb") as f:
+                numpy.lib.format.write_array_header_1_0(f, {"descr": numpy.lib.format.dtype_to_descr(dtype), "fortran_order": False, "shape": (length,)})
+                with open(part.name, "rb") as values:
+                    shutil.copyfileobj(values, f)
+            os.remove(part.name)
+        for name, codes in self._codes.items():
+            _write_strings(self._path(name, ".txt"), codes)
+        self._columns = {}
+        manifest = {
+            "version": STORE_VERSION,
+            "annotation": _source_key(input_annotation),
+            "taxonomy_consensus_threshold": taxonomy_consensus_threshold,
+            "categories": self.categories,
+            "contig_runs": self.contig_runs
+        }
+        if PROPAGATED_CATEGORY in self.categories:
+            manifest["go_obo"] = obo_key(go_obo)
+        with open(os.path.join(self.store_dir, MANIFEST), "w") as f:
+            json.dump(manifest, f, indent=1)
+
+    def close(self):
+        """
+        Closes and removes the .part files of an unfinished store.
+        """
+        self._contig_ids.close()
+        for part, _, _ in self._columns.values():
+            part.close()
+            os.remove(part.name)
+        self._columns = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def save_contig_store(store_dir: str, aggregates: ContigAggregates, categories: List[str], input_annotation: str, taxonomy_consensus_threshold: float, go_obo: Optional[str] = None):
+    """
+    Saves the per-contig aggregates of a whole annotation file to store_dir, replacing any
+    store already there (see ContigStoreWriter).
+    """
+    with ContigStoreWriter(store_dir, categories) as writer:
+        writer.add(aggregates)
+        writer.finish(input_annotation, taxonomy_consensus_threshold, go_obo)
+
+
+def load_contig_store(store_dir: str, categories: List[str]) -> ContigAggregates:
+    """
+    Loads the per-contig aggregates of the given categories from store_dir.
+
+    :raises ValueError: if there's no store in store_dir, or it's missing a category
+    """
+    manifest = read_store_manifest(store_dir)
+    if manifest is None:
+        raise ValueError(f"No contig store found in {store_dir}")
+    missing = [input_cat for input_cat in categories if input_cat not in manifest["categories"]]
+    if missing:
+        raise ValueError(f"The contig store in {store_dir} doesn't have the categories {', '.join(missing)}, only {', '.join(manifest['categories'])}")
+    frequency = numpy.load(os.path.join(store_dir, "consensus_taxonomy_frequency.npy")).astype(object)
+    frequency[pandas.isna(frequency)] = "NA"
+    contigs = pandas.DataFrame({
+        "contig_id": numpy.array(_read_strings(os.path.join(store_dir, "contig_id.txt")), dtype=object),
+        "gene_count": numpy.load(os.path.join(store_dir, "gene_count.npy")),
+        "consensus_taxonomy": pandas.Series(_load_coded(store_dir, "consensus_taxonomy"), dtype=object),
+        "consensus_taxonomy_frequency": pandas.Series(frequency, dtype=object)
+    })
+    non_hits = {}
+    features = {}
+    for input_cat in categories:
+        non_hits[input_cat] = numpy.load(os.path.join(store_dir, f"{input_cat}.non_hits.npy"))
+        features[input_cat] = pandas.DataFrame({
+            "run": numpy.load(os.path.join(store_dir, f"{input_cat}.run.npy")),
+            "feature": _load_coded(store_dir, f"{input_cat}.feature"),
+            "count": numpy.load(os.path.join(store_dir, f"{input_cat}.count.npy"))
+        })
+    return ContigAggregates(contigs, non_hits, features)
+
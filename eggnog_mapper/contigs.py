@@ -1,14 +1,209 @@
 """
 Tools for handling contigs and contig files
 """
-from Bio import SeqIO
+import csv
+import gzip
 import os
-from typing import Dict, Set
+import numpy
+import pandas
+from typing import IO, List, Mapping, Optional, Set, Tuple
+from interning import ContigValues
 
-def summarize_contig_lengths(input_fasta_path: str, output_path: str) -> Dict[str, int]:
+# bytes read from the FASTA file at a time
+BLOCK_SIZE = 1 << 22
+GZIP_MAGIC = b"\x1f\x8b"
+NEWLINE = ord("\n")
+# contig lengths are cached next to the FASTA file, see load_contig_lengths
+LENGTH_CACHE_SUFFIX = ".contig_lengths.tsv"
+
+
+def open_fasta(input_fasta_path: str) -> IO[bytes]:
+    """
+    Opens a FASTA file for binary reading, decompressing it if it's gzipped.
+    """
+    with open(input_fasta_path, "rb") as f:
+        magic = f.read(2)
+    if magic == GZIP_MAGIC:
+        return gzip.open(input_fasta_path, "rb")
+    return open(input_fasta_path, "rb")
+
+
+def _residue_count(block: bytes, start: int, end: int, plain: bool) -> int:
+    """
+    Counts the bytes in block[start:end] that aren't line breaks or spaces, without copying it.
+    If plain is True, the block is known to have no carriage returns or tabs.
+    """
+    count = end - start - block.count(b"\n", start, end)
+    # find is a fast memchr, only count the rarer characters if they're there
+    for char in (b" ",) if plain else (b" ", b"\r", b"\t"):
+        if block.find(char, start, end) >= 0:
+            count -= block.count(char, start, end)
+    return count
+
+
+def _record_id(header: bytes) -> str:
+    fields = header.split(None, 1)
+    return fields[0].decode() if fields else ""
+
+
+def scan_fasta_lengths(input_fasta_path: str, block_size: int = BLOCK_SIZE) -> Tuple[List[str], List[int]]:
+    """
+    Scans a (optionally gzipped) FASTA file for the length of each record, without building the
+    sequences.
+
+    The file is read in large binary blocks. Headers are found by searching for ">" at the start
+    of a line, and the residues between them are counted in place with bytes.count, so the work
+    per record is a handful of C-level calls no matter how long the sequence is. Only a header
+    line cut off by the end of a block is carried over to the next one.
+
+    As with Bio.SeqIO, the id is the header up to the first whitespace and line breaks and spaces
+    don't count towards the length. Anything before the first header is skipped.
+
+    :param input_fasta_path: Path to the input FASTA file
+    :param block_size: number of bytes to read at a time
+    :returns: tuple of (list of ids, list of lengths), in file order
+    """
+    headers = []
+    lengths = []
+    header = None       # header of the current record, None before the first one
+    length = 0          # residues of the current record so far
+    pending = b""       # start of a header line cut off at the end of the last block
+    at_line_start = True
+
+    with open_fasta(input_fasta_path) as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            if pending:
+                block = pending + block
+                pending = b""
+                at_line_start = True
+            plain = block.find(b"\r") < 0 and block.find(b"\t") < 0
+            pos = 0
+            while True:
+                start = block.find(b">", pos)
+                while start >= 0 and not (block[start - 1] == NEWLINE if start else at_line_start):
+                    start = block.find(b">", start + 1)
+                if header is not None:
+                    length += _residue_count(block, pos, start if start >= 0 else len(block), plain)
+                if start < 0:
+                    break
+                end = block.find(b"\n", start)
+                if end < 0:
+                    pending = block[start:]
+                    break
+                if header is not None:
+                    headers.append(header)
+                    lengths.append(length)
+                header = block[start + 1:end]
+                length = 0
+                pos = end + 1
+            at_line_start = block[-1] == NEWLINE
+    if pending:
+        # the file ends on a header line
+        if header is not None:
+            headers.append(header)
+            lengths.append(length)
+        header = pending[1:]
+        length = 0
+    if header is not None:
+        headers.append(header)
+        lengths.append(length)
+    return [_record_id(header) for header in headers], lengths
+
+
+def read_lengths_table(path: str, skip_rows: int = 0) -> ContigValues:
+    """
+    Reads contig id -> length from the first two tab-separated columns of a table, as in a
+    samtools .fai index or a contig length summary.
+    """
+    lengths = pandas.read_csv(
+        path,
+        sep="\t",
+        header=None,
+        usecols=[0, 1],
+        names=["contig_id", "length"],
+        dtype={"contig_id": str, "length": "int64"},
+        skiprows=skip_rows,
+        keep_default_na=False,
+        quoting=csv.QUOTE_NONE
+    )
+    return ContigValues.from_items(lengths["contig_id"].to_numpy(dtype=object), lengths["length"].to_numpy())
+
+
+def _write_lengths_table(path: str, contig_lengths: Mapping[str, int], first_line: str = ""):
+    ids, lengths = ContigValues.from_mapping(contig_lengths).to_arrays()
+    with open(path, "w") as f:
+        f.write(first_line + "".join(f"{name}\t{seq_len}\n" for name, seq_len in zip(ids.tolist(), lengths.tolist())))
+
+
+def _is_newer(path: str, than_path: str) -> bool:
+    return os.path.isfile(path) and os.stat(path).st_mtime_ns >= os.stat(than_path).st_mtime_ns
+
+
+def length_cache_path(input_fasta_path: str) -> str:
+    return input_fasta_path + LENGTH_CACHE_SUFFIX
+
+
+def _cache_key(input_fasta_path: str) -> str:
+    stat = os.stat(input_fasta_path)
+    return f"#contig_lengths\tsize={stat.st_size}\tmtime_ns={stat.st_mtime_ns}\n"
+
+
+def _read_length_cache(input_fasta_path: str) -> Optional[ContigValues]:
+    cache_path = length_cache_path(input_fasta_path)
+    try:
+        with open(cache_path) as f:
+            if f.readline() != _cache_key(input_fasta_path):
+                return None
+        return read_lengths_table(cache_path, skip_rows=1)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_length_cache(input_fasta_path: str, contig_lengths: ContigValues):
+    cache_path = length_cache_path(input_fasta_path)
+    tmp_path = f"{cache_path}.{os.getpid()}"
+    try:
+        _write_lengths_table(tmp_path, contig_lengths, _cache_key(input_fasta_path))
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        # e.g. a read-only assembly directory, the lengths just aren't cached
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def load_contig_lengths(input_fasta_path: str) -> Tuple[ContigValues, str]:
+    """
+    Gets the contig lengths of a FASTA file, from the first of these that's available:
+    1. a samtools index, <fasta>.fai, at least as new as the FASTA
+    2. the length cache, <fasta>.contig_lengths.tsv, written for the same FASTA size and mtime
+    3. a scan of the FASTA (see scan_fasta_lengths), which also writes the length cache
+
+    A contig length summary isn't used, as it's named after the sample prefix of the FASTA
+    file only, and doesn't record which FASTA file it was written for.
+
+    :param input_fasta_path: Path to the input FASTA file
+    :returns: tuple of (ContigValues contig id -> length, name of the source used: "fai",
+        "cache" or "fasta")
+    """
+    fai_path = input_fasta_path + ".fai"
+    if _is_newer(fai_path, input_fasta_path):
+        return read_lengths_table(fai_path), "fai"
+    contig_lengths = _read_length_cache(input_fasta_path)
+    if contig_lengths is not None:
+        return contig_lengths, "cache"
+    ids, lengths = scan_fasta_lengths(input_fasta_path)
+    contig_lengths = ContigValues.from_items(ids, numpy.array(lengths, dtype=numpy.int64))
+    _write_length_cache(input_fasta_path, contig_lengths)
+    return contig_lengths, "fasta"
+
+
+def summarize_contig_lengths(input_fasta_path: str, output_path: Optional[str]) -> ContigValues:
     """
-    Given a FASTA file path, this opens the file, reads all FASTA strings, and returns
-    a dictionary with the ids mapped to the length of the FASTA feature.
+    Given a FASTA file path, this returns a mapping of the ids to the length of the FASTA
+    feature. Gzipped files are supported.
 
     e.g. a file:
     > foo
@@ -16,7 +211,7 @@ def summarize_contig_lengths(input_fasta_path: str, output_path: str) -> Dict[st
     > bar
     AAGGCCTT
 
-    would return the dict:
+    would return the mapping:
     {
         foo: 6,
         bar: 8
@@ -24,37 +219,33 @@ def summarize_contig_lengths(input_fasta_path: str, output_path: str) -> Dict[st
 
     Note that this assumes unique ids in the FASTA file.
 
-    This also prints out the results to the given output_path file, overwriting it if
-    already present.
+    The ids are interned into the ContigIndex of the returned ContigValues, which the coverages
+    and contig filters are then placed on (see interning).
+
+    The FASTA file is only scanned if the lengths aren't already available from a samtools
+    .fai index or the length cache (see load_contig_lengths), so repeated runs on the same
+    assembly skip the scan.
+
+    This also prints out the results to the given output_path file in a single write,
+    overwriting it if already present, unless output_path is None.
 
     :param input_fasta_path: Path to the input FASTA file
-    :param output_path: Path to the output file
-    :returns: dict (string -> int) as described above.
-    """
-    fasta_file = open(input_fasta_path, 'r')
-    contig_lengths = {}
-
-    with open(output_path, "w") as f:
-        for rec in SeqIO.parse(fasta_file, 'fasta'):
-            name = rec.id
-            seq_len = len(rec)
-            contig_lengths[name] = seq_len
-            f.write("{}\t{}\n".format(name, seq_len))
-    fasta_file.close()
+    :param output_path: Path to the output file, or None
+    :returns: ContigValues (string -> int) as described above.
+    """
+    contig_lengths = load_contig_lengths(input_fasta_path)[0]
+    if output_path is not None:
+        _write_lengths_table(output_path, contig_lengths)
     return contig_lengths
 
-def filter_contig_lengths(contig_lengths: Dict[str, int], min_contig_length: int) -> Set[str]:
+def filter_contig_lengths(contig_lengths: Mapping[str, int], min_contig_length: int) -> Set[str]:
     """
     Returns a Set of contig ids that fall below the minimum contig length.
     These would, conceivably, be removed from further analyses.
 
-    :param contig_lengths: dict mapping from contig id -> int
+    :param contig_lengths: mapping from contig id -> int
     :param min_contig_length: the minimum contig length to pass the filter
     :returns: Set of contig id strings
     """
-    filtered_contigs = set()
-    for contig_id, contig_length in contig_lengths.items():
-        if contig_length < min_contig_length:
-            filtered_contigs.add(contig_id)
-    return filtered_contigs
-
+    ids, lengths = ContigValues.from_mapping(contig_lengths).to_arrays()
+    return set(ids[lengths < min_contig_length].tolist())
@@ -0,0 +1,98 @@
+"""
+Running feature totals, accumulated one contig at a time.
+"""
+import numpy
+from typing import Dict, Union
+from interning import Vocabulary
+
+Number = Union[int, float]
+
+
+class FeatureCounts:
+    """
+    Accumulates feature counts over contigs in place.
+
+    Each feature is interned once into an integer id, and the totals are kept in a dense
+    array indexed by that id, so adding a contig only touches the features on that contig.
+
+    The output of to_dict() is ordered the same way as a running sum of Counters, where the
+    totals so far are added to each new contig's counts (newest_contig + totals): features
+    seen on later contigs come first, and features last seen on the same contig keep their
+    order of appearance on it. Features with a total of zero or less are dropped.
+    """
+    def __init__(self):
+        self._vocabulary = Vocabulary()
+        self._totals = numpy.zeros(1024, dtype=numpy.int64)
+        self._last_contig = numpy.zeros(1024, dtype=numpy.int64)
+        self._last_position = numpy.zeros(1024, dtype=numpy.int64)
+        self._contigs_added = 0
+        self._positions_added = 0
+
+    def __len__(self):
+        return len(self._vocabulary)
+
+    def _grow(self):
+        # makes room in the arrays for every feature in the vocabulary
+        if len(self._vocabulary) > len(self._totals):
+            new_size = max(len(self._vocabulary), 2 * len(self._totals))
+            for name in ("_totals", "_last_contig", "_last_position"):
+                old = getattr(self, name)
+                grown = numpy.zeros(new_size, dtype=old.dtype)
+                grown[:len(old)] = old
+                setattr(self, name, grown)
+
+    def _add_totals(self, ids: numpy.ndarray, counts: numpy.ndarray):
+        if counts.dtype.kind == "f" and self._totals.dtype.kind != "f":
+            self._totals = self._totals.astype(numpy.float64)
+        numpy.add.at(self._totals, ids, counts)
+
+    def add(self, contig_counts: Dict[str, Number]):
+        """
+        Adds the feature counts of a single contig.
+
+        :param contig_counts: dict feature -> count, in order of appearance on the contig
+        """
+        if not contig_counts:
+            self._contigs_added += 1
+            return
+        ids = self._vocabulary.intern(contig_counts.keys())
+        self._grow()
+        self._add_totals(ids, numpy.asarray(list(contig_counts.values())))
+        self._last_contig[ids] = self._contigs_added
+        self._last_position[ids] = numpy.arange(self._positions_added, self._positions_added + len(ids))
+        self._contigs_added += 1
+        self._positions_added += len(ids)
+
+    def add_contigs(self, contigs: numpy.ndarray, features: numpy.ndarray, counts: numpy.ndarray):
+        """
+        Adds the feature counts of a batch of contigs at once.
+
+        :param contigs: contig number of each entry, non-decreasing and counted from 0 at the
+            start of the batch
+        :param features: feature of each entry, in order of appearance within each contig
+        :param counts: count of each entry
+        """
+        if len(features) == 0:
+            return
+        ids = self._vocabulary.intern_array(features)
+        self._grow()
+        self._add_totals(ids, numpy.asarray(counts))
+        # only the last entry for each feature decides its output position
+        reversed_ids = ids[::-1]
+        _, last_in_reversed = numpy.unique(reversed_ids, return_index=True)
+        last = len(ids) - 1 - last_in_reversed
+        self._last_contig[ids[last]] = self._contigs_added + contigs[last]
+        self._last_position[ids[last]] = self._positions_added + last
+        self._contigs_added += int(contigs[-1]) + 1
+        self._positions_added += len(ids)
+
+    def to_dict(self) -> Dict[str, Number]:
+        """
+        Returns the totals as an ordered dict of feature -> total.
+        """
+        n = len(self._vocabulary)
+        totals = self._totals[:n]
+        order = numpy.lexsort((self._last_position[:n], -self._last_contig[:n]))
+        order = order[totals[order] > 0]
+        features = self._vocabulary.items
+        return {features[i]: total for i, total in zip(order.tolist(), totals[order].tolist())}
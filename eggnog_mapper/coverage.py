@@ -0,0 +1,71 @@
+"""
+Tools for reading contig coverage files
+"""
+import csv
+import numpy
+import pandas
+from typing import Mapping, Union
+from interning import ContigValues
+from util import isfloat
+
+Number = Union[int, float]
+
+
+class ContigCoverages(ContigValues):
+    """
+    A read-only mapping from contig id to coverage.
+
+    The coverages are kept in a typed array indexed by contig code (see interning): int64 if
+    every coverage in the file is a whole number, float64 otherwise. Use lookup() or take() to
+    get the coverages of many contigs at once.
+    """
+    @classmethod
+    def from_dict(cls, coverages: Mapping[str, Number]) -> "ContigCoverages":
+        if isinstance(coverages, ContigValues):
+            return coverages
+        return cls.from_mapping(coverages)
+
+    def below(self, min_contig_coverage: Number) -> numpy.ndarray:
+        """
+        Returns the ids of the contigs with a coverage below min_contig_coverage.
+        """
+        low = self.values < min_contig_coverage
+        if self.present is not None:
+            low &= self.present
+        return self.index.ids[low].to_numpy(dtype=object)
+
+
+def load_coverages(input_coverage_file: str) -> ContigCoverages:
+    """
+    Reads a tab-separated coverage file of contig id and coverage in one bulk parse. Coverages
+    can be whole numbers or fractional (e.g. mean depths). Any extra columns are ignored, as is
+    a header line, which is recognized by a coverage column that isn't a number. If a contig
+    is listed more than once, the last coverage is used.
+
+    :param input_coverage_file: coverage file path
+    :returns: ContigCoverages
+    :raises ValueError: if a coverage isn't a number
+    """
+    with open(input_coverage_file) as f:
+        first_line = f.readline().rstrip("\r\n").split("\t")
+    has_header = len(first_line) > 1 and not isfloat(first_line[1])
+    try:
+        table = pandas.read_csv(
+            input_coverage_file,
+            sep="\t",
+            header=None,
+            skiprows=1 if has_header else 0,
+            usecols=[0, 1],
+            names=["contig_id", "coverage"],
+            dtype={"contig_id": object},
+            keep_default_na=False,
+            quoting=csv.QUOTE_NONE
+        )
+    except pandas.errors.EmptyDataError:
+        return ContigCoverages.from_dict({})
+    if table.empty:
+        return ContigCoverages.from_dict({})
+    if table["coverage"].dtype.kind not in "iuf":
+        bad = table["coverage"][pandas.to_numeric(table["coverage"], errors="coerce").isna()].iloc[0]
+        raise ValueError(f"{input_coverage_file}: coverage {bad!r} isn't a number")
+    return ContigCoverages.from_items(table["contig_id"].to_numpy(dtype=object), table["coverage"].to_numpy())
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+"""
+Batch entry point for summarizing many metagenomes at once.
+
+Takes a manifest of samples, counts the requested eggNOG categories for each sample in a
+process pool, and writes one sparse feature x sample table per category (and per GO
+cross-reference namespace). Shared resources, such as the GO cross-reference tables, are only
+loaded once.
+
+The manifest is a tab-separated file with one sample per line:
+    annotation_file  coverage_file  contig_fasta  [sample_id]
+Relative paths are taken relative to the manifest. Use NULL for a missing coverage file, only
+allowed without --use_cov and with a --min_contig_coverage of 0. If the sample id is left out, it's taken from the annotation file name (the part before the first "_").
+Blank lines and lines starting with "#" are skipped.
+"""
+import os
+import sys
+import time
+import argparse
+import itertools
+from argparse import RawTextHelpFormatter
+import metrics
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, NamedTuple
+from go_xref import GO_Xrefs
+from counts import FeatureCounts
+from aggregate import (
+    summarize_chunks,
+    Threshold
+)
+from annotations import read_annotation_chunks
+from contigs import summarize_contig_lengths
+from interning import (
+    ContigSet,
+    ContigValues
+)
+from feature_matrix import (
+    FeatureMatrix,
+    MATRIX_FORMATS
+)
+from eggnog_to_feature_table import (
+    GO_CATEGORIES,
+    add_propagated_category,
+    import_coverage_data,
+    load_propagation_closure,
+    _add_summary_arguments,
+    INPUT_CATEGORY_OPTIONS
+)
+
+
+class Sample(NamedTuple):
+    sample_id: str
+    annotation: str
+    coverage: str
+    fasta: str
+
+
+def read_manifest(manifest_path: str) -> List[Sample]:
+    """
+    Reads the sample manifest, see the module docstring for the format.
+
+    :param manifest_path: path to the manifest file
+    :returns: list of Samples
+    """
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+
+    def resolve(path):
+        return path if path == "NULL" else os.path.join(base_dir, path)
+
+    samples = []
+    with open(manifest_path) as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            row = line.split("\t")
+            if len(row) not in (3, 4):
+                raise ValueError(f"{manifest_path} line {line_number}: expected 3 or 4 tab-separated columns, found {len(row)}")
+            sample_id = row[3] if len(row) == 4 else os.path.basename(row[0]).split("_")[0]
+            samples.append(Sample(sample_id, resolve(row[0]), resolve(row[1]), resolve(row[2])))
+    sample_ids = [sample.sample_id for sample in samples]
+    if len(set(sample_ids)) != len(sample_ids):
+        raise ValueError(f"{manifest_path}: sample ids must be unique")
+    return samples
+
+
+def check_sample_coverage(sample: Sample, args: argparse.Namespace):
+    """
+    Checks that a sample without a coverage file (NULL) isn't summarized with options that need
+    coverages.
+
+    :raises ValueError: naming the sample, if it has no coverage file and --use_cov or a
+        --min_contig_coverage above 0 is used
+    """
+    if sample.coverage == "NULL" and (args.use_coverage or max(args.min_contig_coverage) > 0):
+        raise ValueError(f"Sample {sample.sample_id} has no coverage file (NULL), which can't be used with --use_cov or a --min_contig_coverage above 0")
+
+
+def summarize_sample(sample: Sample, cat_options: List[str], args: argparse.Namespace, go_closure=None) -> Dict[Threshold, Dict[str, Dict[str, float]]]:
+    """
+    Counts the features of every requested category in one sample, using the columnar engine.
+    The sample is aggregated once, and counted for every combination of the length and
+    coverage thresholds.
+
+    :param go_closure: go_ontology.GOClosure, needed for the GO_propagated category
+
+    :raises ValueError: if the sample has no coverage file and coverages are needed, see
+        check_sample_coverage
+    :returns: dict (min_contig_length, min_contig_coverage) -> dict category -> dict feature ->
+        (weighted) count
+    """
+    check_sample_coverage(sample, args)
+    thresholds = list(itertools.product(args.min_contig_length, args.min_contig_coverage))
+    with metrics.stage("fasta_lengths"):
+        contig_lengths = summarize_contig_lengths(sample.fasta, None)
+    if sample.coverage == "NULL":
+        coverages = {}
+    else:
+        coverages, _ = import_coverage_data(args.use_coverage, sample.coverage, "NULL", max(args.min_contig_coverage), False)
+    _, contig_import_filter = import_coverage_data(False, sample.coverage, args.contig_filter, 0, args.verbose)
+    # the coverages and filters share the ContigIndex of the assembly
+    coverages = ContigValues.from_mapping(coverages, contig_lengths.index)
+    contigs_allowed = ContigSet.all(contig_lengths.index) - contig_import_filter
+    cov_method = "weighted" if args.use_coverage else "unweighted"
+
+    feature_counts = {threshold: {cat: FeatureCounts() for cat in cat_options} for threshold in thresholds}
+    annotation_chunks = metrics.timed(read_annotation_chunks(sample.annotation, cat_options, args.chunk_size, args.taxonomy_consensus_threshold is not None, args.annotation_parser), "annotation_import")
+    for chunk_results in metrics.timed(summarize_chunks(annotation_chunks, cat_options, cov_method, coverages, contigs_allowed, contig_lengths, args.taxonomy_consensus_threshold, thresholds=thresholds, go_closure=go_closure), "aggregate"):
+        for threshold, (_, chunk_feature_counts, _) in zip(thresholds, chunk_results):
+            for cat in cat_options:
+                feature_counts[threshold][cat].add_contigs(*chunk_feature_counts[cat])
+    return {
+        threshold: {cat: counts.to_dict() for cat, counts in threshold_counts.items()}
+        for threshold, threshold_counts in feature_counts.items()
+    }
+
+
+def run_batch(args: argparse.Namespace) -> int:
+    return metrics.record_run(_run_batch, args)
+
+
+def _run_batch(args: argparse.Namespace) -> int:
+    """
+    Summarizes every sample in the manifest and writes the feature x sample tables. With more
+    than one process, the per-sample stages run in the workers and only show up in the run
+    metrics as the aggregate stage.
+    """
+    starttime = time.time()
+    if args.input_cat != "ALL_CATEGORIES" and args.input_cat not in INPUT_CATEGORY_OPTIONS:
+        sys.exit("Bad category selection, please review options. Exiting...")
+    if args.binary_output == "Yes":
+        args.use_coverage = False
+    cat_options = INPUT_CATEGORY_OPTIONS if args.input_cat == "ALL_CATEGORIES" else [args.input_cat]
+    cat_options = add_propagated_category(cat_options, args.go_obo)
+    # compiled (and cached) once here, the workers memory-map the cached closure
+    go_closure = load_propagation_closure(args.go_obo, cat_options)
+    samples = read_manifest(args.manifest)
+    # checked before any sample is summarized, so one bad sample doesn't fail the pool midway
+    try:
+        for sample in samples:
+            check_sample_coverage(sample, args)
+    except ValueError as e:
+        sys.exit(str(e))
+    print(f"Summarizing {len(samples)} samples with {args.processes} process(es)")
+
+    if args.processes > 1:
+        with ProcessPoolExecutor(max_workers=args.processes) as executor, metrics.stage("aggregate"):
+            futures = [executor.submit(summarize_sample, sample, cat_options, args, go_closure) for sample in samples]
+            sample_counts = [future.result() for future in futures]
+    else:
+        sample_counts = [summarize_sample(sample, cat_options, args, go_closure) for sample in samples]
+
+    method = "binary" if args.binary_output == "Yes" else ("weighted" if args.use_coverage else "unweighted")
+    sample_ids = [sample.sample_id for sample in samples]
+    go_xrefs = GO_Xrefs().xrefs if "GO" in cat_options and args.make_go_xref == "Yes" else None
+    for min_contig_length, min_contig_coverage in sample_counts[0].keys() if sample_counts else []:
+        output_prefix = f"{args.output_prefix}_len{min_contig_length}_cov{min_contig_coverage}"
+        for cat in cat_options:
+            matrix = FeatureMatrix.from_sample_counts([counts[(min_contig_length, min_contig_coverage)][cat] for counts in sample_counts], sample_ids)
+            tables = {f"{cat}_{method}_direct": matrix}
+            if cat in GO_CATEGORIES and go_xrefs is not None:
+                # all samples and namespaces are projected in one sparse product
+                with metrics.stage("xref_load"):
+                    projector = go_xrefs.projector
+                with metrics.stage("xref_projection"):
+                    projected = projector.project(matrix.features, matrix.counts)
+                for xref, (x_refs, x_ref_counts) in projected.items():
+                    tables[f"{cat}_{method}_{xref}"] = FeatureMatrix(x_refs, sample_ids, x_ref_counts.tocsr())
+            for name, table in tables.items():
+                if method == "binary":
+                    table = table.binary()
+                with metrics.stage("export"):
+                    paths = table.write(f"{output_prefix}_{name}_count_matrix", args.batch_format)
+                for path in paths:
+                    print(f"Wrote {path}")
+    print("Batch ran in %s seconds." % round((time.time() - starttime), 2))
+    return 0
+
+
+def _get_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="eggnog_batch",
+        description="eggnog_batch summarizes the eggnog mapper output of many samples into sparse feature x sample tables.",
+        formatter_class=RawTextHelpFormatter
+    )
+    parser.add_argument("--manifest", dest="manifest", required=True, help="Indicate the tab-separated sample manifest: annotation_file, coverage_file, contig_fasta and an optional sample_id per line.")
+    parser.add_argument("--output_prefix", dest="output_prefix", default="batch", help="Indicate the prefix of the output files. (default: batch)")
+    parser.add_argument("--batch_format", dest="batch_format", default="mtx", choices=MATRIX_FORMATS, help="Indicate the output format of the feature x sample tables. 'mtx' writes Matrix Market files, 'parquet' and 'hdf5' write long tables of the non-zero counts. (default: mtx)")
+    _add_summary_arguments(parser)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    sys.exit(run_batch(_get_args()))
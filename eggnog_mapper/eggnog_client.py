@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+"""
+Thin client of the mapper service (see eggnog_service.py), and a drop-in replacement for
+eggnog_to_feature_table.py:
+
+    eggnog_client.py -i 1234_sample.annotations --input_cov 1234_cov.tsv --input_contig_fasta 1234_contigs.fa --use_cov
+
+The arguments are sent to the service along with the current directory, so relative paths
+and the output files work as with eggnog_to_feature_table.py. The client prints the job's
+output and exits with its exit code. If no service is listening on the socket, or the
+annotations are read from standard input or a named pipe (which the service's workers can't
+read), the mapper is run in this process instead.
+
+The client only imports the standard library, so starting it is cheap.
+"""
+import os
+import sys
+import json
+import stat
+import socket
+import struct
+import tempfile
+from typing import Dict, List, Optional
+
+# set EGGNOG_MAPPER_SOCKET to use another socket
+SOCKET_ENV = "EGGNOG_MAPPER_SOCKET"
+SOCKET_NAME = "mapper.sock"
+
+
+def default_socket_path() -> str:
+    """
+    Returns the socket in the user's private runtime directory, $XDG_RUNTIME_DIR/eggnog_mapper,
+    or <temporary directory>/eggnog_mapper-<uid> without one, unless EGGNOG_MAPPER_SOCKET is
+    set. The service creates the directory, readable by the current user only.
+    """
+    if os.environ.get(SOCKET_ENV):
+        return os.environ[SOCKET_ENV]
+    if os.environ.get("XDG_RUNTIME_DIR"):
+        return os.path.join(os.environ["XDG_RUNTIME_DIR"], "eggnog_mapper", SOCKET_NAME)
+    uid = os.getuid() if hasattr(os, "getuid") else "user"
+    return os.path.join(tempfile.gettempdir(), f"eggnog_mapper-{uid}", SOCKET_NAME)
+
+
+def peer_uid(connection: socket.socket) -> Optional[int]:
+    """
+    Returns the user id of the process at the other end of a Unix socket connection, or None
+    where SO_PEERCRED isn't available.
+    """
+    if not hasattr(socket, "SO_PEERCRED"):
+        return None
+    credentials = connection.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+    return struct.unpack("3i", credentials)[1]
+
+
+def is_own_peer(connection: socket.socket) -> bool:
+    """
+    Returns True if the other end of the connection runs as the current user (or can't be
+    checked).
+    """
+    uid = peer_uid(connection)
+    return uid is None or uid == os.getuid()
+
+
+def send_message(connection: socket.socket, message: Dict):
+    connection.sendall(json.dumps(message).encode("utf-8") + b"\n")
+
+
+def receive_message(connection: socket.socket) -> Dict:
+    """
+    Reads one newline-terminated JSON message.
+
+    :raises ConnectionError: if the connection is closed before a whole message is read
+    """
+    chunks = []
+    while True:
+        chunk = connection.recv(65536)
+        if not chunk:
+            raise ConnectionError("Connection closed before a complete message was received")
+        chunks.append(chunk)
+        if chunk.endswith(b"\n"):
+            return json.loads(b"".join(chunks))
+
+
+def request(socket_path: str, message: Dict) -> Dict:
+    """
+    Sends a request to the service and waits for its response.
+
+    :raises OSError: if there's no service listening on socket_path
+    :raises PermissionError: if the service listening on socket_path runs as another user
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(socket_path)
+        if not is_own_peer(connection):
+            raise PermissionError(f"The service on {socket_path} runs as another user, not sending it the job")
+        send_message(connection, message)
+        return receive_message(connection)
+
+
+def submit_job(argv: List[str], cwd: str = None, socket_path: str = None) -> Dict:
+    """
+    Runs the mapper with the given command line arguments on the service.
+
+    :param argv: eggnog_to_feature_table.py arguments
+    :param cwd: directory the job runs in, the current directory by default
+    :returns: dict with the job's exit_code, stdout, stderr, outputs (paths of the tables
+        written) and metrics (run metrics report, see metrics.py)
+    """
+    return request(socket_path or default_socket_path(), {"command": "run", "argv": argv, "cwd": cwd or os.getcwd()})
+
+
+def _input_annotation(argv: List[str]) -> str:
+    # the -i argument, or None
+    for i, arg in enumerate(argv):
+        if arg == "-i":
+            return argv[i + 1] if i + 1 < len(argv) else None
+        if arg.startswith("-i") and not arg.startswith("--"):
+            return arg[2:]
+    return None
+
+
+def reads_stream(argv: List[str], cwd: str = None) -> bool:
+    """
+    Returns True if the job reads its annotations from standard input or a named pipe. Those
+    can only be read by this process: the workers' standard input isn't the client's, and a pipe
+    such as bash's <(...) only exists for the client.
+    """
+    input_annotation = _input_annotation(argv)
+    if input_annotation is None:
+        return False
+    if input_annotation == "-":
+        return True
+    try:
+        return stat.S_ISFIFO(os.stat(os.path.join(cwd or os.getcwd(), input_annotation)).st_mode)
+    except OSError:
+        return False
+
+
+def _run_locally(argv: List[str]) -> int:
+    from eggnog_to_feature_table import run_mapper, _get_args
+    return run_mapper(_get_args(argv))
+
+
+def main(argv: List[str] = None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    if reads_stream(argv):
+        return _run_locally(argv)
+    try:
+        response = submit_job(argv)
+    except (FileNotFoundError, ConnectionRefusedError):
+        # no service running
+        return _run_locally(argv)
+    except PermissionError as e:
+        sys.exit(str(e))
+    sys.stdout.write(response["stdout"])
+    sys.stderr.write(response["stderr"])
+    return response["exit_code"]
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+"""
+Long-lived mapper service, for running many jobs without paying for interpreter start-up,
+imports and reference data loading on every run.
+
+    eggnog_service.py --workers 4 &
+    eggnog_client.py -i 1234_sample.annotations --input_contig_fasta 1234_contigs.fa ...
+
+The service listens on a Unix socket and runs each job in a pool of worker processes. The
+workers import the mapper once, and keep the GO cross-reference tables and their projector
+loaded between jobs (they are reloaded if a .clean file or packed table changes). A worker
+runs one job at a time, in the directory the client was started from, so a job writes the
+same files as eggnog_to_feature_table.py run there.
+
+Only the current user can use the service: the socket is created without permissions for
+other users, in a directory only the current user can write to (see
+eggnog_client.default_socket_path), and connections from processes of other users are
+dropped.
+
+Protocol: the client sends one JSON line, the service answers with one JSON line.
+    {"command": "run", "argv": [...], "cwd": "/data/run1"}
+        -> {"exit_code": 0, "stdout": "...", "stderr": "...", "outputs": [...], "metrics": {...}}
+    {"command": "ping"} -> {"status": "ok", "workers": 4}
+argv takes the same options as eggnog_to_feature_table.py, outputs are the paths of the tables
+written and metrics is the run metrics report (see metrics.py).
+"""
+import io
+import os
+import sys
+import stat
+import signal
+import argparse
+import traceback
+import socketserver
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout, redirect_stderr
+from typing import Dict, List
+import metrics
+from go_xref import GO_Xrefs
+from eggnog_client import (
+    default_socket_path,
+    is_own_peer,
+    receive_message,
+    request,
+    send_message
+)
+from eggnog_to_feature_table import (
+    _get_args as _get_mapper_args,
+    _run_mapper
+)
+
+
+def _warm_worker():
+    # runs once in each worker process, loads the reference data jobs share
+    try:
+        GO_Xrefs().xrefs.projector
+    except OSError:
+        # no cross-reference tables, jobs that need them will fail as they would on their own
+        pass
+
+
+def _worker_ready(_) -> int:
+    return os.getpid()
+
+
+def _exit_code(exit: SystemExit) -> int:
+    # sys.exit("message") prints the message and exits with 1, like the interpreter does
+    if exit.code is None:
+        return 0
+    if isinstance(exit.code, int):
+        return exit.code
+    print(exit.code, file=sys.stderr)
+    return 1
+
+
+def run_job(argv: List[str], cwd: str) -> Dict:
+    """
+    Runs the mapper with the given arguments in cwd, capturing its output. Called in a worker
+    process, which only runs one job at a time.
+
+    :returns: dict with exit_code, stdout, stderr, outputs and metrics, see the module docstring
+    """
+    stdout, stderr = io.StringIO(), io.StringIO()
+    run_metrics = metrics.Metrics()
+    exit_code = 1
+    with redirect_stdout(stdout), redirect_stderr(stderr):
+        try:
+            os.chdir(cwd)
+            exit_code = metrics.record_run(_run_mapper, _get_mapper_args(argv), run_metrics)
+        except SystemExit as e:
+            exit_code = _exit_code(e)
+        except Exception:
+            traceback.print_exc()
+    report = run_metrics.report()
+    return {
+        "exit_code": exit_code,
+        "stdout": stdout.getvalue(),
+        "stderr": stderr.getvalue(),
+        "outputs": [os.path.join(cwd, path) for path in report["outputs"]],
+        "metrics": report
+    }
+
+
+class _JobHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            message = receive_message(self.request)
+        except (ConnectionError, ValueError):
+            return
+        command = message.get("command")
+        if command == "ping":
+            response = {"status": "ok", "workers": self.server.workers}
+        elif command == "run":
+            try:
+                response = self.server.executor.submit(run_job, list(message["argv"]), message["cwd"]).result()
+            except Exception as e:
+                # e.g. a worker process died
+                response = {"exit_code": 1, "stdout": "", "stderr": f"Job failed in the service: {e!r}\n", "outputs": [], "metrics": None}
+        else:
+            response = {"error": f"Unknown command {command}"}
+        send_message(self.request, response)
+
+
+class MapperService(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Unix socket server that hands jobs to a pool of warm worker processes. Each connection is
+    handled in its own thread, so up to `workers` jobs run at once and the rest wait for a
+    free worker.
+    """
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, workers: int = 1):
+        """
+        :raises RuntimeError: if the socket's directory can be written to by other users
+        """
+        private_socket_directory(os.path.dirname(os.path.abspath(socket_path)))
+        self.workers = workers
+        self.executor = ProcessPoolExecutor(max_workers=workers, initializer=_warm_worker)
+        # start (and warm) the workers before any connection threads exist
+        list(self.executor.map(_worker_ready, range(workers)))
+        super().__init__(socket_path, _JobHandler)
+
+    def server_bind(self):
+        # the socket is created with no permissions for other users, rather than restricted
+        # after it's already reachable
+        umask = os.umask(0o177)
+        try:
+            super().server_bind()
+        finally:
+            os.umask(umask)
+
+    def verify_request(self, request, client_address) -> bool:
+        return is_own_peer(request)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown()
+        if _is_own_socket(self.server_address):
+            os.remove(self.server_address)
+
+
+def private_socket_directory(directory: str):
+    """
+    Creates the socket directory, readable by the current user only, or checks that an
+    existing one belongs to the current user and can't be written to by others, so no other
+    user can replace the socket.
+
+    :raises RuntimeError: if the directory isn't safe to put the socket in
+    """
+    try:
+        os.mkdir(directory, 0o700)
+        return
+    except FileExistsError:
+        pass
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o022:
+        raise RuntimeError(f"{directory} isn't a directory of the current user that only they can write to, not putting the service socket in it")
+
+
+def _is_own_socket(path: str) -> bool:
+    try:
+        info = os.lstat(path)
+    except FileNotFoundError:
+        return False
+    return stat.S_ISSOCK(info.st_mode) and info.st_uid == os.getuid()
+
+
+def _remove_stale_socket(socket_path: str):
+    """
+    Removes a socket file left behind by a service that's no longer running.
+
+    :raises RuntimeError: if a service is still listening on it, or the path isn't a socket of
+        the current user
+    """
+    if not os.path.lexists(socket_path):
+        return
+    if not _is_own_socket(socket_path):
+        raise RuntimeError(f"{socket_path} isn't a socket of the current user, not removing it")
+    try:
+        request(socket_path, {"command": "ping"})
+    except (ConnectionError, OSError):
+        os.remove(socket_path)
+        return
+    raise RuntimeError(f"A service is already listening on {socket_path}")
+
+
+def _stop(signum, frame):
+    raise KeyboardInterrupt
+
+
+def _get_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="eggnog_service",
+        description="eggnog_service runs eggnog_to_feature_table jobs sent by eggnog_client.py in a pool of warm worker processes."
+    )
+    parser.add_argument("--socket", dest="socket", default=default_socket_path(), help="Indicate the Unix socket to listen on, in a directory only the current user can write to. The client uses the same default, or the EGGNOG_MAPPER_SOCKET environment variable. (default: %(default)s)")
+    parser.add_argument("--workers", dest="workers", default=os.cpu_count() or 1, type=int, help="Indicate the number of jobs to run at once, each in its own worker process. (default: number of CPUs)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = _get_args(argv)
+    try:
+        _remove_stale_socket(args.socket)
+    except RuntimeError as e:
+        sys.exit(str(e))
+    signal.signal(signal.SIGTERM, _stop)
+    try:
+        service = MapperService(args.socket, args.workers)
+    except RuntimeError as e:
+        sys.exit(str(e))
+    with service:
+        print(f"Listening on {args.socket} with {args.workers} worker(s)", flush=True)
+        try:
+            service.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+"""
+Rebuilds count tables from a contig store (see contig_store.py), without reading the
+annotation file again.
+
+    eggnog_store.py info --store 1234_contig_store
+    eggnog_store.py rebuild --store 1234_contig_store --input_contig_fasta 1234_contigs.fa --input_cov 1234_cov.tsv --use_cov --binary Yes ...
+
+The rebuild subcommand takes the same summary options as eggnog_to_feature_table.py, and
+writes the same tables to the current directory.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from argparse import RawTextHelpFormatter
+import metrics
+from contigs import summarize_contig_lengths
+from contig_store import (
+    read_store_manifest,
+    load_contig_store,
+    store_is_current
+)
+from output import check_output_format
+from eggnog_to_feature_table import (
+    add_propagated_category,
+    write_count_tables,
+    _add_output_arguments,
+    _add_summary_arguments,
+    INPUT_CATEGORY_OPTIONS
+)
+
+
+def store_info(args: argparse.Namespace) -> int:
+    manifest = read_store_manifest(args.store)
+    if manifest is None:
+        sys.exit(f"No contig store found in {args.store}")
+    print(json.dumps(manifest, indent=1))
+    return 0
+
+
+def rebuild_tables(args: argparse.Namespace) -> int:
+    return metrics.record_run(_rebuild_tables, args)
+
+
+def _rebuild_tables(args: argparse.Namespace) -> int:
+    starttime = time.time()
+    manifest = read_store_manifest(args.store)
+    if manifest is None:
+        sys.exit(f"No contig store found in {args.store}")
+    if args.binary_output == "Yes":
+        args.use_coverage = False
+    if args.input_cat == "ALL_CATEGORIES":
+        cat_options = [cat for cat in INPUT_CATEGORY_OPTIONS if cat in manifest["categories"]]
+    elif args.input_cat in INPUT_CATEGORY_OPTIONS:
+        cat_options = [args.input_cat]
+    else:
+        sys.exit("Bad category selection, please review options. Exiting...")
+    # the GO_propagated counts are stored, so the OBO file is only checked to be unchanged
+    cat_options = add_propagated_category(cat_options, args.go_obo)
+    try:
+        check_output_format(args.output_format)
+    except ValueError as e:
+        sys.exit(str(e))
+    if args.taxonomy_consensus_threshold != manifest["taxonomy_consensus_threshold"]:
+        sys.exit(f"The store was built with a contig taxonomy threshold of {manifest['taxonomy_consensus_threshold']}, rerun eggnog_to_feature_table.py with --contig_store to change it.")
+
+    # the annotation file isn't needed, but if it's still there it shouldn't have changed
+    input_annotation = manifest["annotation"]["path"]
+    if os.path.exists(input_annotation) and not store_is_current(args.store, input_annotation, cat_options, args.taxonomy_consensus_threshold, args.go_obo):
+        sys.exit(f"{input_annotation} or the GO ontology has changed since the store was built, rerun eggnog_to_feature_table.py with --contig_store to update it.")
+    try:
+        with metrics.stage("annotation_import"):
+            aggregates = load_contig_store(args.store, cat_options)
+    except ValueError as e:
+        sys.exit(str(e))
+
+    input_fasta_prefix = os.path.basename(args.input_contig_fasta).split("_")[0]
+    with metrics.stage("fasta_lengths"):
+        contig_lengths = summarize_contig_lengths(args.input_contig_fasta, os.path.join(os.getcwd(), f"{input_fasta_prefix}_contig_length_summary.tsv"))
+    args.engine = "columnar"
+    write_count_tables(args, input_annotation, [aggregates], cat_options, contig_lengths)
+    print("Rebuild ran in %s seconds." % round((time.time() - starttime), 2))
+    return 0
+
+
+def _get_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="eggnog_store",
+        description="eggnog_store inspects contig stores and rebuilds count tables from them.",
+        formatter_class=RawTextHelpFormatter
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    info_parser = subparsers.add_parser("info", help="Show what a contig store was built from.")
+    info_parser.add_argument("--store", dest="store", required=True, help="Indicate the contig store directory.")
+    info_parser.set_defaults(func=store_info)
+    rebuild_parser = subparsers.add_parser("rebuild", help="Rebuild count tables from a contig store.", formatter_class=RawTextHelpFormatter)
+    rebuild_parser.add_argument("--store", dest="store", required=True, help="Indicate the contig store directory.")
+    rebuild_parser.add_argument("--input_contig_fasta", dest="input_contig_fasta", required=True, help="Indicate the contig fasta file to calculate sequence length. ")
+    rebuild_parser.add_argument("--input_cov", dest="input_coverage", help="Indicate the tab-separted contig coverage file for input. ")
+    _add_summary_arguments(rebuild_parser)
+    _add_output_arguments(rebuild_parser)
+    rebuild_parser.set_defaults(func=rebuild_tables)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = _get_args()
+    sys.exit(args.func(args))
@@ -7,19 +7,81 @@ __email__ = "sjungbluth@lbl.com"
 
 import os
 import sys
+import numpy
 import pandas
 import argparse
+import itertools
 import time
+from contextlib import ExitStack, nullcontext
 from argparse import RawTextHelpFormatter
-from collections import Counter, defaultdict
-from go_xref import GO_Xrefs
+from collections import Counter
+from go_xref import (
+    GO_Xrefs,
+    LazyXrefs,
+    XrefProjector
+)
 from util import (
-    isfloat
+    isfloat,
+    int_list
 )
 from contigs import (
-    summarize_contig_lengths,
-    filter_contig_lengths
+    summarize_contig_lengths
+)
+from counts import FeatureCounts
+import metrics
+from coverage import (
+    ContigCoverages,
+    load_coverages
+)
+from interning import (
+    ContigSet,
+    ContigValues
+)
+from aggregate import (
+    PROPAGATED_CATEGORY,
+    ContigAggregates,
+    category_column,
+    summarize_chunks
+)
+from go_ontology import load_go_closure
+from gene_abundance import (
+    GENE_WEIGHTINGS,
+    attach_gene_weights,
+    load_gene_weights
+)
+from contig_store import (
+    contig_store_path,
+    store_is_current,
+    load_contig_store,
+    ContigStoreWriter
+)
+from feature_stats import (
+    TOP_FEATURES,
+    FeatureStats,
+    write_stats
+)
+from output import (
+    OUTPUT_FORMATS,
+    SummaryTableWriter,
+    check_output_format,
+    write_count_table
 )
+from annotations import (
+    PARSERS,
+    STDIN,
+    read_annotations,
+    read_annotation_chunks
+)
+
+# outputs of annotations read from standard input are named after this
+STDIN_NAME = "stdin"
+
+# eggNOG categories that can be summarized, in the order used for ALL_CATEGORIES
+INPUT_CATEGORY_OPTIONS = [
+    "GO", "EC", "KEGG_ko", "COG", "KEGG_Module", "KEGG_Reaction", "KEGG_rclass", "BRITE", "KEGG_TC", "CAZy", "BiGG_Reaction", "eggNOG_OGs"
+]
+# categories of GO terms, which get cross-reference tables
+GO_CATEGORIES = ["GO", PROPAGATED_CATEGORY]
 
 
 ### notes about eggNOG annotation output
@@ -56,7 +118,6 @@ from contigs import (
 # different eggnog annotation cateogries
 
 ### todo
-# add "skip contig taxa assignment" for speedup
 # add tests e.g. https://realpython.com/python-testing/
 # pca exploration of output
 # add FAMA and other modules
@@ -83,32 +144,47 @@ def import_data(
     contig_filter - set of contigs to be removed, either by being in the contig_filter file or
     """
     # import annotation data
-    input_annotation_path = os.path.abspath(input_annotation_file)
-    annotation_data = pandas.read_csv(input_annotation_path, delimiter='\t', header=None, names=["query_name", "seed_eggNOG_ortholog", "seed_ortholog_evalue", "seed_ortholog_score", "best_tax_level", "Preferred_name", "GO", "EC", "KEGG_ko", "KEGG_Pathway", "KEGG_Module", "KEGG_Reaction", "KEGG_rclass", "BRITE", "KEGG_TC", "CAZy", "BiGG_Reaction", "taxonomic_scope", "eggNOG_OGs", "best_eggNOG_OG", "COG", "eggNOG_free_text_desc"])
+    annotation_data = read_annotations(input_annotation_file)
+    coverages, contig_filter = import_coverage_data(use_coverage, input_coverage_file, contig_filter_file, min_contig_coverage, verbose)
+    return annotation_data, coverages, contig_filter
+
+# import the contig filter and, if needed, coverage data
+def import_coverage_data(
+    use_coverage: bool,
+    input_coverage_file: str,
+    contig_filter_file: str,
+    min_contig_coverage: int,
+    verbose: bool
+):
+    """
+    :param use_coverage: boolean
+    :param input_coverage_file: coverage file path,
+    :param contig_filter: str or "NULL" contig filter file path
+    :param min_contig_coverage: int minimum contig coverage to use - other contigs are discarded
+    :returns:
+    coverages - ContigCoverages mapping of contig id -> coverage (see coverage.load_coverages)
+    contig_filter - set of contigs to be removed, either by being in the contig_filter file or below min_contig_coverage
+    """
     contig_filter = set()     # contigs not to be used
     if contig_filter_file != "NULL":
         contig_filter_path = os.path.abspath(contig_filter_file)
-        with open(contig_filter_path) as z:
+        with metrics.stage("coverage_import"), open(contig_filter_path) as z:
             contig_filter = set(z.read().splitlines())
         if verbose:
             print("ignoring contigs from contig filter file")
             print(f"{len(contig_filter)} contigs ignored")
-    coverages = {}
+    coverages = ContigCoverages.from_dict({})
     if use_coverage or min_contig_coverage > 0:  # if coverage being used then load file
-        input_coverage_file = os.path.abspath(input_coverage_file)
-        with open(input_coverage_file, "r") as cov_file:
-            cov_lines = cov_file.readlines()
-            for line in cov_lines:
-                row = line.strip().split('\t')
-                # just contig_name and coverage_value here
-                coverage = int(row[1])
-                contig_id = row[0]
-                coverages[contig_id] = coverage
-                if coverage < min_contig_coverage:
-                    if verbose:
-                        print(f"filtering contig {contig_id} with coverage {coverage}")
-                    contig_filter.add(contig_id)
-    return annotation_data, coverages, contig_filter
+        with metrics.stage("coverage_import"):
+            coverages = load_coverages(os.path.abspath(input_coverage_file))
+        # the coverage filter is applied to the whole coverage array at once
+        low_coverage = coverages.below(min_contig_coverage)
+        if verbose:
+            low_values, _ = coverages.lookup(low_coverage)
+            for contig_id, coverage in zip(low_coverage.tolist(), low_values.tolist()):
+                print(f"filtering contig {contig_id} with coverage {coverage}")
+        contig_filter.update(low_coverage.tolist())
+    return coverages, contig_filter
 
 # needed to detect transition to a new contig so that summary step executes to combine with coverage data on a per-contig basis
 def _contig_summary_trigger(annotation_data, i):
@@ -122,28 +198,18 @@ def _contig_summary_trigger(annotation_data, i):
             summarize_contig = True
     return(summarize_contig, current_query_name)
 
-def _combine_and_add_dictionaries(dict_a, dict_b):
-    dictcountA = Counter(dict_a)
-    dictcountB = Counter(dict_b)
-    dict_combined = dictcountA + dictcountB
-    return dict_combined
-
 def _determine_consensus_taxonomy(taxonomic_scope, taxonomy_consensus_threshold, contig_running_count):
-    taxonomic_scope_output = dict(Counter(taxonomic_scope))
-    consensus_taxonomy = "NA"
-    for x in range(0, len(list(taxonomic_scope_output.keys()))):
-        hit_frequency = list(taxonomic_scope_output.values())[x] / contig_running_count
-        if hit_frequency >= taxonomy_consensus_threshold:
-            consensus_taxonomy = list(taxonomic_scope_output.keys())[x]
-            break
-        consensus_taxonomy = "NA"
-        hit_frequency = "NA"
-    if isfloat(hit_frequency): # rarely, but can happen that there is no consensus taxonomy, so need to confirm
-        hit_frequency = round(hit_frequency,2)
-    return consensus_taxonomy, hit_frequency
+    if taxonomy_consensus_threshold is None:  # --skip_taxonomy
+        return "NA", "NA"
+    # the most frequent scope wins, ties go to the scope seen first on the contig
+    consensus_taxonomy, scope_count = Counter(taxonomic_scope).most_common(1)[0]
+    hit_frequency = scope_count / contig_running_count
+    if hit_frequency < taxonomy_consensus_threshold:  # rarely, but can happen that there is no consensus taxonomy
+        return "NA", "NA"
+    return consensus_taxonomy, round(hit_frequency, 2)
 
 # count features and multiple by coverage value, add to final summary dict
-def _summarize_contig_module(f, summary_table, running_contig_non_hits, contig_running_count, cov_method, coverages, contig_id, summary_table_final_count, contig_length_data, taxonomic_scope, taxonomy_consensus_threshold):
+def _summarize_contig_module(f, summary_table, running_contig_non_hits, contig_running_count, cov_method, coverages, contig_id, summary_table_final_count, contig_length_data, taxonomic_scope, taxonomy_consensus_threshold, feature_stats=None):
     """
     :param f: output file pointer
     :param summary_table:
@@ -156,8 +222,8 @@ def _summarize_contig_module(f, summary_table, running_contig_non_hits, contig_r
     :param contig_length_data: dict keys = contig ids, values = contig lengths
     taxonomic_scope
     taxonomy_consensus_threshold
+    :param feature_stats: FeatureStats to add the contig's counts to, or None
     """
-    print("calling _summarize_contig_module")
     summary_table_output = dict(Counter(summary_table))  # covert list to dictionary with feature counts
     feature_hit_freq = 1 - (running_contig_non_hits / contig_running_count)  # calculate frequency of genes with features on a contig
     contig_length = "NA"
@@ -173,11 +239,17 @@ def _summarize_contig_module(f, summary_table, running_contig_non_hits, contig_r
         else:
             contig_coverage = coverages[contig_id]
             summary_table_output.update((x, y*contig_coverage) for x, y in summary_table_output.items())  # multiply dictionary values by contig coverage
-            # need to add summary_table_output dict to new summary_table_final_count dict
-            summary_table_final_count = _combine_and_add_dictionaries(summary_table_output, summary_table_final_count)
+            # add summary_table_output dict to the running totals in place
+            summary_table_final_count.add(summary_table_output)
+            if feature_stats is not None:
+                feature_stats.add(consensus_taxonomy, summary_table_output)
+            metrics.count("contigs")
             f.write("{}\t{}\t{}\t{}\t{}\t{}\n".format(contig_id, contig_length, contig_coverage, round(feature_hit_freq,2), consensus_taxonomy, consensus_taxonomy_frequency))
     else:  # unweighted mode, no need to incorporate contig coverage information
-        summary_table_final_count = _combine_and_add_dictionaries(summary_table, summary_table_final_count)
+        summary_table_final_count.add(summary_table_output)
+        if feature_stats is not None:
+            feature_stats.add(consensus_taxonomy, summary_table_output)
+        metrics.count("contigs")
         f.write("{}\t{}\t{}\t{}\t{}\n".format(contig_id, contig_length, round(feature_hit_freq,2), consensus_taxonomy, consensus_taxonomy_frequency))
     # clear list of features for next contig
     summary_table = []
@@ -189,38 +261,33 @@ def _summarize_contig_module(f, summary_table, running_contig_non_hits, contig_r
 
 # convert large list into dictionary and translate to pandas df for export
 # need to generalize more - currently over-reliant on Torben metadone naming scheme
-def _munge_prepare_and_export_count_tables(summary_table_final_count, input_annotation, input_cat, cov_method, binary_output, min_contig_length, min_contig_coverage):
+def _munge_prepare_and_export_count_tables(summary_table_final_count, input_annotation, input_cat, cov_method, binary_output, min_contig_length, min_contig_coverage, output_format="csv"):
     summary_table_final_count_dict = dict(Counter(summary_table_final_count))
     if binary_output == "Yes":
-        for x in summary_table_final_count_dict:
-            summary_table_final_count_dict[x] = 1
-            df_export = pandas.DataFrame.from_dict(summary_table_final_count_dict, orient='index')
-            pandas.DataFrame(df_export).to_csv(f"{os.getcwd()}/{input_annotation.split('/')[-1].split('_')[0]}_len{min_contig_length}_cov{min_contig_coverage}_{input_cat}_binary_direct_count_table.csv", index=True, header=False)
-    else:
-        df_export = pandas.DataFrame.from_dict(summary_table_final_count_dict, orient='index')
-        # df_export = df_export.sort_values(0, ascending=False) # sort_output
-        pandas.DataFrame(df_export).to_csv(f"{os.getcwd()}/{input_annotation.split('/')[-1].split('_')[0]}_len{min_contig_length}_cov{min_contig_coverage}_{input_cat}_{cov_method}_direct_count_table.csv", index=True, header=False)
+        # presence/absence of every feature, written once
+        summary_table_final_count_dict = dict.fromkeys(summary_table_final_count_dict, 1)
+        cov_method = "binary"
+    write_count_table(f"{os.getcwd()}/{input_annotation.split('/')[-1].split('_')[0]}_len{min_contig_length}_cov{min_contig_coverage}_{input_cat}_{cov_method}_direct_count_table", summary_table_final_count_dict, output_format)
 
-def _convert_go_count_table_to_other_annotation(summary_table_final_count, input_annotation, input_cat, cov_method, go_xref_tables, binary_output, min_contig_length, min_contig_coverage):
+def _convert_go_count_table_to_other_annotation(summary_table_final_count, input_annotation, input_cat, cov_method, go_xref_tables, binary_output, min_contig_length, min_contig_coverage, output_format="csv"):
     print("\nGO count table production complete - converting GO to other name spaces using translation tables.")
     use_binary = binary_output == "Yes"
+    # all namespaces are projected at once as sparse GO -> target matrix products
+    with metrics.stage("xref_load"):
+        projector = go_xref_tables.projector if isinstance(go_xref_tables, LazyXrefs) else XrefProjector(go_xref_tables)
+    go_terms = list(summary_table_final_count.keys())
+    with metrics.stage("xref_projection"):
+        projected = projector.project(go_terms, numpy.array(list(summary_table_final_count.values())) if go_terms else numpy.zeros(0, dtype=numpy.int64))
     for go_xref in go_xref_tables.keys():
         print(f"Converting...{go_xref}...")
-        xref_summary_table_final_count_dict = defaultdict(int)
-        xref_table = go_xref_tables[go_xref]
+        x_refs, x_ref_counts = projected[go_xref]
+        xref_summary_table_final_count_dict = dict(zip(x_refs.tolist(), x_ref_counts.tolist()))
 
-        for go_term in summary_table_final_count.keys():
-            x_refs = xref_table[go_term]
-            # x_refs = xref_table.loc[xref_table['GO_ID'] == go_term]['XRef_Annotation'].to_list()
-            for x_ref in x_refs:
-                xref_summary_table_final_count_dict[x_ref] += summary_table_final_count[go_term]
-
-        outfile_path = f"{os.getcwd()}/{input_annotation.split('/')[-1].split('_')[0]}_len{min_contig_length}_cov{min_contig_coverage}_{input_cat}_{'binary' if use_binary else cov_method}_{go_xref}_count_table.csv"
+        outfile_stem = f"{os.getcwd()}/{input_annotation.split('/')[-1].split('_')[0]}_len{min_contig_length}_cov{min_contig_coverage}_{input_cat}_{'binary' if use_binary else cov_method}_{go_xref}_count_table"
         if use_binary:
-            for x in xref_summary_table_final_count_dict:
-                xref_summary_table_final_count_dict[x] = 1
-        df_export = pandas.DataFrame.from_dict(xref_summary_table_final_count_dict, orient='index')
-        pandas.DataFrame(df_export).to_csv(outfile_path, index=True, header=False)
+            xref_summary_table_final_count_dict = dict.fromkeys(xref_summary_table_final_count_dict, 1)
+        with metrics.stage("export"):
+            write_count_table(outfile_stem, xref_summary_table_final_count_dict, output_format)
 
 def scan_and_summarize_output(
     output_file_prefix,  # like "<mg_id>_len2000_cov5_GO_weighted"
@@ -236,34 +303,39 @@ def scan_and_summarize_output(
     taxonomy_consensus_threshold,
     min_contig_length,
     min_contig_coverage,
-    go_xrefs
+    go_xrefs,
+    output_format="csv", # one of output.OUTPUT_FORMATS
+    go_closure=None,     # go_ontology.GOClosure, for the GO_propagated category
+    stats_top=None       # number of top features in the stats report, None to skip the stats
 ):
 
     # prep starting variables
     summary_table = []
     taxonomic_scope = []
-    summary_table_final_count = {}
+    summary_table_final_count = FeatureCounts()
     contig_running_count = 0
     running_contig_non_hits = 0
+    annotation_column = category_column(input_cat)
+    feature_stats = FeatureStats() if stats_top is not None else None
 
     cols = ["contig_id", "contig_length", "feature_hit_freq", "consensus_taxonomy", "consensus_taxonomy_frequency"]
     if cov_method == "weighted":
         cols.insert(2, "avg_contig_coverage")
 
-    summary_file = f"{output_file_prefix}_summary.tsv"
-    with open(summary_file, 'w') as f:
-        f.write("\t".join(cols) + "\n")
+    with SummaryTableWriter(f"{output_file_prefix}_summary", cols, output_format) as f, metrics.stage("aggregate"):
         total_annotation_queries = len(annotation_data["query_name"])
+        metrics.count("annotation_rows", total_annotation_queries)
         for i in range(total_annotation_queries):  # for each row in table
             if i % 1000 == 0:
-                percent_done = round(((i+1)*100)/(total_annotation_queries),1)
-                print("-----> Processing record {} of {}.....{} complete".format(i+1, total_annotation_queries, f"{percent_done} %"))
+                metrics.progress(i+1, total_annotation_queries)  # throttled, on stderr
             summarize_contig, contig_id = _contig_summary_trigger(annotation_data, i)  # determine if last annotation of the current contig
             contig_running_count += 1
-            if pandas.isna(annotation_data[input_cat][i]):  # if na, skip
+            if pandas.isna(annotation_data[annotation_column][i]):  # if na, skip
                 running_contig_non_hits += 1
             else:  # if not na, skip
-                annotations = annotation_data[input_cat][i].split(",")
+                annotations = annotation_data[annotation_column][i].split(",")
+                if input_cat == PROPAGATED_CATEGORY:  # roll the gene's GO terms up to their ancestors
+                    annotations = go_closure.propagate_terms(annotations)
                 for anno in annotations:
                     if input_cat == "COG":
                         if len(anno) > 1:
@@ -277,23 +349,351 @@ def scan_and_summarize_output(
                     summary_table,
                     contig_running_count,
                     running_contig_non_hits,
-                    taxonomic_scope) = _summarize_contig_module(f, summary_table, running_contig_non_hits, contig_running_count, cov_method, coverages, contig_id, summary_table_final_count, contig_length_data, taxonomic_scope, taxonomy_consensus_threshold)
+                    taxonomic_scope) = _summarize_contig_module(f, summary_table, running_contig_non_hits, contig_running_count, cov_method, coverages, contig_id, summary_table_final_count, contig_length_data, taxonomic_scope, taxonomy_consensus_threshold, feature_stats)
                 else: # skip contig and reset relevant variables
                     taxonomic_scope = []
                     summary_table = []
                     contig_running_count = 0
                     running_contig_non_hits = 0
-        _munge_prepare_and_export_count_tables(summary_table_final_count, input_annotation, input_cat, cov_method, binary_output, min_contig_length, min_contig_coverage)
-        if make_go_xref == "Yes" and input_cat == "GO":
-            _convert_go_count_table_to_other_annotation(summary_table_final_count, input_annotation, input_cat, cov_method, go_xrefs, binary_output, min_contig_length, min_contig_coverage)
+        summary_table_final_count = summary_table_final_count.to_dict()
+        with metrics.stage("export"):
+            _munge_prepare_and_export_count_tables(summary_table_final_count, input_annotation, input_cat, cov_method, binary_output, min_contig_length, min_contig_coverage, output_format)
+            if feature_stats is not None:
+                write_stats(output_file_prefix, summary_table_final_count, feature_stats, stats_top, output_format)
+        if make_go_xref == "Yes" and input_cat in GO_CATEGORIES:
+            _convert_go_count_table_to_other_annotation(summary_table_final_count, input_annotation, input_cat, cov_method, go_xrefs, binary_output, min_contig_length, min_contig_coverage, output_format)
+
+def scan_and_summarize_output_columnar(
+    output_file_prefixes,  # dict of input category -> output file prefix
+    input_annotation,
+    cov_method,
+    annotation_chunks,   # annotation dataframe, or iterable of dataframes split on contig boundaries
+    coverages,
+    contigs_allowed,
+    make_go_xref,
+    binary_output,
+    contig_length_data,
+    taxonomy_consensus_threshold,
+    min_contig_length,
+    min_contig_coverage,
+    go_xrefs,
+    processes=1,         # number of worker processes to summarize chunks with
+    output_format="csv",
+    go_closure=None,
+    stats_top=None,
+    aggregates_sink=None # called with the ContigAggregates of each chunk, see aggregate.summarize_chunks
+):
+    """
+    Columnar version of scan_and_summarize_output. Writes the same summary and count tables,
+    but computes the per-contig counts, weights and hit frequencies with grouped pandas/NumPy
+    operations instead of a per-row loop.
+
+    All categories given in output_file_prefixes are counted in a single pass over the
+    annotation table, and the contig-level summary (length, coverage, taxonomy consensus) is
+    only computed once.
+
+    The annotation table can be given in chunks (see annotations.read_annotation_chunks). The
+    summary rows of each chunk are written as soon as it is processed, and only the running
+    feature totals are kept between chunks. With more than one process, chunks are summarized
+    in parallel and merged in order, giving the same output as a serial run.
+    """
+    _summarize_and_export(
+        {(min_contig_length, min_contig_coverage): output_file_prefixes},
+        input_annotation,
+        cov_method,
+        annotation_chunks,
+        coverages,
+        contigs_allowed,
+        make_go_xref,
+        binary_output,
+        contig_length_data,
+        taxonomy_consensus_threshold,
+        go_xrefs,
+        processes,
+        apply_thresholds=False,
+        output_format=output_format,
+        go_closure=go_closure,
+        stats_top=stats_top,
+        aggregates_sink=aggregates_sink
+    )
+
+def scan_and_summarize_output_sweep(
+    output_file_prefixes,  # dict of (min_contig_length, min_contig_coverage) -> dict of input category -> output file prefix
+    input_annotation,
+    cov_method,
+    annotation_chunks,
+    coverages,           # coverage of every contig in the coverage file, not just those passing the thresholds
+    contigs_allowed,     # set of contigs to use before the length and coverage thresholds are applied
+    make_go_xref,
+    binary_output,
+    contig_length_data,
+    taxonomy_consensus_threshold,
+    go_xrefs,
+    processes=1,
+    output_format="csv",
+    go_closure=None,
+    stats_top=None,
+    aggregates_sink=None
+):
+    """
+    Parameter sweep version of scan_and_summarize_output_columnar. Writes the summary and count
+    tables for several (min_contig_length, min_contig_coverage) thresholds at once.
+
+    The annotation table is only read and aggregated once. The outputs for each threshold are
+    then cut from the per-contig aggregates, so that each extra threshold only costs writing
+    its tables. The tables are the same as those of separate runs with each threshold.
+    """
+    _summarize_and_export(
+        output_file_prefixes,
+        input_annotation,
+        cov_method,
+        annotation_chunks,
+        coverages,
+        contigs_allowed,
+        make_go_xref,
+        binary_output,
+        contig_length_data,
+        taxonomy_consensus_threshold,
+        go_xrefs,
+        processes,
+        apply_thresholds=True,
+        output_format=output_format,
+        go_closure=go_closure,
+        stats_top=stats_top,
+        aggregates_sink=aggregates_sink
+    )
+
+def _count_rows(annotation_chunks):
+    # counts the annotation rows of each chunk as it's read, for the run metrics and the
+    # (throttled) progress lines on stderr
+    rows = 0
+    for annotation_data in annotation_chunks:
+        if isinstance(annotation_data, ContigAggregates):
+            chunk_rows = int(annotation_data.contigs["gene_count"].sum())
+        else:
+            chunk_rows = len(annotation_data)
+        metrics.count("annotation_rows", chunk_rows)
+        rows += chunk_rows
+        metrics.progress(rows)
+        yield annotation_data
+
+def _summarize_and_export(output_file_prefixes, input_annotation, cov_method, annotation_chunks, coverages, contigs_allowed, make_go_xref, binary_output, contig_length_data, taxonomy_consensus_threshold, go_xrefs, processes, apply_thresholds, output_format="csv", go_closure=None, stats_top=None, aggregates_sink=None):
+    # output_file_prefixes is a dict of (min_contig_length, min_contig_coverage) -> dict of input category -> output file prefix
+    if isinstance(annotation_chunks, pandas.DataFrame):
+        annotation_chunks = [annotation_chunks]
+    thresholds = list(output_file_prefixes.keys())
+    input_cats = list(output_file_prefixes[thresholds[0]].keys())
+
+    cols = ["contig_id", "contig_length", "feature_hit_freq", "consensus_taxonomy", "consensus_taxonomy_frequency"]
+    if cov_method == "weighted":
+        cols.insert(2, "avg_contig_coverage")
+
+    feature_counts = {threshold: {input_cat: FeatureCounts() for input_cat in input_cats} for threshold in thresholds}
+    feature_stats = {threshold: {input_cat: FeatureStats() for input_cat in input_cats} for threshold in thresholds} if stats_top is not None else None
+    annotation_chunks = metrics.timed(_count_rows(annotation_chunks), "annotation_import")
+    with ExitStack() as stack:
+        summary_files = {threshold: {} for threshold in thresholds}
+        for threshold, prefixes in output_file_prefixes.items():
+            for input_cat in input_cats:
+                summary_files[threshold][input_cat] = stack.enter_context(SummaryTableWriter(f"{prefixes[input_cat]}_summary", cols, output_format))
+        chunk_results = summarize_chunks(annotation_chunks, input_cats, cov_method, coverages, contigs_allowed, contig_length_data, taxonomy_consensus_threshold, processes, thresholds if apply_thresholds else None, go_closure, aggregates_sink)
+        for chunk_result in metrics.timed(chunk_results, "aggregate"):
+            if not apply_thresholds:
+                chunk_result = [chunk_result]
+            # contigs summarized under the first threshold
+            metrics.count("contigs", len(chunk_result[0][0][input_cats[0]]))
+            for threshold, (summary_lines, chunk_feature_counts, contig_taxa) in zip(thresholds, chunk_result):
+                for input_cat in input_cats:
+                    with metrics.stage("export"):
+                        summary_files[threshold][input_cat].writelines(summary_lines[input_cat])
+                    with metrics.stage("aggregate"):
+                        feature_counts[threshold][input_cat].add_contigs(*chunk_feature_counts[input_cat])
+                        if feature_stats is not None:
+                            feature_stats[threshold][input_cat].add_contigs(contig_taxa, *chunk_feature_counts[input_cat])
+
+    for min_contig_length, min_contig_coverage in thresholds:
+        for input_cat in input_cats:
+            print(f"Generating {input_cat} table(s) from eggNOG-mapper data" + (f" (min contig length {min_contig_length}, min contig coverage {min_contig_coverage})" if apply_thresholds else ""))
+            summary_table_final_count = feature_counts[(min_contig_length, min_contig_coverage)][input_cat].to_dict()
+            with metrics.stage("export"):
+                _munge_prepare_and_export_count_tables(summary_table_final_count, input_annotation, input_cat, cov_method, binary_output, min_contig_length, min_contig_coverage, output_format)
+                if feature_stats is not None:
+                    write_stats(output_file_prefixes[(min_contig_length, min_contig_coverage)][input_cat], summary_table_final_count, feature_stats[(min_contig_length, min_contig_coverage)][input_cat], stats_top, output_format)
+            if make_go_xref == "Yes" and input_cat in GO_CATEGORIES:
+                _convert_go_count_table_to_other_annotation(summary_table_final_count, input_annotation, input_cat, cov_method, go_xrefs, binary_output, min_contig_length, min_contig_coverage, output_format)
+
+def write_count_tables(args, input_annotation, annotation_data, cat_options, contig_lengths, go_closure=None, gene_weighting=None, aggregates_sink=None):
+    """
+    Filters the contigs and writes the summary and count tables for every combination of the
+    length and coverage thresholds in args.
+
+    :param args: parsed arguments, see _add_summary_arguments
+    :param input_annotation: annotation file path, the output files are named after it
+    :param annotation_data: annotation DataFrame for the loop engine, or an iterable of
+        annotation chunks or ContigAggregates for the columnar engine
+    :param cat_options: list of categories to write tables for
+    :param contig_lengths: mapping contig id -> length of every contig in the assembly, its
+        ContigIndex is shared by the coverages and contig filters
+    :param go_closure: go_ontology.GOClosure, needed to aggregate the GO_propagated category
+    :param gene_weighting: one of gene_abundance.GENE_WEIGHTINGS if the annotation chunks have
+        gene weights, which then replace the contig coverage weighting and name the tables
+    :param aggregates_sink: for the columnar engine, called with the ContigAggregates of each
+        annotation chunk as it's summarized (e.g. ContigStoreWriter.add)
+    """
+    contig_lengths = ContigValues.from_mapping(contig_lengths)
+    all_contigs = ContigSet.all(contig_lengths.index)
+
+    # every combination of the length and coverage thresholds gets its own set of tables
+    thresholds = list(itertools.product(args.min_contig_length, args.min_contig_coverage))
+    max_contig_coverage = max(args.min_contig_coverage)
+
+    cov_method = gene_weighting or ("weighted" if args.use_coverage else "unweighted")
+    stats_top = args.stats_top if args.stats else None
+
+    # run main function to summarize eggnog mapper annotation output on a per contig basis
+    output_file_prefixes = {
+        (min_contig_length, min_contig_coverage): {
+            cat: f"{os.getcwd()}/{input_annotation.split('/')[-1].split('_')[0]}_len{min_contig_length}_cov{min_contig_coverage}_{cat}_{cov_method}"
+            for cat in cat_options
+        }
+        for min_contig_length, min_contig_coverage in thresholds
+    }
+    # import Gene Ontology cross-reference tables
+    if "GO" in cat_options and args.make_go_xref != "No":
+        with metrics.stage("xref_load"):
+            go_xref_table_list = GO_Xrefs().xrefs
+    else:
+        go_xref_table_list = ""
+
+    if args.engine == "columnar" and len(thresholds) > 1:
+        # the annotations are aggregated once, and each threshold is applied to the aggregates
+        coverages, _ = import_coverage_data(args.use_coverage, args.input_coverage, "NULL", max_contig_coverage, False)
+        coverages = ContigCoverages.from_mapping(coverages, contig_lengths.index)
+        _, contig_import_filter = import_coverage_data(False, args.input_coverage, args.contig_filter, 0, args.verbose)
+        scan_and_summarize_output_sweep(
+            output_file_prefixes,
+            input_annotation,
+            cov_method,
+            annotation_data,
+            coverages,
+            all_contigs - contig_import_filter,
+            args.make_go_xref,
+            args.binary_output,
+            contig_lengths,
+            args.taxonomy_consensus_threshold,
+            go_xref_table_list,
+            args.processes,
+            args.output_format,
+            go_closure,
+            stats_top,
+            aggregates_sink
+        )
+        thresholds = []
+
+    for min_contig_length, min_contig_coverage in thresholds:
+        coverages, contig_import_filter = import_coverage_data(
+            args.use_coverage,          # boolean whether to weight by coverage
+            args.input_coverage,        # input coverage file
+            args.contig_filter,         # optional list of contigs to include
+            min_contig_coverage,        # minimum contig coverage required
+            args.verbose
+        )
+        coverages = ContigCoverages.from_mapping(coverages, contig_lengths.index)
+        contigs_allowed = ContigSet(contig_lengths.index, contig_lengths.values >= min_contig_length) - contig_import_filter
+        prefixes = output_file_prefixes[(min_contig_length, min_contig_coverage)]
+
+        if args.engine == "loop":
+            for cat in cat_options:
+                args.input_cat = cat
+                print(f"Generating {args.input_cat} table(s) from eggNOG-mapper data")
+                scan_and_summarize_output(
+                    prefixes[cat],
+                    input_annotation,
+                    args.input_cat,
+                    cov_method,
+                    annotation_data,
+                    coverages,
+                    contigs_allowed,
+                    args.make_go_xref,
+                    args.binary_output,
+                    contig_lengths,
+                    args.taxonomy_consensus_threshold,
+                    min_contig_length,
+                    min_contig_coverage,
+                    go_xref_table_list,
+                    args.output_format,
+                    go_closure,
+                    stats_top
+                )
+        else:
+            # all categories are aggregated together in one pass over the annotation table
+            scan_and_summarize_output_columnar(
+                prefixes,
+                input_annotation,
+                cov_method,
+                annotation_data,
+                coverages,
+                contigs_allowed,
+                args.make_go_xref,
+                args.binary_output,
+                contig_lengths,
+                args.taxonomy_consensus_threshold,
+                min_contig_length,
+                min_contig_coverage,
+                go_xref_table_list,
+                args.processes,
+                args.output_format,
+                go_closure,
+                stats_top,
+                aggregates_sink
+            )
+
+def add_propagated_category(cat_options, go_obo):
+    """
+    Returns the categories to summarize, with GO_propagated right after GO if an OBO file to
+    roll the GO terms up with is given.
+    """
+    if go_obo is None or "GO" not in cat_options:
+        return list(cat_options)
+    go_position = cat_options.index("GO")
+    return cat_options[:go_position + 1] + [PROPAGATED_CATEGORY] + cat_options[go_position + 1:]
+
+def load_propagation_closure(go_obo, cat_options):
+    """
+    Loads the GO ancestor closure of the OBO file if the GO_propagated category is summarized,
+    or returns None.
+    """
+    if PROPAGATED_CATEGORY not in cat_options:
+        return None
+    with metrics.stage("go_closure"):
+        return load_go_closure(go_obo)
 
 def run_mapper(args):
+    return metrics.record_run(_run_mapper, args)
+
+def _run_mapper(args):
     starttime = time.time()
     if args.binary_output == "Yes" and args.use_coverage:
         print("Binary output selected, adjusted coverage setting to maximize program performance")
         args.use_coverage = False
-    if (not args.input_cat == "ALL_CATEGORIES") and (not args.input_cat == "GO") and (not args.input_cat == "EC") and (not args.input_cat == "KEGG_ko") and (not args.input_cat == "COG") and (not args.input_cat == "KEGG_Module") and (not args.input_cat == "KEGG_Reaction") and (not args.input_cat == "KEGG_rclass") and (not args.input_cat == "BRITE") and (not args.input_cat == "KEGG_TC") and (not args.input_cat == "CAZy") and (not args.input_cat == "BiGG_Reaction") and (not args.input_cat == "eggNOG_OGs"):
+    if args.input_cat != "ALL_CATEGORIES" and args.input_cat not in INPUT_CATEGORY_OPTIONS:
         sys.exit("Bad category selection, please review options. Exiting...")
+    try:
+        check_output_format(args.output_format)
+    except ValueError as e:
+        sys.exit(str(e))
+    if args.go_obo is not None and not os.path.exists(args.go_obo):
+        sys.exit(f"GO ontology file {args.go_obo} not found. Exiting...")
+    if args.gene_abundance is not None:
+        if args.binary_output == "Yes":
+            print("Binary output selected, gene abundances aren't used")
+            args.gene_abundance = None
+        elif args.gene_lengths is None:
+            sys.exit("Gene weighting needs the gene lengths (--gene_lengths). Exiting...")
+        elif args.use_coverage:
+            sys.exit("--use_cov can't be combined with --gene_abundance, the gene weights replace the contig coverage. Exiting...")
+        elif args.engine == "loop":
+            sys.exit("Gene weighting needs the columnar engine. Exiting...")
     input_fasta = args.input_contig_fasta
     print('''
 ***************************************************************************
@@ -305,14 +705,23 @@ def run_mapper(args):
     print("    Input annotation: " + str(args.input_annotation))
     print("    Input coverage: " + str(args.input_coverage))
     print("    Input contig_fasta: " + str(input_fasta))
-    print("    Input min contig length: " + str(args.min_contig_length))
-    print("    Input min contig coverage: " + str(args.min_contig_coverage))
+    print("    Input min contig length: " + ",".join(str(x) for x in args.min_contig_length))
+    print("    Input min contig coverage: " + ",".join(str(x) for x in args.min_contig_coverage))
     print("    Input contig filter: " + str(args.contig_filter))
     print("    Input eggnog mapper category: " + str(args.input_cat))
     print("    Use contig coverage: " + str(args.use_coverage))
+    print("    Gene abundance: " + str(args.gene_abundance) + ("" if args.gene_abundance is None else f" ({args.gene_weighting}, lengths from {args.gene_lengths})"))
     print("    Binary output: " + str(args.binary_output))
-    print("    Contig taxonomy consensus threshold: " + str(args.taxonomy_consensus_threshold))
+    print("    Contig taxonomy consensus threshold: " + ("skipped" if args.taxonomy_consensus_threshold is None else str(args.taxonomy_consensus_threshold)))
     print("    Make GO cross-ref tables: " + str(args.make_go_xref))
+    print("    GO ontology for propagation: " + str(args.go_obo))
+    print("    Engine: " + str(args.engine))
+    print("    Chunk size: " + str(args.chunk_size))
+    print("    Annotation parser: " + str(args.annotation_parser))
+    print("    Processes: " + str(args.processes))
+    print("    Contig store: " + str(args.contig_store))
+    print("    Output format: " + str(args.output_format))
+    print("    Stats report: " + (f"yes, top {args.stats_top} features" if args.stats else "no"))
     print("")
 
     output_dir = os.getcwd()
@@ -321,61 +730,57 @@ def run_mapper(args):
     input_fasta_prefix = os.path.basename(input_fasta).split("_")[0]
     fasta_summary_file = os.path.join(f"{output_dir}", f"{input_fasta_prefix}_contig_length_summary.tsv")
 
-    contig_lengths = summarize_contig_lengths(input_fasta, fasta_summary_file)
-    contig_length_filter = filter_contig_lengths(contig_lengths, args.min_contig_length)
-
-    all_contigs = contig_lengths.keys()
-    # import annotation and coverage data, filter by coverage and input contig list
-    annotation_data, coverages, contig_import_filter = import_data(
-        args.input_annotation,      # input annotation file
-        args.use_coverage,          # boolean whether to weight by coverage
-        args.input_coverage,        # input coverage file
-        args.contig_filter,         # optional list of contigs to include
-        args.min_contig_coverage,   # minimum contig coverage required
-        args.verbose
-    )
-
-    contigs_allowed = set(all_contigs) - contig_length_filter - contig_import_filter
-
-    input_category_options = [
-        "GO", "EC", "KEGG_ko", "COG", "KEGG_Module", "KEGG_Reaction", "KEGG_rclass", "BRITE", "KEGG_TC", "CAZy", "BiGG_Reaction", "eggNOG_OGs"
-    ]
+    with metrics.stage("fasta_lengths"):
+        contig_lengths = summarize_contig_lengths(input_fasta, fasta_summary_file)
 
-    go_xrefs = GO_Xrefs()
-    cov_method = "weighted" if args.use_coverage else "unweighted"
-
-    # run main function to summarize eggnog mapper annotation output on a per contig basis
     if args.input_cat == "ALL_CATEGORIES":
-        cat_options = input_category_options
+        cat_options = INPUT_CATEGORY_OPTIONS
     else:
         cat_options = [args.input_cat]
-    for cat in cat_options:
-        args.input_cat = cat
-        print(f"Generating {args.input_cat} table(s) from eggNOG-mapper data")
-        # import Gene Ontology cross-reference tables
-        if args.input_cat == "GO" and args.make_go_xref != "No":
-            go_xref_table_list = go_xrefs.xrefs
-        else:
-            go_xref_table_list = ""
+    if args.go_obo is not None and "GO" not in cat_options:
+        print("GO ontology given without the GO category, GO terms won't be propagated")
+    cat_options = add_propagated_category(cat_options, args.go_obo)
+    go_closure = load_propagation_closure(args.go_obo, cat_options)
 
-        output_file_prefix = f"{os.getcwd()}/{args.input_annotation.split('/')[-1].split('_')[0]}_len{args.min_contig_length}_cov{args.min_contig_coverage}_{args.input_cat}_{cov_method}"
+    gene_weighting = None
+    if args.gene_abundance is not None:
+        gene_weighting = args.gene_weighting
+        with metrics.stage("gene_weights"):
+            gene_weights = load_gene_weights(args.gene_abundance, args.gene_lengths, gene_weighting)
+
+    # import annotation data
+    input_annotation = STDIN_NAME if args.input_annotation == STDIN else args.input_annotation
+    store_dir = contig_store_path(output_dir, input_annotation)
+    if args.contig_store and not os.path.isfile(args.input_annotation):
+        print("The contig store needs an annotation file, skipping it for a stream")
+        args.contig_store = False
+    if args.contig_store and gene_weighting is not None:
+        print("The contig store holds unweighted gene counts, skipping it for gene weighting")
+        args.contig_store = False
+    store_writer = None
+    if args.engine == "loop":
+        with metrics.stage("annotation_import"):
+            annotation_data = read_annotations(args.input_annotation)
+    elif args.contig_store and store_is_current(store_dir, args.input_annotation, cat_options, args.taxonomy_consensus_threshold, args.go_obo):
+        print(f"Using the per-contig aggregates in {store_dir}")
+        with metrics.stage("annotation_import"):
+            annotation_data = [load_contig_store(store_dir, cat_options)]
+    else:
+        # the annotation file is streamed in chunks later, only reading the columns needed
+        annotation_data = read_annotation_chunks(args.input_annotation, cat_options, args.chunk_size, args.taxonomy_consensus_threshold is not None, args.annotation_parser)
+        if gene_weighting is not None:
+            annotation_data = attach_gene_weights(annotation_data, gene_weights)
+        if args.contig_store:
+            # the aggregates of each chunk are appended to the store as they're summarized
+            store_writer = ContigStoreWriter(store_dir, cat_options)
+
+    with store_writer or nullcontext():
+        write_count_tables(args, input_annotation, annotation_data, cat_options, contig_lengths, go_closure, gene_weighting, store_writer.add if store_writer is not None else None)
+        if store_writer is not None:
+            with metrics.stage("export"):
+                store_writer.finish(args.input_annotation, args.taxonomy_consensus_threshold, args.go_obo)
+            print(f"Saved the per-contig aggregates to {store_dir}")
 
-        scan_and_summarize_output(
-            output_file_prefix,
-            args.input_annotation,
-            args.input_cat,
-            cov_method,
-            annotation_data,
-            coverages,
-            contigs_allowed,
-            args.make_go_xref,
-            args.binary_output,
-            contig_lengths,
-            args.taxonomy_consensus_threshold,
-            args.min_contig_length,
-            args.min_contig_coverage,
-            go_xref_table_list
-        )
     print('''
 ***************************************************************************
 *                                 App end                                 *
@@ -384,7 +789,36 @@ def run_mapper(args):
     print("App ran in %s seconds." % round((time.time() - starttime), 2))
     return 0
 
-def _get_args():
+def _add_output_arguments(parser):
+    parser.add_argument("--output_format", dest="output_format", default="csv", choices=OUTPUT_FORMATS, help="Indicate the format of the count and summary tables. 'csv.gz' and 'csv.zst' are compressed CSV (zstd requires zstandard), 'parquet' writes typed columnar tables (requires pyarrow). (default: csv)")
+    parser.add_argument("--stats", dest="stats", default=False, action="store_true", help="Also write a stats report (<table prefix>_stats.json) for each category, with the richness, Shannon and Simpson diversity and top features of the counts overall and per contig consensus taxonomy, and the taxon x feature counts (<table prefix>_taxon_count_table). They're computed while counting, from the unbinarized counts. (default: False)")
+    parser.add_argument("--stats_top", dest="stats_top", default=TOP_FEATURES, type=int, help="Indicate the number of top features listed in the stats report. (default: %(default)s)")
+
+def _add_summary_arguments(parser):
+    """
+    Adds the options that control how annotations are summarized into count tables. These are
+    shared with the batch entry point (eggnog_batch.py).
+    """
+    parser.add_argument("--min_contig_length", dest="min_contig_length", default="2000", type=int_list, help="Indicate the minimum contig length to include in final count table. A comma-separated list gives a set of tables per value. (default: 2000).")
+    parser.add_argument("--min_contig_coverage", dest="min_contig_coverage", default="5", type=int_list, help="Indicate the minimum average contig coverage required to include in final count table. A comma-separated list gives a set of tables per value. (default: 5).")
+    parser.add_argument("--contig_filter", dest="contig_filter", default="NULL", help="Indicate the contigs to retain for the output (i.e. contigs not listed will be filtered before count tables produced).")
+    parser.add_argument("--eggnog_category", dest="input_cat", default="GO", help="Indicate the eggnog mapper annotation ontology to use for mapping. (options: ALL_CATEGORIES, GO, EC, KEGG_ko, COG, KEGG_Module, KEGG_Reaction, KEGG_rclass, BRITE, KEGG_TC, CAZy, BiGG_Reaction, eggNOG_OGs (default: GO))")
+    parser.add_argument("--use_cov", dest="use_coverage", default=False, action="store_true", help="Indicate if contig coverage information should be used to produce a weighted output count table. (default: False)")
+    parser.add_argument("--binary", dest="binary_output", default="No", help="Indicate if the output should just indicate hit presence/absence. (default: No)")
+    parser.add_argument("--contig_taxa_threshold", dest="taxonomy_consensus_threshold", default=0.5, type=float, help="Indicate the frequency threshold for determining contig consensus taxonomy. The most frequent taxonomic scope on a contig is its consensus if its frequency meets the threshold, ties go to the scope seen first. (default: 0.5)")
+    parser.add_argument("--skip_taxonomy", dest="taxonomy_consensus_threshold", action="store_const", const=None, help="Skip the contig consensus taxonomy, the taxonomy columns of the summary tables are NA. The taxonomic_scope column isn't read with the columnar engine. (default: False)")
+    parser.add_argument("--go_xref", dest="make_go_xref", default="Yes", help="Indicate if input_cat is GO then generate cross-reference tables. (default: Yes)")
+    parser.add_argument("--go_xref_loc", dest="go_xref_loc", default=".", help="Path to a directory containing GO cross-reference tables")
+    parser.add_argument("--go_obo", dest="go_obo", default=None, help="Indicate a GO OBO file (e.g. go-basic.obo) to also write GO_propagated tables, where each gene counts once for every ancestor of its GO terms (is_a and part_of). The ancestor closure is cached in .go_closure/ next to the OBO file. (default: no propagation)")
+    parser.add_argument("--chunk_size", dest="chunk_size", default=100000, type=int, help="Indicate the number of annotation rows to read at a time with the columnar engine. Chunks are extended to end on a contig boundary. Use 0 to read the whole file at once. (default: 100000)")
+    parser.add_argument("--annotation_parser", dest="annotation_parser", default="c", choices=PARSERS, help="Indicate the parser for the annotation file with the columnar engine. 'pyarrow' parses on multiple threads (requires pyarrow). (default: c)")
+    parser.add_argument("--processes", "--threads", dest="processes", default=1, type=int, help="Indicate the number of worker processes the columnar engine uses to summarize annotation chunks in parallel. (default: 1)")
+    parser.add_argument("--metrics_out", dest="metrics_out", default=None, help="Indicate a path to write a JSON report of the run to: time spent in each stage, annotation rows and contigs per second, and peak memory use. (default: no report)")
+    parser.add_argument("--verbose", dest="verbose", default=False, action="store_true", help="Extra verbose output")
+
+def _get_args(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
     description_text = "eggnog_to_feature_table converts eggnog mapper output to a feature count table, with or without weighting using contig abundance values."
     description_text += "\n" + "-"*len(description_text)
     parser = argparse.ArgumentParser(
@@ -405,27 +839,24 @@ def _get_args():
     )
 
     requiredNamed = parser.add_argument_group('required arguments')
-    requiredNamed.add_argument("-i", dest="input_annotation", help="Indicate the eggnog mapping annotation file for input. ", required=False)
+    requiredNamed.add_argument("-i", dest="input_annotation", help="Indicate the eggnog mapping annotation file for input. Use - to read standard input. Standard input, named pipes and gzip or zstd compressed files are read as a stream, so the annotations can be summarized while eggNOG-mapper writes them.", required=False)
     parser.add_argument("--input_contig_fasta", dest="input_contig_fasta", help="Indicate the contig fasta file to calculate sequence length. ")
     parser.add_argument("--input_cov", dest="input_coverage", help="Indicate the tab-separted contig coverage file for input. ")
-    parser.add_argument("--min_contig_length", dest="min_contig_length", default=2000, help="Indicate the minimum contig length to include in final count table (default: 2000).")
-    parser.add_argument("--min_contig_coverage", dest="min_contig_coverage", default=5, help="Indicate the minimum average contig coverage required to include in final count table (default: 5).")
-    parser.add_argument("--contig_filter", dest="contig_filter", default="NULL", help="Indicate the contigs to retain for the output (i.e. contigs not listed will be filtered before count tables produced).")
-    parser.add_argument("--eggnog_category", dest="input_cat", default="GO", help="Indicate the eggnog mapper annotation ontology to use for mapping. (options: ALL_CATEGORIES, GO, EC, KEGG_ko, COG, KEGG_Module, KEGG_Reaction, KEGG_rclass, BRITE, KEGG_TC, CAZy, BiGG_Reaction, eggNOG_OGs (default: GO))")
-    parser.add_argument("--use_cov", dest="use_coverage", default=False, action="store_true", help="Indicate if contig coverage information should be used to produce a weighted output count table. (default: False)")
-    parser.add_argument("--binary", dest="binary_output", default="No", help="Indicate if the output should just indicate hit presence/absence. (default: No)")
-    parser.add_argument("--contig_taxa_threshold", dest="taxonomy_consensus_threshold", default=0.5, help="Indicate the frequency threshold for determining contig consensus taxonomy. (default: 0.5)")
-    parser.add_argument("--go_xref", dest="make_go_xref", default="Yes", help="Indicate if input_cat is GO then generate cross-reference tables. (default: Yes)")
-    parser.add_argument("--go_xref_loc", dest="go_xref_loc", default=".", help="Path to a directory containing GO cross-reference tables")
+    parser.add_argument("--gene_abundance", dest="gene_abundance", default=None, help="Indicate a tab-separated file of query_name and read count (rpk, tpm) or mean coverage (cov_length) to weight each gene by instead of counting it once. Needs --gene_lengths and the columnar engine, and replaces --use_cov. (default: no gene weighting)")
+    parser.add_argument("--gene_lengths", dest="gene_lengths", default=None, help="Indicate the gene lengths for --gene_abundance: prodigal protein or gene FASTA file (lengths from the header coordinates), GFF file (the n-th CDS on a sequence is <sequence id>_<n>) or tab-separated file of query_name and length.")
+    parser.add_argument("--gene_weighting", dest="gene_weighting", default="tpm", choices=GENE_WEIGHTINGS, help="Indicate the gene weight: 'rpk' reads per kilobase, 'tpm' transcripts per million, 'cov_length' coverage x gene length. Tables are named after it instead of weighted/unweighted. (default: tpm)")
+    _add_summary_arguments(parser)
+    _add_output_arguments(parser)
+    parser.add_argument("--engine", dest="engine", default="columnar", choices=["columnar", "loop"], help="Indicate the summarization engine. 'loop' is the row-by-row reference implementation. (default: columnar)")
+    parser.add_argument("--contig_store", dest="contig_store", default=False, action="store_true", help="Save the per-contig aggregates to <sample>_contig_store next to the outputs, or reuse them if they're up to date with the annotation file. Outputs can be rebuilt from the store with eggnog_store.py. Only used by the columnar engine. (default: False)")
     parser.add_argument("--version", action="version", version='%(prog)s v2.0')
-    parser.add_argument("--verbose", dest="verbose", default=False, action="store_true", help="Extra verbose output")
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     # make args a little more sensible
     if args.binary_output == "Yes":
         args.use_coverage = False
 
-    if len(sys.argv) is None or len(sys.argv) < 2:
+    if not argv:
         parser.print_help()
         sys.exit(0)
     return args
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+"""
+Builds packed GO cross-reference tables from the upstream external2go files (ec2go,
+pfam2go, ...), and shows what existing tables were built from.
+
+    eggnog_xrefs.py build --input external2go/ --output_dir GO_xref --release 2022-07-01
+    eggnog_xrefs.py info --xref_dir GO_xref
+
+build normalizes and validates each file (see go_xref.normalize_xrefs), drops repeated
+(GO id, target) pairs, and writes <name>.xref.npz with the provenance of the table: the
+source file and its checksum, the upstream header (version date, ...), the release label
+and the line counts. GO_Xrefs loads a packed table instead of <name>.clean when there is
+one.
+"""
+import os
+import sys
+import json
+import argparse
+from argparse import RawTextHelpFormatter
+from datetime import datetime, timezone
+from go_xref import (
+    PACKED_SUFFIX,
+    XREF_TYPES,
+    file_sha256,
+    normalize_xrefs,
+    packed_table_path,
+    read_packed_table,
+    read_raw_header,
+    read_xref_lines,
+    write_packed_table,
+    xref_table_from_frame
+)
+
+
+def table_name(path: str) -> str:
+    """
+    Returns the cross-reference table name of a source file, e.g. "pfam2go" for
+    pfam2go, pfam2go.clean or pfam2go.gz.
+    """
+    return os.path.basename(path).split(".")[0]
+
+
+def _input_files(paths: list) -> list:
+    # source files given directly, or the *2go files of a directory
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(
+                os.path.join(path, name) for name in os.listdir(path)
+                if table_name(name).endswith("2go") and not name.endswith(PACKED_SUFFIX)
+            ))
+        else:
+            files.append(path)
+    return files
+
+
+def build_table(source_path: str, output_dir: str, release: str = None, strict: bool = False) -> dict:
+    """
+    Builds the packed table of one source file.
+
+    :param source_path: upstream external2go file, or a .clean table (optionally gzipped)
+    :param output_dir: directory the <name>.xref.npz table is written to
+    :param release: release label stored in the provenance, by default the upstream version
+        date
+    :param strict: if True, raise ValueError instead of writing a table with malformed lines
+        left out
+    :returns: provenance metadata of the table
+    """
+    name = table_name(source_path)
+    lines = read_xref_lines(source_path)
+    header = read_raw_header(lines)
+    table, stats = normalize_xrefs(lines)
+    if strict and stats["malformed"]:
+        raise ValueError(f"{source_path} has {stats['malformed']} malformed lines: {stats['malformed_lines']}")
+    xref_table = xref_table_from_frame(table)
+    metadata = {
+        "name": name,
+        "source": os.path.basename(source_path),
+        "source_sha256": file_sha256(source_path),
+        "source_size": os.path.getsize(source_path),
+        "header": header,
+        "release": release or header.get("version date"),
+        "built": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "go_ids": len(xref_table),
+        "target_ids": len(xref_table.target_ids),
+        **stats
+    }
+    write_packed_table(packed_table_path(output_dir, name), xref_table, metadata)
+    return metadata
+
+
+def build_tables(args: argparse.Namespace) -> int:
+    files = _input_files(args.inputs)
+    if not files:
+        sys.exit(f"No cross-reference files found in {' '.join(args.inputs)}")
+    os.makedirs(args.output_dir, exist_ok=True)
+    for source_path in files:
+        name = table_name(source_path)
+        if name not in XREF_TYPES:
+            print(f"{name} is not one of the cross-reference tables GO_Xrefs loads ({', '.join(XREF_TYPES)}), building it anyway")
+        try:
+            metadata = build_table(source_path, args.output_dir, args.release, args.strict)
+        except (OSError, ValueError) as e:
+            sys.exit(str(e))
+        print(f"{name}: {metadata['go_ids']} GO ids, {metadata['rows']} cross-references, {metadata['duplicates']} duplicate and {metadata['malformed']} malformed lines dropped")
+        for line_number, line in metadata["malformed_lines"]:
+            print(f"    line {line_number}: {line!r}")
+    return 0
+
+
+def tables_info(args: argparse.Namespace) -> int:
+    info = {}
+    for name in sorted(os.listdir(args.xref_dir)):
+        if name.endswith(PACKED_SUFFIX):
+            try:
+                info[name[:-len(PACKED_SUFFIX)]] = read_packed_table(os.path.join(args.xref_dir, name))[1]
+            except (OSError, ValueError) as e:
+                sys.exit(str(e))
+    if not info:
+        sys.exit(f"No packed cross-reference tables found in {args.xref_dir}")
+    print(json.dumps(info, indent=1))
+    return 0
+
+
+def _get_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="eggnog_xrefs",
+        description="eggnog_xrefs builds packed GO cross-reference tables and shows their provenance.",
+        formatter_class=RawTextHelpFormatter
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="Build packed tables from external2go files.")
+    build_parser.add_argument("--input", dest="inputs", nargs="+", required=True, help="Indicate the external2go files, or directories of *2go files, to build tables from. ")
+    build_parser.add_argument("--output_dir", dest="output_dir", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "GO_xref"), help="Indicate the directory to write the <name>.xref.npz tables to, by default the GO_xref directory GO_Xrefs loads. ")
+    build_parser.add_argument("--release", dest="release", help="Indicate a release label to record with the tables, by default the version date of each file. ")
+    build_parser.add_argument("--strict", dest="strict", action="store_true", help="Fail on malformed lines instead of leaving them out. ")
+    build_parser.set_defaults(func=build_tables)
+    info_parser = subparsers.add_parser("info", help="Show what the packed tables of a directory were built from.")
+    info_parser.add_argument("--xref_dir", dest="xref_dir", required=True, help="Indicate the cross-reference table directory.")
+    info_parser.set_defaults(func=tables_info)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = _get_args()
+    sys.exit(args.func(args))
@@ -0,0 +1,100 @@
+"""
+Sparse feature x sample count matrices, for summarizing many samples together.
+"""
+import numpy
+import pandas
+import scipy.io
+import scipy.sparse
+from typing import Dict, List
+
+MATRIX_FORMATS = ["mtx", "parquet", "hdf5"]
+
+
+class FeatureMatrix:
+    """
+    A sparse feature x sample matrix of counts.
+
+    features - array of feature ids, one per row
+    samples - list of sample ids, one per column
+    counts - scipy.sparse csr matrix of shape (len(features), len(samples))
+    """
+    def __init__(self, features: numpy.ndarray, samples: List[str], counts: scipy.sparse.csr_matrix):
+        self.features = features
+        self.samples = samples
+        self.counts = counts
+
+    @classmethod
+    def from_sample_counts(cls, sample_counts: List[Dict[str, float]], samples: List[str]) -> "FeatureMatrix":
+        """
+        Merges per-sample dicts of feature -> count into one matrix. Features are ordered by their
+        first appearance, going through the samples in order.
+        """
+        sample_features = [numpy.asarray(list(counts.keys()), dtype=object) for counts in sample_counts]
+        all_features = numpy.concatenate(sample_features + [numpy.array([], dtype=object)])
+        codes, features = pandas.factorize(all_features)
+        columns = numpy.repeat(numpy.arange(len(samples)), [len(f) for f in sample_features])
+        values = numpy.concatenate([numpy.asarray(list(counts.values())) for counts in sample_counts] + [numpy.array([], dtype=numpy.int64)])
+        counts = scipy.sparse.csr_matrix((values, (codes, columns)), shape=(len(features), len(samples)))
+        return cls(numpy.asarray(features, dtype=object), samples, counts)
+
+    def binary(self) -> "FeatureMatrix":
+        """
+        Returns a copy with every non-zero count set to 1.
+        """
+        counts = self.counts.copy()
+        counts.data = (counts.data != 0).astype(numpy.int64)
+        return FeatureMatrix(self.features, self.samples, counts)
+
+    def to_long(self) -> pandas.DataFrame:
+        """
+        Returns the non-zero counts as a long table with columns feature, sample, count.
+        """
+        coo = self.counts.tocoo()
+        return pandas.DataFrame({
+            "feature": pandas.Categorical.from_codes(coo.row, categories=pandas.Index(self.features, dtype=object)),
+            "sample": pandas.Categorical.from_codes(coo.col, categories=pandas.Index(self.samples, dtype=object)),
+            "count": coo.data
+        })
+
+    def write(self, path_prefix: str, matrix_format: str = "mtx") -> List[str]:
+        """
+        Writes the matrix, keeping it sparse.
+
+        mtx - Matrix Market file <prefix>.mtx, with row and column ids in <prefix>.features.txt and
+            <prefix>.samples.txt
+        parquet - long table of non-zero counts in <prefix>.parquet (requires pyarrow)
+        hdf5 - long table of non-zero counts in <prefix>.h5, under the key "counts" (requires tables)
+
+        :returns: list of paths written
+        """
+        if matrix_format == "mtx":
+            paths = [f"{path_prefix}.mtx", f"{path_prefix}.features.txt", f"{path_prefix}.samples.txt"]
+            scipy.io.mmwrite(paths[0], self.counts)
+            for path, ids in zip(paths[1:], [self.features, self.samples]):
+                with open(path, "w") as f:
+                    f.writelines(f"{item}\n" for item in ids)
+            return paths
+        if matrix_format == "parquet":
+            path = f"{path_prefix}.parquet"
+            self.to_long().to_parquet(path, index=False)
+            return [path]
+        if matrix_format == "hdf5":
+            path = f"{path_prefix}.h5"
+            long_counts = self.to_long()
+            for col in ["feature", "sample"]:
+                long_counts[col] = long_counts[col].astype(str)
+            long_counts.to_hdf(path, key="counts", mode="w", format="table")
+            return [path]
+        raise ValueError(f"Unknown matrix format {matrix_format}, options are {', '.join(MATRIX_FORMATS)}")
+
+
+def read_feature_matrix(path_prefix: str) -> FeatureMatrix:
+    """
+    Reads a matrix written with FeatureMatrix.write(path_prefix, "mtx").
+    """
+    counts = scipy.sparse.csr_matrix(scipy.io.mmread(f"{path_prefix}.mtx"))
+    with open(f"{path_prefix}.features.txt") as f:
+        features = numpy.asarray(f.read().splitlines(), dtype=object)
+    with open(f"{path_prefix}.samples.txt") as f:
+        samples = f.read().splitlines()
+    return FeatureMatrix(features, samples, counts)
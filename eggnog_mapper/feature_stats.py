@@ -0,0 +1,177 @@
+"""
+Diversity and summary statistics of the feature counts, accumulated while the counts are built.
+
+For each category, FeatureStats keeps a sparse taxon x feature cross-tab: the (weighted) count
+of each feature summed over the contigs of each consensus taxonomy ("NA" for contigs without
+one). It's filled from the same per-contig counts that are added to the running feature
+totals, so the statistics don't need the count tables to be read back. The stats report has
+the richness, Shannon and Simpson diversity and top features of the totals, and the same for
+each taxon from the cross-tab.
+"""
+import json
+import numpy
+import pandas
+import scipy.sparse
+import metrics
+from typing import Dict, List, Mapping
+from interning import Vocabulary
+from output import write_table
+
+# number of features listed in the top features of the report, see --stats_top
+TOP_FEATURES = 10
+# cross-tab entries buffered before they're summed into the sparse matrix
+_FOLD_ENTRIES = 1 << 20
+
+
+class FeatureStats:
+    """
+    Accumulates the taxon x feature cross-tab of one category over contigs.
+
+    taxa - Vocabulary of consensus taxonomies, one per cross-tab row
+    features - Vocabulary of features, one per cross-tab column
+    """
+    def __init__(self):
+        self.taxa = Vocabulary()
+        self.features = Vocabulary()
+        self._crosstab = scipy.sparse.csr_matrix((0, 0), dtype=numpy.int64)
+        self._pending = []
+        self._pending_entries = 0
+
+    def add(self, taxon: str, contig_counts: Dict[str, float]):
+        """
+        Adds the feature counts of a single contig with the given consensus taxonomy.
+        """
+        if not contig_counts:
+            return
+        taxon_id = self.taxa.intern([taxon])[0]
+        feature_ids = self.features.intern(contig_counts.keys())
+        self._add_entries(numpy.full(len(feature_ids), taxon_id), feature_ids, numpy.asarray(list(contig_counts.values())))
+
+    def add_contigs(self, contig_taxa: numpy.ndarray, contigs: numpy.ndarray, features: numpy.ndarray, counts: numpy.ndarray):
+        """
+        Adds the feature counts of a batch of contigs at once.
+
+        :param contig_taxa: consensus taxonomy of each contig number
+        :param contigs: contig number of each entry
+        :param features: feature of each entry
+        :param counts: count of each entry
+        """
+        if len(features) == 0:
+            return
+        taxon_ids = self.taxa.intern_array(numpy.asarray(contig_taxa, dtype=object)[contigs])
+        self._add_entries(taxon_ids, self.features.intern_array(features), numpy.asarray(counts))
+
+    def _add_entries(self, taxon_ids: numpy.ndarray, feature_ids: numpy.ndarray, counts: numpy.ndarray):
+        self._pending.append((taxon_ids, feature_ids, counts))
+        self._pending_entries += len(counts)
+        if self._pending_entries >= _FOLD_ENTRIES:
+            self._fold()
+
+    def _fold(self):
+        # sums the buffered entries into the cross-tab, growing it to the current vocabularies
+        shape = (len(self.taxa), len(self.features))
+        crosstab = self._crosstab
+        crosstab.resize(shape)
+        if self._pending:
+            taxon_ids, feature_ids, counts = (numpy.concatenate(parts) for parts in zip(*self._pending))
+            crosstab = crosstab + scipy.sparse.csr_matrix((counts, (taxon_ids, feature_ids)), shape=shape)
+        self._crosstab = crosstab
+        self._pending = []
+        self._pending_entries = 0
+
+    def crosstab(self) -> scipy.sparse.csr_matrix:
+        """
+        Returns the taxon x feature counts, rows in the order of self.taxa.items and columns in
+        the order of self.features.items.
+        """
+        self._fold()
+        return self._crosstab
+
+    def to_long(self) -> pandas.DataFrame:
+        """
+        Returns the non-zero cross-tab counts as a long table with columns taxon, feature,
+        count. Taxa are in order of first appearance, and the features of each taxon by
+        decreasing count.
+        """
+        coo = self.crosstab().tocoo()
+        positive = coo.data > 0
+        rows, cols, counts = coo.row[positive], coo.col[positive], coo.data[positive]
+        order = numpy.lexsort((cols, -counts, rows))
+        return pandas.DataFrame({
+            "taxon": numpy.asarray(self.taxa.items, dtype=object)[rows[order]] if len(order) else numpy.zeros(0, dtype=object),
+            "feature": numpy.asarray(self.features.items, dtype=object)[cols[order]] if len(order) else numpy.zeros(0, dtype=object),
+            "count": counts[order]
+        })
+
+
+def diversity(counts: numpy.ndarray) -> Dict[str, float]:
+    """
+    Returns the total, richness (number of features with a positive count), Shannon index
+    (natural log) and Simpson index (1 - sum of squared proportions) of a set of counts.
+    """
+    counts = numpy.asarray(counts, dtype=numpy.float64)
+    counts = counts[counts > 0]
+    total = counts.sum()
+    proportions = counts / total if total > 0 else counts
+    return {
+        "total": _number(total),
+        "richness": int(len(counts)),
+        "shannon": float(0.0 - (proportions * numpy.log(proportions)).sum()),
+        "simpson": float(1 - (proportions ** 2).sum()) if len(counts) else 0.0
+    }
+
+
+def _number(value) -> float:
+    # whole totals stay integers in the report
+    value = float(value)
+    return int(value) if value.is_integer() else value
+
+
+def _top_features(features: List[str], counts: numpy.ndarray, top_n: int) -> List[list]:
+    # highest counts first, ties in the given order
+    order = numpy.argsort(-numpy.asarray(counts, dtype=numpy.float64), kind="stable")[:top_n]
+    return [[features[i], _number(counts[i])] for i in order.tolist() if counts[i] > 0]
+
+
+def stats_report(totals: Mapping[str, float], feature_stats: FeatureStats, top_n: int = TOP_FEATURES) -> Dict:
+    """
+    Builds the stats report of one category.
+
+    :param totals: dict feature -> total count, as written to the direct count table
+    :param feature_stats: the category's FeatureStats
+    :param top_n: number of top features to list, overall and per taxon
+    :returns: dict with the diversity of the totals (see diversity), top_features as
+        [feature, count] pairs, and taxa, a list with the diversity and top features of
+        each taxon, by decreasing total
+    """
+    features = list(totals.keys())
+    counts = numpy.asarray(list(totals.values()), dtype=numpy.float64)
+    report = diversity(counts)
+    report["top_features"] = _top_features(features, counts, top_n)
+
+    crosstab = feature_stats.crosstab()
+    taxon_features = numpy.asarray(feature_stats.features.items, dtype=object)
+    taxa = []
+    for taxon, row in zip(feature_stats.taxa.items, crosstab):
+        taxon_report = {"taxon": taxon}
+        taxon_report.update(diversity(row.data))
+        taxon_report["top_features"] = _top_features(taxon_features[row.indices].tolist(), row.data, top_n)
+        taxa.append(taxon_report)
+    # by decreasing total, ties in order of first appearance
+    report["taxa"] = sorted(taxa, key=lambda taxon_report: -taxon_report["total"])
+    return report
+
+
+def write_stats(path_stem: str, totals: Mapping[str, float], feature_stats: FeatureStats, top_n: int = TOP_FEATURES, output_format: str = "csv") -> List[str]:
+    """
+    Writes the stats report of one category to <path_stem>_stats.json, and its taxon x
+    feature cross-tab as a long table to <path_stem>_taxon_count_table (see
+    output.write_table).
+
+    :returns: paths written
+    """
+    report_path = f"{path_stem}_stats.json"
+    with open(report_path, "w") as f:
+        json.dump(stats_report(totals, feature_stats, top_n), f, indent=1)
+    metrics.output(report_path)
+    return [report_path, write_table(f"{path_stem}_taxon_count_table", feature_stats.to_long(), output_format)]
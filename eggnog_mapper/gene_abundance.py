@@ -0,0 +1,156 @@
+"""
+Per-gene abundance weighting.
+
+Instead of counting each gene once (or once times its contig's coverage), each gene can count
+with a weight computed from its own abundance and length:
+    rpk - reads per kilobase, read count / (gene length / 1000)
+    tpm - transcripts per million, the RPK of each gene scaled so the RPKs of all genes in
+        the abundance file sum to 1,000,000
+    cov_length - mean coverage x gene length, i.e. the bases mapped to the gene
+The count of a feature is then the sum of the weights of the genes annotated with it.
+
+Abundances (read counts for rpk and tpm, coverages for cov_length) and gene lengths are keyed
+by query_name. The weights are computed once, as arrays over all genes, and joined onto each
+annotation chunk as it's read (see attach_gene_weights), so there is no per-gene lookup in
+Python.
+"""
+import re
+import csv
+import numpy
+import pandas
+from typing import Iterable, Iterator
+from aggregate import WEIGHT_COLUMN
+from contigs import BLOCK_SIZE, open_fasta, read_lengths_table
+from coverage import load_coverages
+from interning import ContigValues
+from util import isfloat
+
+GENE_WEIGHTINGS = ["rpk", "tpm", "cov_length"]
+
+# "><query_name> # <start> # <end> # <strand> # ..." headers of prodigal protein and gene files
+_PRODIGAL_HEADER = re.compile(rb"^>(\S+) # (\d+) # (\d+) #", re.MULTILINE)
+GFF_EXTENSIONS = (".gff", ".gff3", ".gff.gz", ".gff3.gz")
+
+
+def _prodigal_lengths(path: str) -> ContigValues:
+    # gene lengths from the coordinates in the FASTA headers, scanned a block at a time
+    names, starts, ends = [], [], []
+    pending = b""
+    with open_fasta(path) as f:
+        while True:
+            block = f.read(BLOCK_SIZE)
+            if not block:
+                break
+            block = pending + block
+            # only whole lines are searched, the last one is carried over to the next block
+            end = block.rfind(b"\n") + 1
+            block, pending = block[:end], block[end:]
+            for name, start, stop in _PRODIGAL_HEADER.findall(block):
+                names.append(name)
+                starts.append(start)
+                ends.append(stop)
+    for name, start, stop in _PRODIGAL_HEADER.findall(pending):
+        names.append(name)
+        starts.append(start)
+        ends.append(stop)
+    lengths = numpy.asarray(ends, dtype=numpy.int64) - numpy.asarray(starts, dtype=numpy.int64) + 1
+    return ContigValues.from_items([name.decode() for name in names], lengths)
+
+
+def _gff_lengths(path: str) -> ContigValues:
+    # CDS lengths of a GFF file, named like prodigal names its proteins: the n-th CDS on a
+    # sequence is <sequence id>_<n>
+    features = pandas.read_csv(
+        path,
+        sep="\t",
+        header=None,
+        comment="#",
+        usecols=[0, 2, 3, 4],
+        names=["seqid", "type", "start", "end"],
+        dtype={"seqid": str, "type": str},
+        keep_default_na=False,
+        quoting=csv.QUOTE_NONE
+    )
+    # rows of an embedded ##FASTA section have a single column
+    cds = features[features["type"] == "CDS"]
+    numbers = cds.groupby("seqid", sort=False).cumcount().to_numpy() + 1
+    names = cds["seqid"].to_numpy(dtype=object) + "_" + numbers.astype(str).astype(object)
+    lengths = cds["end"].to_numpy(dtype=numpy.int64) - cds["start"].to_numpy(dtype=numpy.int64) + 1
+    return ContigValues.from_items(names, lengths)
+
+
+def load_gene_lengths(path: str) -> ContigValues:
+    """
+    Reads the length of each gene (in bases), keyed by query_name, from one of:
+        - prodigal protein or gene FASTA files (optionally gzipped), from the coordinates in the
+          headers
+        - GFF files (.gff or .gff3, or starting with ##gff-version), from the CDS coordinates.
+          The n-th CDS on a sequence is named <sequence id>_<n>, as prodigal names its proteins
+        - tables of query_name and length, with or without a header line
+
+    :param path: gene length file path
+    :returns: ContigValues of query_name -> length
+    """
+    with open_fasta(path) as f:
+        first_line = f.readline().decode(errors="replace")
+    if first_line.startswith(">"):
+        return _prodigal_lengths(path)
+    if first_line.startswith("##gff-version") or path.endswith(GFF_EXTENSIONS):
+        return _gff_lengths(path)
+    fields = first_line.rstrip("\r\n").split("\t")
+    return read_lengths_table(path, 0 if len(fields) < 2 or isfloat(fields[1]) else 1)
+
+
+def gene_weights(abundances: ContigValues, lengths: ContigValues, weighting: str) -> ContigValues:
+    """
+    Computes the weight of every gene with both an abundance and a length (see the module
+    docstring for the weightings).
+
+    :param abundances: query_name -> read count (rpk, tpm) or coverage (cov_length)
+    :param lengths: query_name -> gene length in bases
+    :param weighting: one of GENE_WEIGHTINGS
+    :returns: ContigValues of query_name -> weight
+    """
+    if weighting not in GENE_WEIGHTINGS:
+        raise ValueError(f"Unknown gene weighting {weighting}, options are {', '.join(GENE_WEIGHTINGS)}")
+    genes, values = abundances.to_arrays()
+    gene_lengths, has_length = lengths.lookup(genes)
+    usable = has_length & (gene_lengths > 0)
+    genes, values, gene_lengths = genes[usable], values[usable].astype(numpy.float64), gene_lengths[usable]
+    if weighting == "cov_length":
+        weights = values * gene_lengths
+    else:
+        weights = values / (gene_lengths / 1000)
+        if weighting == "tpm":
+            total = weights.sum()
+            weights = weights / total * 1e6 if total > 0 else weights
+    return ContigValues.from_items(genes, weights)
+
+
+def load_gene_weights(abundance_path: str, lengths_path: str, weighting: str) -> ContigValues:
+    """
+    Reads the gene abundances (a tab-separated file of query_name and read count or coverage,
+    see coverage.load_coverages) and gene lengths (see load_gene_lengths) and computes the
+    gene weights. Genes without a length are left out, with a warning.
+
+    :returns: ContigValues of query_name -> weight
+    """
+    abundances = load_coverages(abundance_path)
+    weights = gene_weights(abundances, load_gene_lengths(lengths_path), weighting)
+    if len(weights) < len(abundances):
+        print(f"{len(abundances) - len(weights)} of {len(abundances)} genes in {abundance_path} have no length in {lengths_path} and are left out")
+    return weights
+
+
+def attach_gene_weights(annotation_chunks: Iterable[pandas.DataFrame], weights: ContigValues) -> Iterator[pandas.DataFrame]:
+    """
+    Adds the gene_weight column to each annotation chunk as it's read, by looking up the query
+    names of the whole chunk at once. Genes without a weight get 0, so they don't add to any
+    feature.
+    """
+    if isinstance(annotation_chunks, pandas.DataFrame):
+        annotation_chunks = [annotation_chunks]
+    for annotation_data in annotation_chunks:
+        annotation_data = annotation_data.copy()
+        annotation_data[WEIGHT_COLUMN] = weights.lookup(annotation_data["query_name"].to_numpy(dtype=object))[0]
+        yield annotation_data
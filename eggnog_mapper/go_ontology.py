@@ -0,0 +1,284 @@
+"""
+Gene Ontology ancestor closure, for rolling GO annotations up to their ancestor terms.
+
+The is_a and part_of relations of a GO OBO file are compiled into a sparse term x ancestor
+matrix (the transitive closure, with every term its own ancestor). The matrix is cached next to
+the OBO file in .go_closure/, memory-mapped on later runs, and rebuilt when the OBO file
+changes.
+
+Annotations are propagated gene by gene: each gene counts once for every term that is one of
+its GO terms or an ancestor of one, however many of its terms share that ancestor.
+"""
+import os
+import sys
+import json
+import numpy
+import pandas
+import scipy.sparse
+from typing import Dict, List, Tuple
+
+# relations followed up the DAG
+PROPAGATE_RELATIONS = ["is_a", "part_of"]
+
+# compiled closure location (relative to the OBO file directory) and format version
+CLOSURE_DIR = ".go_closure"
+CLOSURE_VERSION = 1
+CLOSURE_ARRAYS = ["term_ids", "indptr", "ancestors", "alt_ids", "alt_terms"]
+
+# closures unpickled in this process, by OBO path: (source key, GOClosure)
+_WORKER_CLOSURES = {}
+
+
+def parse_obo(path: str) -> Tuple[List[str], List[Tuple[str, str]], Dict[str, str]]:
+    """
+    Reads the terms of an OBO file.
+
+    :param path: path to the OBO file, e.g. go-basic.obo
+    :returns: tuple of
+        term_ids - list of term ids, in file order
+        edges - list of (term id, parent id) pairs for the PROPAGATE_RELATIONS
+        alt_ids - dict alternative id -> term id
+    """
+    term_ids, edges, alt_ids = [], [], {}
+    term_id = None
+    in_term = False
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith("["):
+                term_id = None
+                in_term = line == "[Term]"
+                continue
+            if not line or not in_term:
+                continue
+            tag, _, value = line.partition(": ")
+            value = value.split(" !")[0].strip()
+            if tag == "id":
+                term_id = value
+                term_ids.append(term_id)
+            elif term_id is None:
+                continue
+            elif tag == "is_a" and "is_a" in PROPAGATE_RELATIONS:
+                edges.append((term_id, value.split()[0]))
+            elif tag == "relationship":
+                relation, _, parent = value.partition(" ")
+                if relation in PROPAGATE_RELATIONS:
+                    edges.append((term_id, parent.split()[0]))
+            elif tag == "alt_id":
+                alt_ids[value] = term_id
+    return term_ids, edges, alt_ids
+
+
+class GOClosure:
+    """
+    The ancestors of every GO term, in compressed sparse row form: the ancestors of term_ids[i]
+    (including itself) are term_ids[ancestors[indptr[i]:indptr[i+1]]], in term order.
+    alt_ids[j] is another id of term_ids[alt_terms[j]].
+    """
+    def __init__(self, term_ids: numpy.ndarray, indptr: numpy.ndarray, ancestors: numpy.ndarray, alt_ids: numpy.ndarray, alt_terms: numpy.ndarray, source: str = None):
+        self.term_ids = term_ids
+        self.indptr = indptr
+        self.ancestors = ancestors
+        self.alt_ids = alt_ids
+        self.alt_terms = alt_terms
+        self.source = source
+        self._index = None
+        self._matrix = None
+
+    def __len__(self) -> int:
+        return len(self.term_ids)
+
+    def __reduce__(self):
+        # loaded from the OBO file, a worker process maps the cached closure itself, once
+        if self.source is not None:
+            return worker_go_closure, (self.source,)
+        return GOClosure, (self.term_ids, self.indptr, self.ancestors, self.alt_ids, self.alt_terms)
+
+    @classmethod
+    def from_edges(cls, term_ids: List[str], edges: List[Tuple[str, str]], alt_ids: Dict[str, str], source: str = None) -> "GOClosure":
+        """
+        Computes the transitive closure of the (term, parent) edges by repeated squaring of the
+        sparse parent matrix. Parents that aren't terms themselves are left out.
+        """
+        index = pandas.Index(numpy.asarray(term_ids, dtype=object))
+        edges = numpy.asarray(edges, dtype=object).reshape(-1, 2)
+        children, parents = index.get_indexer(edges[:, 0]), index.get_indexer(edges[:, 1])
+        known = (children >= 0) & (parents >= 0)
+        n = len(term_ids)
+        closure = scipy.sparse.identity(n, dtype=numpy.int32, format="csr") + scipy.sparse.csr_matrix(
+            (numpy.ones(known.sum(), dtype=numpy.int32), (children[known], parents[known])), shape=(n, n)
+        )
+        closure.data[:] = 1
+        while True:
+            squared = (closure @ closure).tocsr()
+            squared.data[:] = 1
+            if squared.nnz == closure.nnz:
+                break
+            closure = squared
+        closure.sort_indices()
+        alt_terms = index.get_indexer(numpy.asarray(list(alt_ids.values()), dtype=object))
+        return cls(
+            numpy.asarray(term_ids, dtype=str),
+            closure.indptr.astype(numpy.int64),
+            closure.indices.astype(numpy.int32),
+            numpy.asarray(list(alt_ids.keys()), dtype=str)[alt_terms >= 0],
+            alt_terms[alt_terms >= 0].astype(numpy.int32),
+            source
+        )
+
+    @property
+    def matrix(self) -> scipy.sparse.csr_matrix:
+        """
+        Sparse term x ancestor matrix of ones, built on first use.
+        """
+        if self._matrix is None:
+            n = len(self.term_ids)
+            self._matrix = scipy.sparse.csr_matrix((numpy.ones(len(self.ancestors), dtype=numpy.int32), self.ancestors, self.indptr), shape=(n, n))
+        return self._matrix
+
+    def term_codes(self, go_ids) -> numpy.ndarray:
+        """
+        Returns the position of each GO id (or of the term it's an alternative id of) in
+        term_ids, or -1 for ids that aren't in the ontology.
+        """
+        if self._index is None:
+            self._index = pandas.Index(numpy.concatenate([numpy.asarray(self.term_ids, dtype=object), numpy.asarray(self.alt_ids, dtype=object)]))
+            self._index_terms = numpy.concatenate([numpy.arange(len(self.term_ids)), numpy.asarray(self.alt_terms, dtype=numpy.int64)])
+        codes = self._index.get_indexer(numpy.asarray(go_ids, dtype=object))
+        return numpy.where(codes >= 0, self._index_terms[codes], -1)
+
+    def propagate(self, genes: numpy.ndarray, go_ids: numpy.ndarray) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """
+        Rolls (gene, GO id) pairs up to (gene, ancestor) pairs, with each ancestor listed once
+        per gene. The pairs of each gene are its ancestors in term order, then any of its GO ids
+        that aren't in the ontology, in their original order.
+
+        :param genes: integer gene (row) number of each pair, in ascending order
+        :param go_ids: GO id of each pair
+        :returns: tuple of (genes, GO ids) arrays
+        """
+        genes = numpy.asarray(genes, dtype=numpy.int64)
+        go_ids = numpy.asarray(go_ids, dtype=object)
+        codes = self.term_codes(go_ids)
+        known = codes >= 0
+        gene_codes, gene_numbers = pandas.factorize(genes)
+        gene_terms = scipy.sparse.csr_matrix(
+            (numpy.ones(known.sum(), dtype=numpy.int32), (gene_codes[known], codes[known])), shape=(len(gene_numbers), len(self.term_ids))
+        )
+        # one product for all genes, shared ancestors are counted once by keeping the pattern
+        rolled_up = (gene_terms @ self.matrix).tocsr()
+        rolled_up.sort_indices()
+        rows = numpy.repeat(numpy.arange(len(gene_numbers)), numpy.diff(rolled_up.indptr))
+        known_pairs = pandas.DataFrame({"gene": rows, "order": 0, "go_id": numpy.asarray(self.term_ids, dtype=object)[rolled_up.indices]})
+        unknown = pandas.DataFrame({"gene": gene_codes[~known], "order": 1, "go_id": go_ids[~known]}).drop_duplicates(["gene", "go_id"])
+        pairs = pandas.concat([known_pairs, unknown], ignore_index=True).sort_values(["gene", "order"], kind="stable")
+        return numpy.asarray(gene_numbers)[pairs["gene"].to_numpy()], pairs["go_id"].to_numpy(dtype=object)
+
+    def propagate_terms(self, go_ids: List[str]) -> List[str]:
+        """
+        Same as propagate(), for the GO ids of a single gene.
+        """
+        return self.propagate(numpy.zeros(len(go_ids), dtype=numpy.int64), go_ids)[1].tolist()
+
+
+def _source_key(path: str) -> dict:
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "version": CLOSURE_VERSION}
+
+
+def _closure_path(closure_dir: str, name: str, array: str) -> str:
+    return os.path.join(closure_dir, f"{name}.{array}.npy")
+
+
+def _read_manifest(closure_dir: str) -> dict:
+    try:
+        with open(os.path.join(closure_dir, "manifest.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_array(path: str, array: numpy.ndarray):
+    # other processes may be memory-mapping the array at path, so it's replaced atomically
+    tmp_path = f"{path}.{os.getpid()}"
+    try:
+        with open(tmp_path, "wb") as f:
+            numpy.save(f, array)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def load_go_closure(obo_path: str, write_cache: bool = True) -> GOClosure:
+    """
+    Loads the ancestor closure of an OBO file from its cache in .go_closure/ next to it,
+    memory-mapping the arrays. If the cache is missing or older than the OBO file, the OBO file
+    is parsed and the cache rebuilt. Each array is written to a temporary file and moved into
+    place, so processes mapping the old arrays aren't affected. If the cache can't be written,
+    the computed closure is returned anyway.
+
+    :param obo_path: path to the GO OBO file
+    :param write_cache: if False, a missing or outdated cache is left as it is
+    :returns: GOClosure
+    """
+    obo_path = os.path.abspath(obo_path)
+    closure_dir = os.path.join(os.path.dirname(obo_path), CLOSURE_DIR)
+    name = os.path.basename(obo_path)
+    source_key = _source_key(obo_path)
+    if _read_manifest(closure_dir).get(name) == source_key:
+        try:
+            return GOClosure(*[numpy.load(_closure_path(closure_dir, name, array), mmap_mode="r") for array in CLOSURE_ARRAYS], source=obo_path)
+        except (OSError, ValueError):
+            pass
+    closure = GOClosure.from_edges(*parse_obo(obo_path), source=obo_path)
+    if not write_cache:
+        return closure
+    try:
+        os.makedirs(closure_dir, exist_ok=True)
+        for array in CLOSURE_ARRAYS:
+            _save_array(_closure_path(closure_dir, name, array), getattr(closure, array))
+        manifest = _read_manifest(closure_dir)
+        manifest[name] = source_key
+        tmp_path = os.path.join(closure_dir, f"manifest.json.{os.getpid()}")
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, os.path.join(closure_dir, "manifest.json"))
+    except OSError:
+        pass
+    return closure
+
+
+def worker_go_closure(obo_path: str) -> GOClosure:
+    """
+    Returns the closure of an OBO file loaded in this process, loading it if it's not loaded
+    yet or the OBO file has changed since (see load_go_closure). This is how a GOClosure sent
+    to a worker process with each shard is unpickled, so that every worker loads the closure
+    and builds its term index and matrix once, rather than for every shard.
+
+    Workers only read the cache, which the parent process has brought up to date by loading
+    the closure before sending it. If the cache couldn't be written, each worker parses the
+    OBO file once.
+    """
+    obo_path = os.path.abspath(obo_path)
+    source_key = _source_key(obo_path)
+    loaded = _WORKER_CLOSURES.get(obo_path)
+    if loaded is None or loaded[0] != source_key:
+        loaded = _WORKER_CLOSURES[obo_path] = (source_key, load_go_closure(obo_path, write_cache=False))
+    return loaded[1]
+
+
+def obo_key(obo_path: str) -> dict:
+    """
+    Returns what identifies a version of the OBO file (size and mtime), e.g. to tell whether
+    stored propagated counts are still up to date.
+    """
+    key = _source_key(os.path.abspath(obo_path))
+    key["path"] = os.path.abspath(obo_path)
+    return key
+
+
+if __name__ == "__main__":
+    # compile the closure ahead of time
+    closure = load_go_closure(sys.argv[1])
+    print(f"{len(closure)} GO terms, {len(closure.ancestors)} term-ancestor pairs")
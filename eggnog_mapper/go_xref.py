@@ -1,5 +1,15 @@
+import io
 import os
-from collections import defaultdict
+import re
+import sys
+import gzip
+import json
+import hashlib
+import numpy
+import pandas
+import scipy.sparse
+from collections.abc import Mapping
+from typing import Dict, List, Sequence, Tuple
 
 XREF_TYPES = [
     "ec2go",
@@ -22,23 +32,490 @@ XREF_TYPES = [
     "unirule2go"
 ]
 
+# compiled index location (relative to the cross-reference table directory) and format version
+INDEX_DIR = ".xref_index"
+INDEX_VERSION = 2
+INDEX_ARRAYS = ["go_ids", "indptr", "targets", "target_ids"]
+# packed tables built by eggnog_xrefs.py, <name>.xref.npz next to the .clean files
+PACKED_SUFFIX = ".xref.npz"
+PACKED_VERSION = 1
+
+GO_ID_PATTERN = r"GO:\d{7}"
+# "<target> > GO:<GO name> ; <GO id>" lines of the upstream external2go files
+_RAW_LINE = r"(?P<target>.+) > (?P<go_name>.*) ; (?P<go_id>\S+)"
+# "<target> \t <GO name> \t <GO id>" lines of the .clean files
+_CLEAN_LINE = r"(?P<target>[^\t]*)\t(?P<go_name>[^\t]*)\t(?P<go_id>[^\t]*)"
+# upstream header lines, e.g. "!version date: 2022/06/28 10:02:25"
+_HEADER_LINE = re.compile(r"^!\s*([^:]+):\s*(.*)$")
+# number of malformed lines quoted in the build statistics
+_MALFORMED_EXAMPLES = 5
+
+
+class XrefTable(Mapping):
+    """
+    A read-only mapping from GO id to the list of ids in another namespace.
+
+    The table is stored in compressed sparse row form: go_ids[i] maps to
+    target_ids[targets[indptr[i]:indptr[i+1]]]. GO ids are kept in the order they first appear
+    in the source file, and the targets of each GO id in file order. Each (GO id, target) pair
+    appears once.
+
+    Like the defaultdict it replaces, looking up a GO id that isn't in the table returns an
+    empty list.
+    """
+    def __init__(self, go_ids: numpy.ndarray, indptr: numpy.ndarray, targets: numpy.ndarray, target_ids: numpy.ndarray):
+        self.go_ids = go_ids
+        self.indptr = indptr
+        self.targets = targets
+        self.target_ids = target_ids
+        self._rows = None
+
+    @property
+    def rows(self) -> Dict[str, int]:
+        """
+        dict GO id -> row number, built on first use.
+        """
+        if self._rows is None:
+            self._rows = {go_id: row for row, go_id in enumerate(self.go_ids.tolist())}
+        return self._rows
+
+    def __getitem__(self, go_id: str) -> List[str]:
+        row = self.rows.get(go_id)
+        if row is None:
+            return []
+        return self.target_ids[self.targets[self.indptr[row]:self.indptr[row + 1]]].tolist()
+
+    def __contains__(self, go_id) -> bool:
+        return go_id in self.rows
+
+    def __iter__(self):
+        return iter(self.go_ids.tolist())
+
+    def __len__(self) -> int:
+        return len(self.go_ids)
+
+    @classmethod
+    def from_dict(cls, xref_table: Mapping) -> "XrefTable":
+        """
+        Builds an XrefTable from a dict of GO id -> list of target ids. Targets repeated for a
+        GO id are kept once.
+        """
+        go_ids = list(xref_table.keys())
+        lists = [xref_table[go_id] for go_id in go_ids]
+        go_codes = numpy.repeat(numpy.arange(len(go_ids)), [len(targets) for targets in lists])
+        return _pack_pairs(go_codes, go_ids, [t for targets in lists for t in targets])
+
+    def entries(self, rows: numpy.ndarray) -> numpy.ndarray:
+        """
+        Returns the positions in targets of all entries of the given rows, row by row.
+        """
+        starts = self.indptr[rows]
+        lengths = self.indptr[rows + 1] - starts
+        offsets = numpy.repeat(numpy.cumsum(lengths) - lengths, lengths)
+        return numpy.repeat(starts, lengths) + numpy.arange(lengths.sum()) - offsets
+
+
+def _pack_pairs(go_codes: numpy.ndarray, go_ids: Sequence[str], targets: Sequence[str]) -> XrefTable:
+    # CSR arrays of the (go_ids[go_codes[i]], targets[i]) pairs, repeated pairs kept once
+    go_codes = numpy.asarray(go_codes, dtype=numpy.int64)
+    target_codes, target_ids = pandas.factorize(pandas.Series(targets, dtype=object))
+    first = ~pandas.Index(go_codes * max(len(target_ids), 1) + target_codes).duplicated()
+    go_codes, target_codes = go_codes[first], target_codes[first]
+    order = numpy.argsort(go_codes, kind="stable")
+    indptr = numpy.zeros(len(go_ids) + 1, dtype=numpy.int64)
+    numpy.cumsum(numpy.bincount(go_codes, minlength=len(go_ids)), out=indptr[1:])
+    return XrefTable(
+        numpy.asarray(go_ids, dtype=str),
+        indptr,
+        target_codes[order].astype(numpy.int32),
+        numpy.asarray(target_ids, dtype=str)
+    )
+
+
+def read_xref_lines(path: str) -> List[str]:
+    """
+    Returns the lines of a plain or gzipped cross-reference file, in a single read.
+    """
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8", errors="replace", newline="") as f:
+        return f.read().splitlines()
+
+
+def normalize_xrefs(lines: Sequence[str]) -> Tuple[pandas.DataFrame, dict]:
+    """
+    Parses, normalizes and validates cross-reference lines, either upstream external2go lines
+    ("<target> > GO:<GO name> ; <GO id>") or .clean lines ("<target> \t <GO name> \t <GO id>",
+    used if the first line has a tab). Blank lines and "!" header lines are skipped.
+
+    Targets and GO ids are trimmed, and the prefix of GO ids upper-cased. Lines that don't parse, have an empty target or a GO id not of the form
+    GO:nnnnnnn are dropped as malformed, then repeated (GO id, target) pairs are dropped,
+    keeping the first, e.g. one target listed under several variants of a GO name.
+
+    :param lines: lines of a cross-reference file
+    :returns: (DataFrame with columns target and go_id in file order, dict of statistics: the
+        number of lines, rows kept, malformed and duplicate lines, and the first malformed
+        lines as [line number, line])
+    """
+    lines = pandas.Series(lines, dtype=object)
+    content = lines.str.strip().ne("") & ~lines.str.startswith("!")
+    data = lines[content]
+    pattern = _CLEAN_LINE if len(data) and "\t" in data.iloc[0] else _RAW_LINE
+    fields = data.str.strip(" ").str.extract(f"^{pattern}$")
+    targets = fields["target"].str.strip()
+    go_ids = fields["go_id"].str.strip().str.replace(r"^go:", "GO:", case=False, regex=True)
+    # lines that didn't parse have no fields
+    valid = (targets.fillna("").ne("") & go_ids.fillna("").str.fullmatch(GO_ID_PATTERN)).astype(bool)
+    table = pandas.DataFrame({"target": targets[valid], "go_id": go_ids[valid]})
+    duplicated = table.duplicated()
+    malformed = valid.index[~valid.to_numpy()]
+    stats = {
+        "lines": int(content.sum()),
+        "rows": int((~duplicated).sum()),
+        "malformed": len(malformed),
+        "duplicates": int(duplicated.sum()),
+        "malformed_lines": [[int(i) + 1, lines[i]] for i in malformed[:_MALFORMED_EXAMPLES]]
+    }
+    return table[~duplicated].reset_index(drop=True), stats
+
+
+def xref_table_from_frame(table: pandas.DataFrame) -> XrefTable:
+    """
+    Builds an XrefTable from the target and go_id columns of a normalized table (see
+    normalize_xrefs).
+    """
+    go_codes, go_ids = pandas.factorize(table["go_id"])
+    return _pack_pairs(go_codes, go_ids, table["target"].to_numpy(dtype=object))
+
+
+def parse_xref_table(path: str) -> XrefTable:
+    """
+    Parses a cross-reference table with the format:
+    Namespace ID \t GO name \t GO id
+
+    Identifiers are normalized and repeated pairs dropped (see normalize_xrefs). Malformed lines
+    are skipped with a warning.
+
+    :param path: path to the .clean file
+    :returns: XrefTable
+    """
+    table, stats = normalize_xrefs(read_xref_lines(path))
+    if stats["malformed"]:
+        line_number, line = stats["malformed_lines"][0]
+        print(f"Skipped {stats['malformed']} malformed lines of {path}, e.g. line {line_number}: {line!r}")
+    return xref_table_from_frame(table)
+
+
+def file_sha256(path: str) -> str:
+    """
+    Returns the hex SHA-256 checksum of a file, recorded as the provenance of packed tables.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_raw_header(lines: Sequence[str]) -> Dict[str, str]:
+    """
+    Returns the "!key: value" header fields of an upstream external2go file, e.g.
+    {"version date": "2022/06/28 10:02:25", "description": ...}.
+    """
+    header = {}
+    for line in lines:
+        if not line.startswith("!"):
+            break
+        match = _HEADER_LINE.match(line.strip())
+        if match and match.group(2):
+            header[match.group(1).strip()] = match.group(2).strip()
+    return header
+
+
+def packed_table_path(go_directory: str, name: str) -> str:
+    return os.path.join(go_directory, f"{name}{PACKED_SUFFIX}")
+
+
+def write_packed_table(path: str, table: XrefTable, metadata: dict):
+    """
+    Writes an XrefTable and its provenance metadata to a single .npz file, replacing path
+    atomically.
+    """
+    metadata = dict(metadata, format_version=PACKED_VERSION)
+    tmp_path = f"{path}.{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        numpy.savez(
+            f,
+            metadata=numpy.array(json.dumps(metadata, sort_keys=True)),
+            **{array: numpy.asarray(getattr(table, array)) for array in INDEX_ARRAYS}
+        )
+    os.replace(tmp_path, path)
+
+
+def read_packed_table(path: str) -> Tuple[XrefTable, dict]:
+    """
+    Reads a packed table written by write_packed_table, with a single read of the file.
+
+    :returns: (XrefTable, provenance metadata)
+    :raises ValueError: if the file was written by a newer, unsupported format version
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    with numpy.load(io.BytesIO(data), allow_pickle=False) as packed:
+        metadata = json.loads(str(packed["metadata"]))
+        if metadata.get("format_version", 0) > PACKED_VERSION:
+            raise ValueError(f"{path} has packed table format version {metadata['format_version']}, this version reads up to {PACKED_VERSION}. Rebuild it with eggnog_xrefs.py build.")
+        return XrefTable(*[packed[array] for array in INDEX_ARRAYS]), metadata
+
+
+def _table_source(go_directory: str, name: str) -> str:
+    # the packed table if one was built and the .clean file hasn't changed since, otherwise
+    # the .clean file
+    packed_path = packed_table_path(go_directory, name)
+    clean_path = os.path.join(go_directory, f"{name}.clean")
+    if os.path.exists(packed_path) and not _is_newer(clean_path, packed_path):
+        return packed_path
+    return clean_path
+
+
+def _is_newer(path: str, than_path: str) -> bool:
+    try:
+        return os.stat(path).st_mtime_ns > os.stat(than_path).st_mtime_ns
+    except OSError:
+        return False
+
+
+def _source_key(path: str) -> dict:
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "version": INDEX_VERSION}
+
+
+def _index_path(index_dir: str, name: str, array: str) -> str:
+    return os.path.join(index_dir, f"{name}.{array}.npy")
+
+
+def _read_manifest(index_dir: str) -> dict:
+    try:
+        with open(os.path.join(index_dir, "manifest.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_manifest(index_dir: str, manifest: dict):
+    tmp_path = os.path.join(index_dir, f"manifest.json.{os.getpid()}")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, os.path.join(index_dir, "manifest.json"))
+
+
+def _save_array(path: str, array: numpy.ndarray):
+    # other processes may be memory-mapping the array at path, so it's replaced atomically
+    tmp_path = f"{path}.{os.getpid()}"
+    try:
+        with open(tmp_path, "wb") as f:
+            numpy.save(f, array)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def load_xref_table(go_directory: str, name: str) -> XrefTable:
+    """
+    Loads one cross-reference table. A packed table built by eggnog_xrefs.py,
+    go_directory/<name>.xref.npz, is read whole, unless the .clean file has been changed
+    since it was built, which is then loaded instead with a warning. Otherwise the table is
+    loaded from the compiled index of the .clean file in go_directory/.xref_index,
+    memory-mapping its arrays.
+    If the index is missing or older than the source .clean file, the source is parsed and the
+    index rebuilt. Each array is written to a temporary file and moved into place before the
+    manifest is updated, so processes mapping the old arrays aren't affected. If the index
+    can't be written, the parsed table is returned anyway.
+
+    :param go_directory: directory containing <name>.xref.npz or <name>.clean
+    :param name: cross-reference table name, e.g. "ec2go"
+    :returns: XrefTable
+    """
+    packed_path = packed_table_path(go_directory, name)
+    source_path = _table_source(go_directory, name)
+    if source_path == packed_path:
+        return read_packed_table(packed_path)[0]
+    if os.path.exists(packed_path):
+        print(f"{source_path} has changed since {packed_path} was built, loading it instead. Rebuild the packed table with eggnog_xrefs.py build.")
+    index_dir = os.path.join(go_directory, INDEX_DIR)
+    source_key = _source_key(source_path)
+    if _read_manifest(index_dir).get(name) == source_key:
+        try:
+            return XrefTable(*[numpy.load(_index_path(index_dir, name, array), mmap_mode="r") for array in INDEX_ARRAYS])
+        except (OSError, ValueError):
+            pass
+    table = parse_xref_table(source_path)
+    try:
+        os.makedirs(index_dir, exist_ok=True)
+        for array in INDEX_ARRAYS:
+            _save_array(_index_path(index_dir, name, array), getattr(table, array))
+        manifest = _read_manifest(index_dir)
+        manifest[name] = source_key
+        _write_manifest(index_dir, manifest)
+    except OSError:
+        pass
+    return table
+
+
+def build_xref_index(go_directory: str) -> Dict[str, XrefTable]:
+    """
+    Compiles (or refreshes) the index for every table in XREF_TYPES.
+
+    :param go_directory: directory with the .clean cross-reference tables
+    :returns: dict of table name -> XrefTable
+    """
+    return {name: load_xref_table(go_directory, name) for name in XREF_TYPES}
+
+
+class XrefProjector:
+    """
+    Projects GO counts onto other namespaces with sparse matrix products.
+
+    Every table is an incidence matrix from GO ids to target ids, with each pair once. The
+    matrices of all tables share one GO axis and are stacked side by side, so the counts of
+    every namespace come from a single product. Counts can be a vector, or a GO x samples
+    matrix to project many samples at once.
+    """
+    def __init__(self, xref_tables: Mapping):
+        self.names = list(xref_tables.keys())
+        self.tables = {}
+        for name in self.names:
+            table = xref_tables[name]
+            self.tables[name] = table if isinstance(table, XrefTable) else XrefTable.from_dict(table)
+        self.go_index = pandas.Index(pandas.unique(numpy.concatenate(
+            [numpy.asarray(self.tables[name].go_ids, dtype=object) for name in self.names] + [numpy.array([], dtype=object)]
+        )))
+        rows, cols = [], []
+        self.offsets = {}
+        offset = 0
+        for name in self.names:
+            table = self.tables[name]
+            self.offsets[name] = offset
+            table_rows = self.go_index.get_indexer(numpy.asarray(table.go_ids, dtype=object))
+            rows.append(numpy.repeat(table_rows, numpy.diff(table.indptr)))
+            cols.append(offset + numpy.asarray(table.targets, dtype=numpy.int64))
+            offset += len(table.target_ids)
+        rows = numpy.concatenate(rows) if rows else numpy.array([], dtype=numpy.int64)
+        cols = numpy.concatenate(cols) if cols else numpy.array([], dtype=numpy.int64)
+        self.incidence = scipy.sparse.csr_matrix(
+            (numpy.ones(len(rows), dtype=numpy.int64), (rows, cols)), shape=(len(self.go_index), offset)
+        )
+
+    def project(self, go_ids: Sequence[str], counts: numpy.ndarray) -> Dict[str, Tuple[numpy.ndarray, numpy.ndarray]]:
+        """
+        Projects counts over go_ids onto every namespace.
+
+        Within each namespace, targets are ordered by the first GO id (in go_ids order) that
+        maps to them, then by their order in the table, which matches adding up the counts one
+        GO id at a time. Targets not reached by any of the GO ids are left out.
+
+        :param go_ids: sequence of unique GO ids
+        :param counts: array of counts, of shape (len(go_ids),), or a dense or sparse matrix of
+            shape (len(go_ids), samples)
+        :returns: dict namespace -> (target ids, projected counts) with one row per target.
+            Projected counts are sparse if counts were.
+        """
+        go_ids = numpy.asarray(go_ids, dtype=object)
+        vector = not scipy.sparse.issparse(counts) and numpy.ndim(counts) == 1
+        if scipy.sparse.issparse(counts):
+            counts = counts.tocsr()
+        else:
+            counts = numpy.asarray(counts).reshape(len(go_ids), -1)
+        rows = self.go_index.get_indexer(go_ids)
+        present = rows >= 0
+        projected = self.incidence[rows[present]].T @ counts[present]
+
+        results = {}
+        for name in self.names:
+            table = self.tables[name]
+            table_rows = pandas.Index(numpy.asarray(table.go_ids, dtype=object)).get_indexer(go_ids)
+            reached = pandas.unique(numpy.asarray(table.targets)[table.entries(table_rows[table_rows >= 0])])
+            values = projected[self.offsets[name] + reached]
+            results[name] = (numpy.asarray(table.target_ids)[reached], values[:, 0] if vector else values)
+        return results
+
+
+class LazyXrefs(Mapping):
+    """
+    dict-like collection of cross-reference tables that loads each table on first access.
+    """
+    def __init__(self, go_directory: str):
+        self.go_directory = go_directory
+        self._tables = {}
+        self._projector = None
+
+    @property
+    def projector(self) -> XrefProjector:
+        """
+        XrefProjector over all tables, built on first use.
+        """
+        if self._projector is None:
+            self._projector = XrefProjector(self)
+        return self._projector
+
+    def __getitem__(self, name: str) -> XrefTable:
+        if name not in XREF_TYPES:
+            raise KeyError(name)
+        if name not in self._tables:
+            self._tables[name] = load_xref_table(self.go_directory, name)
+        return self._tables[name]
+
+    def __iter__(self):
+        return iter(XREF_TYPES)
+
+    def __len__(self) -> int:
+        return len(XREF_TYPES)
+
+
+# cross-reference tables kept loaded for later runs in the same process (see eggnog_service.py)
+_shared_xrefs = {}
+
+
+def _sources_key(go_directory: str) -> dict:
+    key = {}
+    for name in XREF_TYPES:
+        try:
+            source_path = _table_source(go_directory, name)
+            key[name] = dict(_source_key(source_path), path=source_path)
+        except OSError:
+            key[name] = None
+    return key
+
+
+def shared_go_xrefs(go_directory: str) -> LazyXrefs:
+    """
+    Returns the cross-reference tables of go_directory, reusing the tables (and projector)
+    loaded by an earlier call in this process unless a .clean file or packed table has changed
+    since.
+
+    :param go_directory: directory with the .clean cross-reference tables
+    :returns: LazyXrefs
+    """
+    go_directory = os.path.abspath(go_directory)
+    sources_key = _sources_key(go_directory)
+    cached = _shared_xrefs.get(go_directory)
+    if cached is not None and cached[0] == sources_key:
+        return cached[1]
+    xrefs = LazyXrefs(go_directory)
+    _shared_xrefs[go_directory] = (sources_key, xrefs)
+    return xrefs
+
+
 class GO_Xrefs:
     """
     Imports and manages the mappings from the Gene Ontology to various other namespaces.
+
+    Nothing is read on construction. Each table is loaded from a compiled, memory-mapped index
+    the first time it is used (see load_xref_table).
     """
     def __init__(self, xref_dir="../GO_xref/"):
         self.xrefs = self._import_go_xref_tables(xref_dir)
 
-    def _read_xref_table(self, path: str) -> dict:
-        xref_table = defaultdict(list)
-        with open(path) as f:
-            lines = f.readlines()
-            for line in lines:
-                row = line.strip().split('\t')
-                # 3 here - XRef_Annotation and GO_desc
-                xref_table[row[2]].append(row[0])
-        return xref_table
-
     # import all GO cross-reference tables
     def _import_go_xref_tables(self, go_directory="../GO_xref/"):
         """
@@ -55,10 +532,11 @@ class GO_Xrefs:
         all_xrefs = GO_Xrefs()
         all_xrefs.xrefs["ec2go"]["GO:0008465"] = ["EC:1.1.1.29"]
         """
-        xrefs = {}
+        return shared_go_xrefs(os.path.join(os.path.dirname(os.path.abspath(__file__)), go_directory))
 
-        for file in XREF_TYPES:
-            filepath = os.path.join(os.path.dirname(__file__), go_directory, f"{file}.clean")
-            xrefs[file] = self._read_xref_table(filepath)
-        return xrefs
 
+if __name__ == "__main__":
+    # compile the cross-reference index, e.g. as part of installation
+    xref_dir = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "GO_xref")
+    for name, table in build_xref_index(xref_dir).items():
+        print(f"{name}: {len(table)} GO ids, {len(table.targets)} cross-references")
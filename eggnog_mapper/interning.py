@@ -0,0 +1,252 @@
+"""
+Interning of contig and feature ids.
+
+Each contig id is given an integer code once, its position in a ContigIndex (usually every
+contig in the assembly). Per-contig state such as lengths, coverages and filters is then held
+in NumPy arrays indexed by those codes (ContigValues, ContigSet), and the contigs of an
+annotation chunk only have to be looked up once. Contig id strings are only needed again
+when writing the outputs.
+
+Features are interned the same way with a Vocabulary, which grows as new features are seen.
+"""
+import numpy
+import pandas
+from collections.abc import Mapping, Set
+from typing import Iterable, Optional, Tuple
+
+
+class ContigIndex:
+    """
+    A fixed set of unique contig ids, each identified by its integer code (position).
+    """
+    def __init__(self, contig_ids):
+        self.ids = pandas.Index(numpy.asarray(contig_ids, dtype=object), dtype=object)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def codes(self, contig_ids) -> numpy.ndarray:
+        """
+        Returns the code of each contig id, or -1 for ids not in the index.
+        """
+        return self.ids.get_indexer(numpy.asarray(contig_ids, dtype=object))
+
+    def code(self, contig_id: str) -> int:
+        try:
+            return self.ids.get_loc(contig_id)
+        except (KeyError, TypeError):
+            return -1
+
+    def union(self, contig_ids) -> "ContigIndex":
+        """
+        Returns an index with any of the given contig ids that are missing appended to the end,
+        so the codes of the contigs already in this index stay the same. Returns this index if
+        none are missing.
+        """
+        contig_ids = numpy.asarray(contig_ids, dtype=object)
+        missing = contig_ids[self.codes(contig_ids) < 0]
+        if len(missing) == 0:
+            return self
+        return ContigIndex(numpy.concatenate([self.ids.to_numpy(dtype=object), pandas.unique(missing)]))
+
+
+def _take(array: numpy.ndarray, codes: numpy.ndarray, fill) -> numpy.ndarray:
+    # array[codes], with fill for codes of -1
+    if len(array) == 0:
+        return numpy.full(len(codes), fill, dtype=array.dtype)
+    return numpy.where(codes >= 0, array[codes], fill).astype(array.dtype)
+
+
+class ContigValues(Mapping):
+    """
+    A read-only mapping from contig id to a number, held as an array indexed by the codes of a
+    ContigIndex. present marks which contigs of the index have a value (None if all do).
+    """
+    def __init__(self, index: ContigIndex, values: numpy.ndarray, present: Optional[numpy.ndarray] = None):
+        self.index = index
+        self.values = values
+        self.present = present
+
+    @classmethod
+    def from_items(cls, contig_ids, values, index: Optional[ContigIndex] = None):
+        """
+        Builds the mapping from parallel arrays of contig ids and values. If a contig is listed
+        more than once, its last value is used. If index is given, the values are placed on it
+        and contigs not in it are dropped, otherwise a new index is made in order of first
+        appearance.
+        """
+        contig_ids = numpy.asarray(contig_ids, dtype=object)
+        values = numpy.asarray(values)
+        if values.dtype == object:
+            values = numpy.array(values.tolist())
+        if index is None:
+            codes, uniques = pandas.factorize(contig_ids)
+            index = ContigIndex(uniques)
+        else:
+            codes = index.codes(contig_ids)
+        last = ~pandas.Index(contig_ids, dtype=object).duplicated(keep="last") & (codes >= 0)
+        placed = numpy.zeros(len(index), dtype=values.dtype if len(values) else numpy.int64)
+        placed[codes[last]] = values[last]
+        present = None
+        if last.sum() != len(index):
+            present = numpy.zeros(len(index), dtype=bool)
+            present[codes[last]] = True
+        return cls(index, placed, present)
+
+    @classmethod
+    def from_mapping(cls, mapping: Mapping, index: Optional[ContigIndex] = None):
+        """
+        Returns the mapping as ContigValues on the given index (or its own, if index is None),
+        converting a dict or reindexing other ContigValues as needed.
+        """
+        if isinstance(mapping, ContigValues):
+            return mapping if index is None or mapping.index is index else mapping.reindex(index)
+        return cls.from_items(list(mapping.keys()), list(mapping.values()), index)
+
+    def _present(self) -> numpy.ndarray:
+        return numpy.ones(len(self.index), dtype=bool) if self.present is None else self.present
+
+    def take(self, codes: numpy.ndarray) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """
+        Returns the values of the contigs with the given codes, as a tuple of (value array, with
+        0 for contigs without a value, and boolean array of whether each contig has a value).
+        """
+        found = _take(self._present(), codes, False)
+        return numpy.where(found, _take(self.values, codes, 0), 0).astype(self.values.dtype), found
+
+    def lookup(self, contig_ids) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """
+        Same as take(), for contig ids.
+        """
+        return self.take(self.index.codes(contig_ids))
+
+    def reindex(self, index: ContigIndex):
+        """
+        Returns the same values placed on another index, dropping contigs that aren't in it.
+        """
+        codes = index.codes(self.index.ids)
+        keep = (codes >= 0) & self._present()
+        values = numpy.zeros(len(index), dtype=self.values.dtype)
+        values[codes[keep]] = self.values[keep]
+        present = numpy.zeros(len(index), dtype=bool)
+        present[codes[keep]] = True
+        return type(self)(index, values, None if present.all() else present)
+
+    def to_arrays(self) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """
+        Returns the (contig ids, values) of the contigs that have a value, in index order.
+        """
+        if self.present is None:
+            return self.index.ids.to_numpy(dtype=object), self.values
+        return self.index.ids[self.present].to_numpy(dtype=object), self.values[self.present]
+
+    def __getitem__(self, contig_id: str):
+        code = self.index.code(contig_id)
+        if code < 0 or not (self.present is None or self.present[code]):
+            raise KeyError(contig_id)
+        return self.values[code].item()
+
+    def __contains__(self, contig_id) -> bool:
+        code = self.index.code(contig_id)
+        return code >= 0 and (self.present is None or bool(self.present[code]))
+
+    def __iter__(self):
+        ids = self.index.ids if self.present is None else self.index.ids[self.present]
+        return iter(ids.tolist())
+
+    def __len__(self) -> int:
+        return len(self.index) if self.present is None else int(self.present.sum())
+
+
+class ContigSet(Set):
+    """
+    A read-only set of contig ids, held as a boolean mask over a ContigIndex.
+    """
+    def __init__(self, index: ContigIndex, mask: numpy.ndarray):
+        self.index = index
+        self.mask = mask
+
+    @classmethod
+    def all(cls, index: ContigIndex) -> "ContigSet":
+        """
+        Returns the set of every contig in the index.
+        """
+        return cls(index, numpy.ones(len(index), dtype=bool))
+
+    @classmethod
+    def from_set(cls, contigs: Iterable[str], index: Optional[ContigIndex] = None) -> "ContigSet":
+        """
+        Returns the contigs as a ContigSet on the given index (or a new one, if index is None).
+        Contigs that aren't in the index are dropped.
+        """
+        if isinstance(contigs, ContigSet):
+            return contigs if index is None or contigs.index is index else contigs.reindex(index)
+        contig_ids = numpy.asarray(list(contigs), dtype=object)
+        if index is None:
+            return cls.all(ContigIndex(pandas.unique(contig_ids)))
+        mask = numpy.zeros(len(index), dtype=bool)
+        codes = index.codes(contig_ids)
+        mask[codes[codes >= 0]] = True
+        return cls(index, mask)
+
+    @classmethod
+    def _from_iterable(cls, iterable):
+        # results of the generic set operations are plain sets
+        return set(iterable)
+
+    def take(self, codes: numpy.ndarray) -> numpy.ndarray:
+        """
+        Returns whether each contig with the given codes is in the set.
+        """
+        return _take(self.mask, codes, False)
+
+    def reindex(self, index: ContigIndex) -> "ContigSet":
+        return ContigSet.from_set(self.index.ids[self.mask].to_numpy(dtype=object), index)
+
+    def __sub__(self, other: Iterable[str]) -> "ContigSet":
+        other = ContigSet.from_set(other, self.index)
+        return ContigSet(self.index, self.mask & ~other.mask)
+
+    def __contains__(self, contig_id) -> bool:
+        code = self.index.code(contig_id)
+        return code >= 0 and bool(self.mask[code])
+
+    def __iter__(self):
+        return iter(self.index.ids[self.mask].tolist())
+
+    def __len__(self) -> int:
+        return int(self.mask.sum())
+
+
+class Vocabulary:
+    """
+    Assigns each distinct item an integer id, in order of first appearance.
+    """
+    def __init__(self):
+        self._index = {}            # item -> id
+        self.items = []             # id -> item
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def intern(self, items: Iterable) -> numpy.ndarray:
+        """
+        Returns the ids of the given items, adding new ones to the vocabulary.
+        """
+        items = list(items)
+        ids = numpy.empty(len(items), dtype=numpy.int64)
+        for i, item in enumerate(items):
+            item_id = self._index.get(item)
+            if item_id is None:
+                item_id = len(self.items)
+                self._index[item] = item_id
+                self.items.append(item)
+            ids[i] = item_id
+        return ids
+
+    def intern_array(self, values) -> numpy.ndarray:
+        """
+        Same as intern(), but each distinct value of the array is only looked up once.
+        """
+        codes, uniques = pandas.factorize(numpy.asarray(values, dtype=object))
+        return self.intern(uniques.tolist())[codes]
@@ -0,0 +1,186 @@
+"""
+Run metrics: per-stage wall times, throughput counters, peak memory and progress reporting.
+
+Code on the hot paths reports to the active Metrics through the module functions stage(),
+timed(), count() and progress(). These do nothing unless the run is wrapped in recording(),
+so library callers and worker processes pay no cost.
+
+Stage times are exclusive: time spent in a nested stage (e.g. reading the next annotation
+chunk while aggregating) only counts towards the inner stage, so the stage times add up to at
+most the total run time.
+"""
+import json
+import sys
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, Optional
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+# seconds between progress lines on stderr
+PROGRESS_INTERVAL = 10.0
+
+_active = None
+
+
+def peak_rss_bytes(children: bool = False) -> Optional[int]:
+    """
+    Returns the peak resident set size of this process (or of its finished child processes,
+    such as the worker pool), in bytes, or None if it isn't available on this platform.
+    """
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return usage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+
+class Metrics:
+    """
+    Collects the metrics of one run.
+
+    stages - dict stage name -> seconds, in order of first use
+    counters - dict counter name -> total, e.g. annotation_rows, contigs
+    outputs - list of the paths of the tables written
+    """
+    def __init__(self, progress_interval: float = PROGRESS_INTERVAL, progress_stream=None):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.counters = {}
+        self.outputs = []
+        self.progress_interval = progress_interval
+        self.progress_stream = progress_stream
+        self._last_progress = self.started
+        self._nested = [0.0]        # time spent in nested stages, one entry per open stage
+
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        self._nested.append(0.0)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            nested = self._nested.pop()
+            self.stages[name] = self.stages.get(name, 0.0) + elapsed - nested
+            self._nested[-1] += elapsed
+
+    def count(self, name: str, n: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def output(self, path: str):
+        self.outputs.append(path)
+
+    def progress(self, rows: int, total: Optional[int] = None):
+        """
+        Writes a progress line to stderr, at most once every progress_interval seconds.
+        """
+        now = time.perf_counter()
+        if now - self._last_progress < self.progress_interval:
+            return
+        self._last_progress = now
+        rate = rows / (now - self.started)
+        done = f" of {total:,} ({round(rows * 100 / total, 1)} %)" if total else ""
+        print(f"-----> Processed {rows:,}{done} annotation rows, {rate:,.0f} rows/s", file=self.progress_stream or sys.stderr, flush=True)
+
+    def report(self) -> Dict:
+        """
+        Returns the metrics as a JSON-serializable dict. Throughput is measured over the time
+        spent reading and aggregating annotations.
+        """
+        total = time.perf_counter() - self.started
+        scan_seconds = sum(self.stages.get(name, 0.0) for name in ("annotation_import", "aggregate")) or total
+        return {
+            "total_seconds": round(total, 6),
+            "stages": {name: round(seconds, 6) for name, seconds in self.stages.items()},
+            "counters": dict(self.counters),
+            "throughput": {
+                "rows_per_second": round(self.counters.get("annotation_rows", 0) / scan_seconds, 2) if scan_seconds else None,
+                "contigs_per_second": round(self.counters.get("contigs", 0) / scan_seconds, 2) if scan_seconds else None
+            },
+            "peak_rss_bytes": peak_rss_bytes(),
+            "peak_rss_children_bytes": peak_rss_bytes(children=True),
+            "outputs": list(self.outputs)
+        }
+
+    def write(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
+            f.write("\n")
+
+
+@contextmanager
+def recording(metrics: Metrics):
+    """
+    Makes metrics the active Metrics within the block.
+    """
+    global _active
+    previous = _active
+    _active = metrics
+    try:
+        yield metrics
+    finally:
+        _active = previous
+
+
+def record_run(run: Callable, args, run_metrics: Optional[Metrics] = None) -> int:
+    """
+    Calls run(args) with run_metrics (or a fresh Metrics) active, then writes its report to
+    args.metrics_out, if given.
+    """
+    if run_metrics is None:
+        run_metrics = Metrics()
+    with recording(run_metrics):
+        result = run(args)
+    if getattr(args, "metrics_out", None):
+        run_metrics.write(args.metrics_out)
+        print(f"Wrote run metrics to {args.metrics_out}")
+    return result
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Times the block as the named stage of the active Metrics, if any.
+    """
+    if _active is None:
+        yield
+        return
+    with _active.stage(name):
+        yield
+
+
+def timed(iterable: Iterable, name: str) -> Iterator:
+    """
+    Yields from iterable, timing each step as the named stage, e.g. to time the reading of
+    lazily streamed chunks separately from their processing.
+    """
+    iterator = iter(iterable)
+    while True:
+        with stage(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def count(name: str, n: int = 1):
+    if _active is not None:
+        _active.count(name, n)
+
+
+def output(path: str):
+    """
+    Records the path of a table written by the run.
+    """
+    if _active is not None:
+        _active.output(path)
+
+
+def progress(rows: int, total: Optional[int] = None):
+    if _active is not None:
+        _active.progress(rows, total)
@@ -0,0 +1,193 @@
+"""
+Writers for the output tables.
+
+Count tables and contig summary tables can be written as plain CSV (the default), gzip or
+zstd compressed CSV, or Parquet. Every table is opened and written once: count tables in one
+bulk write from the final totals, summary tables by appending the lines of each chunk to a
+single open (compressed) stream, or, for Parquet, by writing the buffered lines as a typed row
+group every _PARQUET_BATCH_LINES lines.
+"""
+import os
+import gzip
+import io
+import pandas
+import metrics
+from typing import Iterable, List, Mapping
+
+OUTPUT_FORMATS = ["csv", "csv.gz", "csv.zst", "parquet"]
+
+# pandas compression options of the CSV formats. gzip files get a fixed timestamp, so the same
+# tables always give the same bytes
+_COMPRESSION = {
+    "csv": None,
+    "csv.gz": {"method": "gzip", "mtime": 0},
+    "csv.zst": {"method": "zstd"}
+}
+# optional packages needed by each format
+_REQUIRES = {"csv.zst": "zstandard", "parquet": "pyarrow"}
+# Parquet types of the contig summary table columns, as pyarrow type names. Missing values are
+# written as "NA" in the lines
+_SUMMARY_TYPES = {
+    "contig_id": "string",
+    "contig_length": "int64",
+    "avg_contig_coverage": "float64",
+    "feature_hit_freq": "float64",
+    "consensus_taxonomy": "string",
+    "consensus_taxonomy_frequency": "float64"
+}
+# summary lines buffered before they're written as a Parquet row group
+_PARQUET_BATCH_LINES = 1 << 16
+
+
+def check_output_format(output_format: str):
+    """
+    Raises a ValueError if the format is unknown or the package it needs isn't installed, so
+    that runs fail before any work is done rather than when the first table is written.
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format {output_format}, options are {', '.join(OUTPUT_FORMATS)}")
+    package = _REQUIRES.get(output_format)
+    if package is not None:
+        try:
+            __import__(package)
+        except ImportError:
+            raise ValueError(f"The {output_format} output format requires the {package} package")
+
+
+def table_path(path_stem: str, output_format: str, text_extension: str = "csv") -> str:
+    """
+    Returns the path of a table in the given format, e.g. <stem>.csv.gz or <stem>.parquet.
+
+    :param path_stem: path without the extension
+    :param text_extension: extension of the uncompressed text format, "csv" or "tsv"
+    """
+    if output_format == "parquet":
+        return f"{path_stem}.parquet"
+    return f"{path_stem}.{text_extension}{output_format[len('csv'):]}"
+
+
+def write_count_table(path_stem: str, counts: Mapping[str, float], output_format: str = "csv") -> str:
+    """
+    Writes a feature count table in one go. CSV tables have a feature and a count column and
+    no header, Parquet tables have feature and count columns.
+
+    :param path_stem: output path without the extension
+    :param counts: dict feature -> count
+    :returns: path written
+    """
+    path = table_path(path_stem, output_format)
+    features = pandas.Index(list(counts.keys()), dtype=object)
+    values = list(counts.values())
+    if output_format == "parquet":
+        pandas.DataFrame({"feature": features, "count": pandas.Series(values, dtype=None if values else "int64")}).to_parquet(path, index=False)
+    else:
+        pandas.Series(values, index=features, dtype=None if values else object).to_csv(path, header=False, compression=_COMPRESSION[output_format])
+    metrics.output(path)
+    return path
+
+
+def write_table(path_stem: str, table: pandas.DataFrame, output_format: str = "csv") -> str:
+    """
+    Writes a table with a header line (CSV) or its column names (Parquet) in one go.
+
+    :param path_stem: output path without the extension
+    :returns: path written
+    """
+    path = table_path(path_stem, output_format)
+    if output_format == "parquet":
+        table.to_parquet(path, index=False)
+    else:
+        table.to_csv(path, index=False, compression=_COMPRESSION[output_format])
+    metrics.output(path)
+    return path
+
+
+def _open_text(path: str, output_format: str):
+    if output_format == "csv.gz":
+        return io.TextIOWrapper(gzip.GzipFile(path, "wb", mtime=0), encoding="utf-8")
+    if output_format == "csv.zst":
+        import zstandard
+        return zstandard.open(path, "wt", encoding="utf-8")
+    return open(path, "w")
+
+
+class SummaryTableWriter:
+    """
+    Writes a contig summary table. Takes tab-separated lines like a text file, through write()
+    and writelines(), and writes them in the requested format. Parquet tables are written in
+    row groups of up to _PARQUET_BATCH_LINES lines, typed as in _SUMMARY_TYPES.
+
+    Used as a context manager, the partly written table is removed if an exception is raised.
+    """
+    def __init__(self, path_stem: str, columns: List[str], output_format: str = "csv"):
+        self.path = table_path(path_stem, output_format, "tsv")
+        self.columns = columns
+        self.output_format = output_format
+        metrics.output(self.path)
+        if output_format == "parquet":
+            import pyarrow
+            import pyarrow.parquet
+            self._schema = pyarrow.schema([(column, _SUMMARY_TYPES[column]) for column in columns])
+            self._lines = []
+            self._parquet = pyarrow.parquet.ParquetWriter(self.path, self._schema)
+            self._file = None
+        else:
+            self._parquet = None
+            self._file = _open_text(self.path, output_format)
+            self._file.write("\t".join(columns) + "\n")
+
+    def write(self, line: str):
+        if self._file is None:
+            self._lines.append(line)
+            if len(self._lines) >= _PARQUET_BATCH_LINES:
+                self._write_batch()
+        else:
+            self._file.write(line)
+
+    def writelines(self, lines: Iterable[str]):
+        if self._file is None:
+            self._lines.extend(lines)
+            if len(self._lines) >= _PARQUET_BATCH_LINES:
+                self._write_batch()
+        else:
+            self._file.writelines(lines)
+
+    def _write_batch(self):
+        # parses the buffered lines into a typed table and writes it as a row group
+        import pyarrow.csv
+        table = pyarrow.csv.read_csv(
+            io.BytesIO("".join(self._lines).encode("utf-8")),
+            read_options=pyarrow.csv.ReadOptions(column_names=self.columns),
+            parse_options=pyarrow.csv.ParseOptions(delimiter="\t"),
+            convert_options=pyarrow.csv.ConvertOptions(column_types=self._schema, null_values=["NA"], strings_can_be_null=True)
+        )
+        self._parquet.write_table(table)
+        self._lines = []
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        elif self._parquet is not None:
+            if self._lines:
+                self._write_batch()
+            self._parquet.close()
+            self._parquet = None
+
+    def discard(self):
+        """
+        Closes the table without writing the buffered lines, and removes it.
+        """
+        self._lines = []
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
@@ -1,4 +1,4 @@
-from typing import Any
+from typing import Any, List
 from math import isnan
 
 def isfloat(num: Any) -> bool:
@@ -11,3 +11,13 @@ def isfloat(num: Any) -> bool:
         return not isnan(float_num)
     except (ValueError, TypeError):
         return False
+
+def int_list(value: str) -> List[int]:
+    """
+    Parses a comma-separated list of ints, e.g. "1000,2000" -> [1000, 2000]. Duplicates are
+    dropped, keeping the first. Meant as an argparse type, so raises ValueError on bad input.
+    """
+    values = [int(item) for item in value.split(",") if item.strip()]
+    if not values:
+        raise ValueError(f"no values in {value!r}")
+    return list(dict.fromkeys(values))
@@ -0,0 +1,6 @@
+import os
+import pytest
+
+# the wall-clock and peak memory comparisons depend on the load of the machine, so they only
+# run with EGGNOG_BENCHMARKS=1
+benchmark = pytest.mark.skipif(not os.environ.get("EGGNOG_BENCHMARKS"), reason="benchmark, set EGGNOG_BENCHMARKS=1 to run it")
@@ -0,0 +1,214 @@
+"""
+End-to-end benchmark of eggnog_to_feature_table.py on synthetic metagenomes.
+
+For each size and engine, runs the mapper in a subprocess with --metrics_out, and appends a
+record of the run (parameters, git commit, platform, and the metrics report: per-stage times,
+throughput and peak memory) to a JSON lines results file. Each run is printed next to the
+previous record with the same parameters, so results can be compared across commits.
+
+    python tests/benchmarks/run_pipeline_benchmark.py --genes 10000,100000,1000000
+    python tests/benchmarks/run_pipeline_benchmark.py --genes 10000000 --engines columnar --processes 8
+
+Generated inputs are kept under --data_dir, one directory per set of parameters, and reused
+by later runs.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from typing import Dict, List, Optional
+
+# the mapper modules import their siblings directly, as in tests/conftest.py
+REPO_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+sys.path[:0] = [REPO_DIR, os.path.join(REPO_DIR, "eggnog_mapper")]
+from tests.benchmarks.synthetic import MetagenomeParams, write_metagenome  # noqa: E402
+
+MAPPER = os.path.join(REPO_DIR, "eggnog_mapper", "eggnog_to_feature_table.py")
+# results are kept in the user's cache directory, outside the repository, so they carry over
+# between checkouts and commits without being committed themselves
+DEFAULT_RESULTS = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"), "eggnog_mapper", "benchmark_results.jsonl")
+DEFAULT_DATA_DIR = os.path.join(REPO_DIR, "tests", "benchmarks", "data")
+DEFAULT_SIZES = "10000,100000,1000000"
+DEFAULTS = MetagenomeParams._field_defaults
+# low thresholds, so most synthetic contigs make it into the tables
+MAPPER_ARGS = ["--min_contig_length", "1000", "--min_contig_coverage", "2", "--use_cov", "--go_xref_loc", os.path.join(REPO_DIR, "GO_xref")]
+
+
+def prepare_inputs(data_dir: str, params: MetagenomeParams) -> Dict[str, str]:
+    """
+    Returns the paths of the synthetic inputs for params, generating them if they aren't in
+    data_dir yet.
+    """
+    sample_dir = os.path.join(data_dir, params.name())
+    done = os.path.join(sample_dir, "done")
+    if os.path.exists(done):
+        return {
+            "annotations": os.path.join(sample_dir, f"{params.sample_id}_sample.annotations"),
+            "coverage": os.path.join(sample_dir, f"{params.sample_id}_coverage.tsv"),
+            "fasta": os.path.join(sample_dir, f"{params.sample_id}_contigs.fa")
+        }
+    paths = write_metagenome(sample_dir, params)
+    open(done, "w").close()
+    return paths
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_mapper(paths: Dict[str, str], engine: str, extra_args: List[str]) -> Dict:
+    """
+    Runs the mapper on the inputs in a scratch output directory and returns its metrics report.
+    The contig length cache is removed first, so the FASTA scan is part of every run.
+    """
+    cache = paths["fasta"] + ".contig_lengths.tsv"
+    if os.path.exists(cache):
+        os.remove(cache)
+    with tempfile.TemporaryDirectory() as out_dir:
+        metrics_path = os.path.join(out_dir, "metrics.json")
+        command = [
+            sys.executable, MAPPER,
+            "-i", paths["annotations"],
+            "--input_cov", paths["coverage"],
+            "--input_contig_fasta", paths["fasta"],
+            "--engine", engine,
+            "--metrics_out", metrics_path
+        ] + extra_args
+        result = subprocess.run(command, cwd=out_dir, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"Mapper failed with exit code {result.returncode}:\n{result.stderr[-2000:]}")
+        with open(metrics_path) as f:
+            return json.load(f)
+
+
+def benchmark_record(params: MetagenomeParams, engine: str, extra_args: List[str], report: Dict) -> Dict:
+    return {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": params._asdict(),
+        "engine": engine,
+        "args": extra_args,
+        "metrics": report
+    }
+
+
+def _same_run(record: Dict, other: Dict) -> bool:
+    return record["params"] == other["params"] and record["engine"] == other["engine"] and record["args"] == other["args"]
+
+
+def load_results(path: str) -> List[Dict]:
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def append_result(path: str, record: Dict):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "a") as f:
+        f.write(json.dumps(record, sort_keys=True) + "\n")
+
+
+def previous_result(results: List[Dict], record: Dict) -> Optional[Dict]:
+    """
+    Returns the latest stored record for the same parameters, engine and arguments, if any.
+    """
+    for other in reversed(results):
+        if _same_run(record, other):
+            return other
+    return None
+
+
+def format_comparison(record: Dict, previous: Optional[Dict]) -> str:
+    """
+    Returns a table of the stage times of record, next to those of previous (if any).
+    """
+    def change(new, old):
+        if old is None:
+            return ""
+        if not old:
+            return f"{old:>10.3f}"
+        return f"{old:>10.3f} {round((new - old) * 100 / old, 1):>+7.1f} %"
+
+    old_metrics = previous["metrics"] if previous else {}
+    old_stages = old_metrics.get("stages", {})
+    header = f"{record['params']['n_genes']:,} genes, {record['engine']} engine"
+    if previous:
+        header += f" (previous: {previous['commit']} {previous['timestamp']})"
+    lines = [header]
+    rows = [(name, seconds, old_stages.get(name) if previous else None) for name, seconds in record["metrics"]["stages"].items()]
+    rows.append(("total", record["metrics"]["total_seconds"], old_metrics.get("total_seconds")))
+    for name, seconds, old in rows:
+        lines.append(f"  {name:<20}{seconds:>10.3f} {change(seconds, old)}".rstrip())
+    throughput = record["metrics"]["throughput"]
+    peak = max(record["metrics"]["peak_rss_bytes"] or 0, record["metrics"]["peak_rss_children_bytes"] or 0)
+    lines.append(f"  {throughput['rows_per_second'] or 0:,.0f} rows/s, {throughput['contigs_per_second'] or 0:,.0f} contigs/s, peak RSS {peak / 2 ** 20:,.1f} MiB")
+    return "\n".join(lines)
+
+
+def run_benchmarks(sizes: List[int], engines: List[str], extra_args: List[str], results_path: str, data_dir: str, base_params: MetagenomeParams, n_contigs: Optional[int] = None) -> List[Dict]:
+    """
+    Runs the mapper for every size (number of genes) and engine, with about n_contigs contigs
+    if given, or base_params.genes_per_contig genes per contig otherwise. Stores each record in results_path and prints
+    it next to the previous matching one.
+    """
+    results = load_results(results_path)
+    records = []
+    for size in sizes:
+        params = base_params._replace(n_genes=size)
+        if n_contigs:
+            params = params._replace(genes_per_contig=size / n_contigs)
+        paths = prepare_inputs(data_dir, params)
+        for engine in engines:
+            report = run_mapper(paths, engine, extra_args)
+            record = benchmark_record(params, engine, extra_args, report)
+            print(format_comparison(record, previous_result(results, record)), flush=True)
+            append_result(results_path, record)
+            results.append(record)
+            records.append(record)
+    return records
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark eggnog_to_feature_table.py on synthetic metagenomes.")
+    parser.add_argument("--genes", default=DEFAULT_SIZES, help=f"Comma-separated numbers of genes to benchmark. (default: {DEFAULT_SIZES})")
+    parser.add_argument("--engines", default="columnar,loop", help="Comma-separated engines to benchmark. (default: columnar,loop)")
+    parser.add_argument("--contigs", type=int, default=None, help="Number of contigs, the same for every size. Overrides --genes_per_contig.")
+    parser.add_argument("--genes_per_contig", type=float, default=DEFAULTS["genes_per_contig"], help="Mean number of genes per contig.")
+    parser.add_argument("--go_per_gene", type=float, default=DEFAULTS["go_per_gene"], help="Mean number of GO terms on an annotated gene.")
+    parser.add_argument("--sparsity", type=float, default=DEFAULTS["sparsity"], help="Fraction of genes without a hit in each category.")
+    parser.add_argument("--seed", type=int, default=DEFAULTS["seed"], help="Random seed of the generator.")
+    parser.add_argument("--results", default=DEFAULT_RESULTS, help="JSON lines file the results are appended to. (default: benchmark_results.jsonl in $XDG_CACHE_HOME/eggnog_mapper, or ~/.cache/eggnog_mapper)")
+    parser.add_argument("--data_dir", default=DEFAULT_DATA_DIR, help="Directory of the generated inputs.")
+    args, mapper_args = parser.parse_known_args(argv)
+    # anything else is passed on to the mapper, e.g. --eggnog_category ALL_CATEGORIES
+    args.mapper_args = MAPPER_ARGS + mapper_args
+    return args
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    base_params = MetagenomeParams(genes_per_contig=args.genes_per_contig, go_per_gene=args.go_per_gene, sparsity=args.sparsity, seed=args.seed)
+    run_benchmarks(
+        [int(size) for size in args.genes.split(",")],
+        args.engines.split(","),
+        args.mapper_args,
+        args.results,
+        args.data_dir,
+        base_params,
+        args.contigs
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
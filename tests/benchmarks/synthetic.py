@@ -0,0 +1,142 @@
+"""
+Deterministic generator of synthetic metagenomes for benchmarking: an eggNOG annotation file,
+a contig coverage file and a contig FASTA file that look like those of a real assembly.
+
+The same parameters and seed always give byte-identical files. Everything is drawn from a
+NumPy Generator up front, and the files are written in blocks of rows, so 10M gene inputs can
+be made in a few minutes.
+
+    from tests.benchmarks.synthetic import MetagenomeParams, write_metagenome
+    paths = write_metagenome("bench_data", MetagenomeParams(n_genes=100000))
+"""
+import glob
+import os
+import numpy
+from typing import Dict, List, NamedTuple
+from eggnog_mapper.annotations import ANNOTATION_COLUMNS
+
+GO_XREF_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "GO_xref")
+SCOPES = ["Bacteria", "Archaea", "Eukaryota", "Viruses", "Proteobacteria", "Firmicutes", "Bacteroidetes", "Actinobacteria"]
+COG_CATEGORIES = list("CDEFGHIJKLMNOPQSTUV")
+# categories without generated terms are left empty, i.e. no hits
+EMPTY_CATEGORIES = ["KEGG_Pathway", "KEGG_Module", "KEGG_Reaction", "KEGG_rclass", "BRITE", "KEGG_TC", "BiGG_Reaction"]
+ROWS_PER_BLOCK = 50000
+
+
+class MetagenomeParams(NamedTuple):
+    n_genes: int = 10000
+    genes_per_contig: float = 10.0     # mean, the number of genes per contig is geometric
+    go_per_gene: float = 3.0           # mean number of GO terms on an annotated gene
+    sparsity: float = 0.4              # fraction of genes without a hit, per category
+    bases_per_gene: int = 300          # contig length per gene in the FASTA
+    uncovered_fraction: float = 0.02   # fraction of contigs missing from the coverage file
+    sample_id: str = "9999"
+    seed: int = 1
+
+    def name(self) -> str:
+        """
+        A file name friendly summary of the parameters.
+        """
+        return f"g{self.n_genes}_c{self.genes_per_contig:g}_go{self.go_per_gene:g}_s{self.sparsity:g}_b{self.bases_per_gene}_seed{self.seed}"
+
+
+def go_vocabulary(go_xref_dir: str = GO_XREF_DIR) -> numpy.ndarray:
+    """
+    Returns the GO ids found in the cross-reference tables, so the synthetic annotations
+    project onto the other namespaces, or made-up GO ids if there are no tables.
+    """
+    go_ids = set()
+    for path in sorted(glob.glob(os.path.join(go_xref_dir, "*.clean"))):
+        with open(path) as f:
+            go_ids.update(line.rstrip("\n").split("\t")[-1] for line in f if line.strip())
+    if not go_ids:
+        go_ids = {f"GO:{i:07d}" for i in range(1, 20001)}
+    return numpy.array(sorted(go_ids), dtype=object)
+
+
+def _skewed_choice(rng: numpy.random.Generator, vocabulary: numpy.ndarray, size: int) -> numpy.ndarray:
+    # a few terms are very common and most are rare, as in real annotations
+    weights = 1.0 / numpy.arange(1, len(vocabulary) + 1) ** 1.1
+    return vocabulary[rng.choice(len(vocabulary), size=size, p=weights / weights.sum())]
+
+
+def _contig_sizes(rng: numpy.random.Generator, params: MetagenomeParams) -> numpy.ndarray:
+    # geometric gene counts with the requested mean, trimmed to n_genes in total
+    sizes = rng.geometric(1.0 / max(params.genes_per_contig, 1.0), size=int(params.n_genes / max(params.genes_per_contig, 1.0) * 2) + 10)
+    sizes = sizes[:numpy.searchsorted(numpy.cumsum(sizes), params.n_genes) + 1]
+    sizes[-1] -= sizes.sum() - params.n_genes
+    return sizes[sizes > 0]
+
+
+def _term_lists(rng: numpy.random.Generator, vocabulary: numpy.ndarray, n_genes: int, mean_terms: float, sparsity: float) -> List[str]:
+    """
+    Returns one comma-separated list of terms per gene, or "" for genes without a hit.
+    """
+    hit = rng.random(n_genes) >= sparsity
+    n_terms = numpy.where(hit, 1 + rng.poisson(max(mean_terms - 1, 0), size=n_genes), 0)
+    terms = _skewed_choice(rng, vocabulary, int(n_terms.sum()))
+    bounds = numpy.concatenate([[0], numpy.cumsum(n_terms)]).tolist()
+    terms = terms.tolist()
+    return [",".join(terms[bounds[i]:bounds[i + 1]]) if n_terms[i] else "" for i in range(n_genes)]
+
+
+def write_metagenome(out_dir: str, params: MetagenomeParams, go_xref_dir: str = GO_XREF_DIR) -> Dict[str, str]:
+    """
+    Writes the annotation, coverage and FASTA files of a synthetic metagenome to out_dir,
+    named after the sample id like real inputs, e.g. 9999_sample.annotations.
+
+    :returns: dict with the "annotations", "coverage" and "fasta" paths
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    paths = {
+        "annotations": os.path.join(out_dir, f"{params.sample_id}_sample.annotations"),
+        "coverage": os.path.join(out_dir, f"{params.sample_id}_coverage.tsv"),
+        "fasta": os.path.join(out_dir, f"{params.sample_id}_contigs.fa")
+    }
+    rng = numpy.random.default_rng(params.seed)
+    sizes = _contig_sizes(rng, params)
+    contig_names = [f"{params.sample_id}_contig_{i + 1}" for i in range(len(sizes))]
+    vocabularies = {
+        "GO": go_vocabulary(go_xref_dir),
+        "EC": numpy.array([f"{a}.{b}.{c}.{d}" for a in range(1, 7) for b in range(1, 6) for c in range(1, 6) for d in range(1, 40)], dtype=object),
+        "KEGG_ko": numpy.array([f"ko:K{i:05d}" for i in range(1, 5001)], dtype=object),
+        "eggNOG_OGs": numpy.array([f"COG{i:04d}@1|root" for i in range(1, 5001)], dtype=object),
+        "CAZy": numpy.array([f"GH{i}" for i in range(1, 170)], dtype=object),
+    }
+    mean_terms = {"GO": params.go_per_gene, "EC": 1.2, "KEGG_ko": 1.1, "eggNOG_OGs": 2.0, "CAZy": 1.0}
+    sparsity = {cat: params.sparsity for cat in mean_terms}
+    sparsity["CAZy"] = max(params.sparsity, 0.95)
+    columns = {name: i for i, name in enumerate(ANNOTATION_COLUMNS)}
+    # each contig is mostly one taxon, with some genes assigned elsewhere
+    contig_scope = rng.integers(0, len(SCOPES), size=len(sizes))
+
+    with open(paths["annotations"], "w") as f:
+        gene_contig = numpy.repeat(numpy.arange(len(sizes)), sizes)
+        gene_number = numpy.arange(params.n_genes) - numpy.repeat(numpy.cumsum(sizes) - sizes, sizes) + 1
+        for start in range(0, params.n_genes, ROWS_PER_BLOCK):
+            stop = min(start + ROWS_PER_BLOCK, params.n_genes)
+            n = stop - start
+            block = [[""] * n if name in EMPTY_CATEGORIES else ["-"] * n for name in ANNOTATION_COLUMNS]
+            block[columns["query_name"]] = [f"{contig_names[c]}_{g}" for c, g in zip(gene_contig[start:stop].tolist(), gene_number[start:stop].tolist())]
+            block[columns["seed_eggNOG_ortholog"]] = [f"1234567.SAMN{i:08d}" for i in rng.integers(0, 10 ** 8, size=n).tolist()]
+            block[columns["seed_ortholog_evalue"]] = [f"{e:.2e}" for e in (10.0 ** -rng.uniform(5, 150, size=n)).tolist()]
+            block[columns["seed_ortholog_score"]] = [f"{s:.1f}" for s in rng.uniform(40, 900, size=n).tolist()]
+            for cat, vocabulary in vocabularies.items():
+                block[columns[cat]] = _term_lists(rng, vocabulary, n, mean_terms[cat], sparsity[cat])
+            scopes = numpy.where(rng.random(n) < 0.8, contig_scope[gene_contig[start:stop]], rng.integers(0, len(SCOPES), size=n))
+            block[columns["taxonomic_scope"]] = [SCOPES[s] for s in scopes.tolist()]
+            block[columns["COG"]] = ["".join(rng.choice(COG_CATEGORIES, size=k)) if k else "" for k in numpy.where(rng.random(n) < params.sparsity, 0, rng.integers(1, 3, size=n)).tolist()]
+            block[columns["eggNOG_free_text_desc"]] = ["hypothetical protein"] * n
+            f.writelines("\t".join(row) + "\n" for row in zip(*block))
+
+    coverages = numpy.round(rng.lognormal(2.5, 1.2, size=len(sizes)), 2)
+    covered = rng.random(len(sizes)) >= params.uncovered_fraction
+    with open(paths["coverage"], "w") as f:
+        f.writelines(f"{name}\t{coverage}\n" for name, coverage, keep in zip(contig_names, coverages.tolist(), covered.tolist()) if keep)
+
+    line = "".join(rng.choice(list("ACGT"), size=60)) + "\n"
+    lengths = sizes * params.bases_per_gene + rng.integers(0, params.bases_per_gene, size=len(sizes))
+    with open(paths["fasta"], "w") as f:
+        for name, length in zip(contig_names, lengths.tolist()):
+            f.write(f">{name}\n" + line * (length // 60) + (line[:length % 60] + "\n" if length % 60 else ""))
+    return paths
@@ -0,0 +1,82 @@
+"""
+Benchmark for the running feature totals. Accumulating N contigs that each bring new
+features should take time proportional to N. The old running Counter sum copied all the
+totals for every contig, so its runtime grew with N * total features, i.e. quadratically.
+
+The wall-clock comparisons depend on the load of the machine, so they only run with
+EGGNOG_BENCHMARKS=1. The linear growth is also checked by counting the work done.
+"""
+import time
+from collections import Counter
+from eggnog_mapper.counts import FeatureCounts
+from tests.benchmarks import benchmark
+
+FEATURES_PER_CONTIG = 20
+
+
+class _CopyCountingFeatureCounts(FeatureCounts):
+    # counts the array elements copied when the totals arrays grow
+    copied = 0
+
+    def _grow(self):
+        size = len(self._totals)
+        super()._grow()
+        if len(self._totals) != size:
+            self.copied += 3 * size
+
+
+def _contigs(n_contigs):
+    return [
+        {f"GO:{i * FEATURES_PER_CONTIG + j}": j + 1 for j in range(FEATURES_PER_CONTIG)}
+        for i in range(n_contigs)
+    ]
+
+
+def _time_feature_counts(contigs):
+    start = time.perf_counter()
+    counts = FeatureCounts()
+    for contig in contigs:
+        counts.add(contig)
+    counts.to_dict()
+    return time.perf_counter() - start
+
+
+def _time_counter_sum(contigs):
+    start = time.perf_counter()
+    total = Counter()
+    for contig in contigs:
+        total = Counter(contig) + total
+    return time.perf_counter() - start
+
+
+def _best_of(timer, contigs, repeats=3):
+    return min(timer(contigs) for _ in range(repeats))
+
+
+def test_feature_counts_copies_linearly():
+    # the arrays double when they grow, so the elements copied stay within a constant factor
+    # of the number of features, instead of copying all totals for every contig
+    for n_contigs in [2000, 8000]:
+        counts = _CopyCountingFeatureCounts()
+        for contig in _contigs(n_contigs):
+            counts.add(contig)
+        n_features = n_contigs * FEATURES_PER_CONTIG
+        assert len(counts) == n_features
+        assert counts.copied <= 3 * 2 * n_features
+
+
+@benchmark
+def test_feature_counts_scale_linearly():
+    small, large = _contigs(2000), _contigs(8000)
+    small_time = _best_of(_time_feature_counts, small)
+    large_time = _best_of(_time_feature_counts, large)
+    # 4x the contigs should take about 4x the time, quadratic growth would be about 16x
+    assert large_time < 8 * small_time
+
+
+@benchmark
+def test_feature_counts_faster_than_counter_sum():
+    contigs = _contigs(500)
+    new_time = _best_of(_time_feature_counts, contigs)
+    old_time = _best_of(_time_counter_sum, contigs, repeats=1)
+    assert new_time < old_time
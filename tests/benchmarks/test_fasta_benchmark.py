@@ -0,0 +1,64 @@
+"""
+Benchmark for scanning contig lengths. The block scanner should be much faster than building a
+SeqRecord for every contig with Bio.SeqIO, for both many short contigs and a few long ones.
+
+The timing comparison only runs with EGGNOG_BENCHMARKS=1, the lengths are always checked
+against Bio.SeqIO.
+"""
+import random
+import time
+import pytest
+from eggnog_mapper.contigs import scan_fasta_lengths
+from tests.benchmarks import benchmark
+
+SIZES = [(20000, 600), (20, 600000)]
+
+
+def _write_fasta(path, n_contigs, contig_length):
+    rng = random.Random(1)
+    line = "".join(rng.choice("ACGT") for _ in range(60)) + "\n"
+    with open(path, "w") as f:
+        for i in range(n_contigs):
+            f.write(f">1234_contig_{i} length={contig_length}\n")
+            f.write(line * (contig_length // 60))
+
+
+def _best_time(func, repeats=3):
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def _readers(tmp_path, n_contigs, contig_length):
+    SeqIO = pytest.importorskip("Bio.SeqIO")
+    path = str(tmp_path / "contigs.fa")
+    _write_fasta(path, n_contigs, contig_length)
+
+    def seqio():
+        with open(path) as f:
+            return [(rec.id, len(rec)) for rec in SeqIO.parse(f, "fasta")]
+
+    def scan():
+        return list(zip(*scan_fasta_lengths(path)))
+
+    return seqio, scan
+
+
+@pytest.mark.parametrize("n_contigs,contig_length", SIZES)
+def test_scan_matches_seqio(tmp_path, n_contigs, contig_length):
+    seqio, scan = _readers(tmp_path, n_contigs, contig_length)
+    assert scan() == seqio()
+
+
+@benchmark
+@pytest.mark.parametrize("n_contigs,contig_length", SIZES)
+def test_scan_faster_than_seqio(tmp_path, n_contigs, contig_length):
+    seqio, scan = _readers(tmp_path, n_contigs, contig_length)
+    seqio_time, expected = _best_time(seqio)
+    scan_time, result = _best_time(scan)
+    assert result == expected
+    assert scan_time * 1.5 < seqio_time
@@ -0,0 +1,82 @@
+"""
+Checks of the synthetic metagenome generator, and a small run of the end-to-end benchmark
+harness. The full benchmark is run with tests/benchmarks/run_pipeline_benchmark.py.
+"""
+import os
+import filecmp
+import importlib
+import pandas
+from eggnog_mapper.annotations import ANNOTATION_COLUMNS
+from tests.benchmarks import run_pipeline_benchmark
+from tests.benchmarks.synthetic import MetagenomeParams, write_metagenome
+from tests.benchmarks.run_pipeline_benchmark import REPO_DIR, load_results, parse_args, run_benchmarks
+
+PARAMS = MetagenomeParams(n_genes=2000, genes_per_contig=8.0, go_per_gene=3.0, sparsity=0.5)
+
+
+def _fasta_lengths(path):
+    lengths = {}
+    with open(path) as f:
+        for line in f:
+            if line.startswith(">"):
+                name = line[1:].strip()
+                lengths[name] = 0
+            else:
+                lengths[name] += len(line.strip())
+    return lengths
+
+
+def test_generator_is_deterministic(tmp_path):
+    first = write_metagenome(str(tmp_path / "a"), PARAMS)
+    second = write_metagenome(str(tmp_path / "b"), PARAMS)
+    other_seed = write_metagenome(str(tmp_path / "c"), PARAMS._replace(seed=2))
+    for kind in ("annotations", "coverage", "fasta"):
+        assert filecmp.cmp(first[kind], second[kind], shallow=False)
+    assert not filecmp.cmp(first["annotations"], other_seed["annotations"], shallow=False)
+
+
+def test_generator_shape(tmp_path):
+    paths = write_metagenome(str(tmp_path), PARAMS)
+    table = pandas.read_csv(paths["annotations"], sep="\t", header=None, names=ANNOTATION_COLUMNS, dtype=str, keep_default_na=False)
+    assert len(table) == PARAMS.n_genes
+    contigs = table["query_name"].str.rpartition("_")[0]
+    # genes are numbered from 1 within each contig, and contigs are contiguous blocks
+    assert (contigs != contigs.shift()).sum() == contigs.nunique()
+    assert 150 < contigs.nunique() < 350
+    go_hits = table["GO"] != ""
+    assert 0.4 < 1 - go_hits.mean() < 0.6
+    assert 2.0 < table.loc[go_hits, "GO"].str.count(",").add(1).mean() < 4.0
+    assert table.loc[go_hits, "GO"].str.match(r"^GO:\d{7}(,GO:\d{7})*$").all()
+
+    lengths = _fasta_lengths(paths["fasta"])
+    assert set(lengths) == set(contigs)
+    genes = contigs.value_counts()
+    assert all(genes[c] * PARAMS.bases_per_gene <= lengths[c] < (genes[c] + 1) * PARAMS.bases_per_gene for c in lengths)
+    coverage = pandas.read_csv(paths["coverage"], sep="\t", header=None, names=["contig", "coverage"])
+    assert set(coverage["contig"]) <= set(lengths)
+    assert len(coverage) > 0.9 * len(lengths)
+
+
+def test_results_kept_outside_repository(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    default_results = importlib.reload(run_pipeline_benchmark).DEFAULT_RESULTS
+    assert default_results == str(tmp_path / "eggnog_mapper" / "benchmark_results.jsonl")
+    monkeypatch.delenv("XDG_CACHE_HOME")
+    assert not os.path.abspath(importlib.reload(run_pipeline_benchmark).DEFAULT_RESULTS).startswith(REPO_DIR + os.sep)
+    assert parse_args(["--results", "runs.jsonl"]).results == "runs.jsonl"
+
+
+def test_harness_stores_stage_metrics(tmp_path):
+    # the results file's directory is created on the first run
+    results = str(tmp_path / "cache" / "results.jsonl")
+    for _ in range(2):
+        run_benchmarks([1000], ["columnar"], ["--min_contig_length", "1000", "--min_contig_coverage", "2", "--use_cov"], results, str(tmp_path / "data"), PARAMS)
+    records = load_results(results)
+    assert len(records) == 2
+    record = records[-1]
+    assert record["params"]["n_genes"] == 1000 and record["engine"] == "columnar"
+    metrics = record["metrics"]
+    for name in ("fasta_lengths", "coverage_import", "annotation_import", "aggregate", "export"):
+        assert name in metrics["stages"]
+    assert metrics["counters"]["annotation_rows"] == 1000
+    assert metrics["peak_rss_bytes"] is None or metrics["peak_rss_bytes"] > 0
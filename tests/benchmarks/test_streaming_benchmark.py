@@ -0,0 +1,57 @@
+"""
+Memory benchmark for streaming the annotation file. Reading the file in chunks, with only the
+needed columns, should keep peak memory well below loading the whole table.
+
+The peak memory depends on the pandas and pyarrow versions and allocator, so the comparison
+only runs with EGGNOG_BENCHMARKS=1.
+"""
+import tracemalloc
+from eggnog_mapper.annotations import (
+    ANNOTATION_COLUMNS,
+    read_annotations,
+    read_annotation_chunks
+)
+from eggnog_mapper.aggregate import summarize_contigs
+from tests.benchmarks import benchmark
+
+N_CONTIGS = 4000
+GENES_PER_CONTIG = 10
+
+
+def _write_annotations(path):
+    with open(path, "w") as f:
+        for contig in range(N_CONTIGS):
+            for gene in range(GENES_PER_CONTIG):
+                row = [f"value_{contig}_{gene}_{col}" for col in ANNOTATION_COLUMNS]
+                row[0] = f"1234_contig_{contig}_{gene + 1}"
+                row[ANNOTATION_COLUMNS.index("GO")] = ",".join(f"GO:{(contig + gene + i) % 500:07d}" for i in range(5))
+                row[ANNOTATION_COLUMNS.index("taxonomic_scope")] = "Bacteria"
+                row[ANNOTATION_COLUMNS.index("eggNOG_free_text_desc")] = "free text description " * 10
+                f.write("\t".join(row) + "\n")
+
+
+def _peak_memory(func):
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+@benchmark
+def test_streaming_peak_memory(tmp_path):
+    path = str(tmp_path / "1234_bench.annotations")
+    _write_annotations(path)
+
+    def full_read():
+        annotation_data = read_annotations(path)
+        summarize_contigs(annotation_data, ["GO"], 0.5)
+
+    def streamed():
+        for chunk in read_annotation_chunks(path, ["GO"], 2000):
+            summarize_contigs(chunk, ["GO"], 0.5)
+
+    full_peak = _peak_memory(full_read)
+    streamed_peak = _peak_memory(streamed)
+    assert streamed_peak * 4 < full_peak
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# eggnog_to_feature_table.py is run as a script and imports its sibling modules directly,
+# so make them importable the same way under pytest
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "eggnog_mapper"))
@@ -0,0 +1,216 @@
+import os
+import random
+import filecmp
+import pandas
+import pytest
+from collections import defaultdict
+from eggnog_mapper.aggregate import (
+    contig_ids_from_query_names,
+    summarize_contigs
+)
+from eggnog_mapper.annotations import read_annotation_chunks
+from eggnog_to_feature_table import (
+    _determine_consensus_taxonomy,
+    import_data,
+    scan_and_summarize_output,
+    scan_and_summarize_output_columnar,
+    scan_and_summarize_output_sweep
+)
+
+ANNOTATION_COLUMNS = 22
+CATEGORY_COLUMNS = {"GO": 6, "EC": 7, "KEGG_ko": 8, "taxonomic_scope": 17, "COG": 20}
+SCOPES = ["Bacteria", "Archaea", "Eukaryota", "Viruses"]
+
+
+def _write_annotation_file(path, seed=1):
+    """
+    Writes a small random annotation file. It includes genes without hits, single letter COG
+    values, contigs that show up again later in the file, and contigs with no coverage.
+    """
+    rng = random.Random(seed)
+    contig_order = [f"1234_contig_{i}" for i in range(40)] + ["1234_contig_3", "1234_contig_7"]
+    with open(path, "w") as f:
+        for contig in contig_order:
+            for gene in range(rng.randint(1, 8)):
+                row = ["-"] * ANNOTATION_COLUMNS
+                row[0] = f"{contig}_{gene + 1}"
+                for cat, col in CATEGORY_COLUMNS.items():
+                    if cat == "taxonomic_scope":
+                        row[col] = rng.choice(SCOPES[:rng.randint(1, len(SCOPES))])
+                    elif rng.random() < 0.3:
+                        row[col] = ""
+                    elif cat == "COG":
+                        row[col] = rng.choice(["S", "EG", "KT", "C"])
+                    else:
+                        row[col] = ",".join(f"{cat}:{rng.randint(0, 30)}" for _ in range(rng.randint(1, 4)))
+                f.write("\t".join(row) + "\n")
+    return sorted(set(contig_order))
+
+
+def _write_inputs(tmp_path):
+    annotation_file = tmp_path / "1234_sample.annotations"
+    coverage_file = tmp_path / "1234_coverage.tsv"
+    contigs = _write_annotation_file(annotation_file)
+    with open(coverage_file, "w") as f:
+        for i, contig in enumerate(contigs):
+            if i % 9 != 4:
+                f.write(f"{contig}\t{i % 7}\n")
+    annotation_data, coverages, contig_filter = import_data(str(annotation_file), True, str(coverage_file), "NULL", 1, False)
+    contig_lengths = {contig: 1000 * (i % 5) for i, contig in enumerate(contigs) if i != 11}
+    contigs_allowed = set(contigs) - contig_filter - {"1234_contig_20"}
+    fake_xref = defaultdict(list)
+    for i in range(0, 30, 2):
+        fake_xref[f"GO:{i}"] = [f"X:{i % 4}", f"X:{i % 3}"]
+    go_xrefs = {"fake2go": fake_xref}
+    return annotation_data, coverages, contigs_allowed, contig_lengths, go_xrefs
+
+
+def _run_engines(tmp_path, input_cats, cov_method, binary_output, chunk_size=None, processes=1):
+    """
+    Runs the reference loop once per category, and the columnar engine once for all
+    categories, each in their own output directory. If chunk_size is given, the columnar
+    engine streams the annotation file in chunks, summarized by the given number of processes.
+    """
+    annotation_data, coverages, contigs_allowed, contig_lengths, go_xrefs = _write_inputs(tmp_path)
+    if chunk_size is not None:
+        annotation_chunks = read_annotation_chunks(str(tmp_path / "1234_sample.annotations"), input_cats, chunk_size)
+    else:
+        annotation_chunks = annotation_data
+    prefixes = {cat: f"1234_len2000_cov5_{cat}_{cov_method}" for cat in input_cats}
+    cwd = os.getcwd()
+    try:
+        os.makedirs(tmp_path / "loop")
+        os.chdir(tmp_path / "loop")
+        for cat in input_cats:
+            scan_and_summarize_output(prefixes[cat], "1234_sample.annotations", cat, cov_method, annotation_data, coverages, contigs_allowed, "Yes", binary_output, contig_lengths, 0.5, 2000, 5, go_xrefs)
+        os.makedirs(tmp_path / "columnar")
+        os.chdir(tmp_path / "columnar")
+        scan_and_summarize_output_columnar(prefixes, "1234_sample.annotations", cov_method, annotation_chunks, coverages, contigs_allowed, "Yes", binary_output, contig_lengths, 0.5, 2000, 5, go_xrefs, processes)
+    finally:
+        os.chdir(cwd)
+
+
+def _assert_same_outputs(dir_a, dir_b):
+    files = sorted(os.listdir(dir_a))
+    assert files == sorted(os.listdir(dir_b))
+    for file_name in files:
+        assert filecmp.cmp(dir_a / file_name, dir_b / file_name, shallow=False), file_name
+    return files
+
+
+@pytest.mark.parametrize("input_cat", ["GO", "EC", "KEGG_ko", "COG"])
+@pytest.mark.parametrize("cov_method,binary_output", [("weighted", "No"), ("unweighted", "No"), ("unweighted", "Yes")])
+def test_columnar_matches_loop(tmp_path, input_cat, cov_method, binary_output):
+    _run_engines(tmp_path, [input_cat], cov_method, binary_output)
+    files = _assert_same_outputs(tmp_path / "loop", tmp_path / "columnar")
+    assert f"1234_len2000_cov5_{input_cat}_{cov_method}_summary.tsv" in files
+
+
+@pytest.mark.parametrize("cov_method", ["weighted", "unweighted"])
+def test_columnar_single_pass_matches_loop(tmp_path, cov_method):
+    input_cats = ["GO", "EC", "KEGG_ko", "COG"]
+    _run_engines(tmp_path, input_cats, cov_method, "No")
+    files = _assert_same_outputs(tmp_path / "loop", tmp_path / "columnar")
+    for cat in input_cats:
+        assert f"1234_len2000_cov5_{cat}_{cov_method}_summary.tsv" in files
+    assert f"1234_len2000_cov5_GO_{cov_method}_fake2go_count_table.csv" in files
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 50, 0])
+@pytest.mark.parametrize("cov_method", ["weighted", "unweighted"])
+def test_columnar_streaming_matches_loop(tmp_path, chunk_size, cov_method):
+    _run_engines(tmp_path, ["GO", "COG"], cov_method, "No", chunk_size=chunk_size)
+    files = _assert_same_outputs(tmp_path / "loop", tmp_path / "columnar")
+    assert f"1234_len2000_cov5_GO_{cov_method}_direct_count_table.csv" in files
+
+
+@pytest.mark.parametrize("chunk_size", [5, 0])
+@pytest.mark.parametrize("cov_method", ["weighted", "unweighted"])
+def test_columnar_multiprocess_matches_loop(tmp_path, chunk_size, cov_method):
+    _run_engines(tmp_path, ["GO", "EC", "COG"], cov_method, "No", chunk_size=chunk_size, processes=3)
+    files = _assert_same_outputs(tmp_path / "loop", tmp_path / "columnar")
+    assert f"1234_len2000_cov5_GO_{cov_method}_fake2go_count_table.csv" in files
+
+
+@pytest.mark.parametrize("chunk_size,processes", [(0, 1), (7, 1), (5, 3)])
+@pytest.mark.parametrize("cov_method", ["weighted", "unweighted"])
+def test_sweep_matches_separate_runs(tmp_path, chunk_size, processes, cov_method):
+    annotation_data, coverages, _, contig_lengths, go_xrefs = _write_inputs(tmp_path)
+    thresholds = [(0, 0), (2000, 0), (2000, 3), (4000, 5)]
+    input_cats = ["GO", "COG"]
+    prefixes = {
+        (min_length, min_coverage): {cat: f"1234_len{min_length}_cov{min_coverage}_{cat}_{cov_method}" for cat in input_cats}
+        for min_length, min_coverage in thresholds
+    }
+    contigs_allowed = set(contig_lengths) - {"1234_contig_20"}
+    cwd = os.getcwd()
+    try:
+        os.makedirs(tmp_path / "separate")
+        os.chdir(tmp_path / "separate")
+        for min_length, min_coverage in thresholds:
+            allowed = {
+                contig for contig in contigs_allowed
+                if contig_lengths[contig] >= min_length and coverages.get(contig, min_coverage) >= min_coverage
+            }
+            scan_and_summarize_output_columnar(prefixes[(min_length, min_coverage)], "1234_sample.annotations", cov_method, annotation_data, coverages, allowed, "Yes", "No", contig_lengths, 0.5, min_length, min_coverage, go_xrefs)
+        os.makedirs(tmp_path / "sweep")
+        os.chdir(tmp_path / "sweep")
+        annotation_chunks = read_annotation_chunks(str(tmp_path / "1234_sample.annotations"), input_cats, chunk_size)
+        scan_and_summarize_output_sweep(prefixes, "1234_sample.annotations", cov_method, annotation_chunks, coverages, contigs_allowed, "Yes", "No", contig_lengths, 0.5, go_xrefs, processes)
+    finally:
+        os.chdir(cwd)
+    files = _assert_same_outputs(tmp_path / "separate", tmp_path / "sweep")
+    assert len(files) == len(thresholds) * 5
+
+
+def test_contig_ids_from_query_names():
+    query_names = pandas.Series(["1085605_contig_1_32", "1085605_contig_12_1", "nounderscore"])
+    assert contig_ids_from_query_names(query_names).tolist() == ["1085605_contig_1", "1085605_contig_12", ""]
+
+
+def test_summarize_contigs():
+    annotation_data = pandas.DataFrame({
+        "query_name": ["a_1_1", "a_1_2", "a_1_3", "a_2_1", "a_1_4"],
+        "taxonomic_scope": ["Bacteria", "Archaea", "Bacteria", "Viruses", "Viruses"],
+        "GO": ["GO:1,GO:2", None, "GO:2", "GO:3", "GO:1"]
+    })
+    aggregates = summarize_contigs(annotation_data, ["GO"], 0.5)
+    assert aggregates.contigs["contig_id"].tolist() == ["a_1", "a_2", "a_1"]
+    assert aggregates.contigs["gene_count"].tolist() == [3, 1, 1]
+    assert aggregates.contigs["consensus_taxonomy"].tolist() == ["Bacteria", "Viruses", "Viruses"]
+    assert aggregates.contigs["consensus_taxonomy_frequency"].tolist() == [0.67, 1.0, 1.0]
+    assert aggregates.non_hits["GO"].tolist() == [1, 0, 0]
+    features = aggregates.features["GO"]
+    assert list(zip(features["run"], features["feature"], features["count"])) == [
+        (0, "GO:1", 1), (0, "GO:2", 2), (1, "GO:3", 1), (2, "GO:1", 1)
+    ]
+
+
+def test_consensus_taxonomy_tie_break():
+    annotation_data = pandas.DataFrame({
+        "query_name": ["a_1_1", "a_1_2", "a_1_3", "a_1_4", "a_1_5", "b_1_1", "b_1_2", "c_1_1", "c_1_2", "c_1_3"],
+        "taxonomic_scope": ["Archaea", "Bacteria", "Bacteria", "Viruses", "Viruses", "Viruses", "Bacteria", "Archaea", "Bacteria", "Viruses"],
+        "GO": [None] * 10
+    })
+    aggregates = summarize_contigs(annotation_data, ["GO"], 0.3)
+    # the most frequent scope wins, even if an earlier one passes the threshold, and ties go
+    # to the first scope on the contig
+    assert aggregates.contigs["consensus_taxonomy"].tolist() == ["Bacteria", "Viruses", "Archaea"]
+    assert aggregates.contigs["consensus_taxonomy_frequency"].tolist() == [0.4, 0.5, 0.33]
+    for contig in ["a_1", "b_1", "c_1"]:
+        rows = annotation_data["query_name"].str.startswith(contig)
+        scopes = annotation_data["taxonomic_scope"][rows].tolist()
+        assert _determine_consensus_taxonomy(scopes, 0.3, len(scopes)) == tuple(
+            aggregates.contigs.loc[aggregates.contigs["contig_id"] == contig, ["consensus_taxonomy", "consensus_taxonomy_frequency"]].iloc[0]
+        )
+
+
+def test_skip_taxonomy():
+    annotation_data = pandas.DataFrame({
+        "query_name": ["a_1_1", "a_1_2", "a_2_1"],
+        "GO": ["GO:1", None, "GO:3"]
+    })
+    aggregates = summarize_contigs(annotation_data, ["GO"], None)
+    assert aggregates.contigs["consensus_taxonomy"].tolist() == ["NA", "NA"]
+    assert aggregates.contigs["consensus_taxonomy_frequency"].tolist() == ["NA", "NA"]
+    assert _determine_consensus_taxonomy(["Bacteria"], None, 1) == ("NA", "NA")
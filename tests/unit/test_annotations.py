@@ -0,0 +1,229 @@
+import io
+import os
+import sys
+import gzip
+import threading
+import pandas
+import pytest
+from eggnog_mapper import annotations
+from eggnog_mapper.annotations import (
+    ANNOTATION_COLUMNS,
+    annotation_layout,
+    is_annotation_stream,
+    required_columns,
+    read_annotations,
+    read_annotation_chunks
+)
+
+V2_HEADER = [
+    "query", "seed_ortholog", "evalue", "score", "eggNOG_OGs", "max_annot_lvl", "COG_category", "Description",
+    "Preferred_name", "GOs", "EC", "KEGG_ko", "KEGG_Pathway", "KEGG_Module", "KEGG_Reaction", "KEGG_rclass",
+    "BRITE", "KEGG_TC", "CAZy", "BiGG_Reaction", "PFAMs"
+]
+CONTIG_GENES = [("A_contig_1", 3), ("A_contig_2", 1), ("A_contig_3", 5), ("A_contig_1", 2), ("A_contig_4", 1)]
+
+
+def _write_annotations(path):
+    with open(path, "w") as f:
+        for contig, genes in CONTIG_GENES:
+            for gene in range(genes):
+                row = [f"col{i}" for i in range(len(ANNOTATION_COLUMNS))]
+                row[0] = f"{contig}_{gene + 1}"
+                f.write("\t".join(row) + "\n")
+
+
+def test_required_columns():
+    assert required_columns(["COG", "GO"]) == ["query_name", "GO", "taxonomic_scope", "COG"]
+    assert required_columns(["COG", "GO"], taxonomy=False) == ["query_name", "GO", "COG"]
+
+
+def test_read_annotations(tmp_path):
+    path = tmp_path / "test.annotations"
+    _write_annotations(path)
+    annotation_data = read_annotations(str(path))
+    assert list(annotation_data.columns) == ANNOTATION_COLUMNS
+    assert len(annotation_data) == 12
+    annotation_data = read_annotations(str(path), ["EC"])
+    assert list(annotation_data.columns) == ["query_name", "EC", "taxonomic_scope"]
+
+
+def test_read_annotation_chunks_end_on_contig_boundaries(tmp_path):
+    path = tmp_path / "test.annotations"
+    _write_annotations(path)
+    full = read_annotations(str(path), ["GO"])
+    for chunk_size in [1, 2, 4, 5, 100]:
+        chunks = list(read_annotation_chunks(str(path), ["GO"], chunk_size))
+        assert list(chunks[0].columns) == ["query_name", "GO", "taxonomic_scope", "contig_id"]
+        combined = pandas.concat([chunk.drop(columns="contig_id") for chunk in chunks], ignore_index=True)
+        pandas.testing.assert_frame_equal(combined.astype(object), full.astype(object))
+        for chunk in chunks:
+            assert chunk.index[0] == 0
+            assert list(chunk["contig_id"].astype(object)) == [name.rsplit("_", 1)[0] for name in chunk["query_name"]]
+        for previous, chunk in zip(chunks, chunks[1:]):
+            last_contig = previous["query_name"].iloc[-1].rsplit("_", 1)[0]
+            first_contig = chunk["query_name"].iloc[0].rsplit("_", 1)[0]
+            assert last_contig != first_contig
+
+
+def test_read_annotation_chunks_whole_file(tmp_path):
+    path = tmp_path / "test.annotations"
+    _write_annotations(path)
+    chunks = list(read_annotation_chunks(str(path), ["GO"], 0))
+    assert len(chunks) == 1
+    assert len(chunks[0]) == 12
+
+
+def _write_v2_annotations(path):
+    with open(path, "w") as f:
+        f.write("## emapper-2.1.12\n## command: emapper.py -i proteins.faa\n")
+        f.write("#" + "\t".join(V2_HEADER) + "\n")
+        for contig, genes in CONTIG_GENES:
+            for gene in range(genes):
+                row = {name: "-" for name in V2_HEADER}
+                row.update({"query": f"{contig}_{gene + 1}", "GOs": f"GO:{gene:07d},GO:0000100", "max_annot_lvl": "2|Bacteria", "EC": ""})
+                f.write("\t".join(row[name] for name in V2_HEADER) + "\n")
+        f.write("## 12 queries scanned\n## Total time (seconds): 1.5\n")
+
+
+def test_annotation_layout(tmp_path):
+    path = tmp_path / "v2.annotations"
+    _write_v2_annotations(path)
+    layout = annotation_layout(str(path))
+    assert layout.skip_rows == 3
+    with open(path, "rb") as f:
+        assert f.read()[layout.data_end:].startswith(b"## 12 queries scanned")
+    assert layout.columns[:3] == ["query_name", "seed_eggNOG_ortholog", "seed_ortholog_evalue"]
+    assert {"GO", "COG", "taxonomic_scope", "eggNOG_free_text_desc", "PFAMs"} <= set(layout.columns)
+    assert layout.version == 2
+    assert "-" in layout.na_values
+    _write_annotations(path)
+    assert annotation_layout(str(path)) == (ANNOTATION_COLUMNS, 0, None, 1)
+    assert "-" not in annotation_layout(str(path)).na_values
+
+
+@pytest.mark.parametrize("parser", ["c", "pyarrow"])
+def test_read_v2_annotations(tmp_path, parser):
+    path = tmp_path / "v2.annotations"
+    _write_v2_annotations(path)
+    annotation_data = read_annotations(str(path), ["GO", "EC"], parser=parser)
+    assert list(annotation_data.columns) == ["query_name", "GO", "EC", "taxonomic_scope"]
+    assert len(annotation_data) == 12
+    assert annotation_data["query_name"].iloc[0] == "A_contig_1_1"
+    assert annotation_data["GO"].iloc[1] == "GO:0000001,GO:0000100"
+    assert annotation_data["EC"].isna().all()
+    assert isinstance(annotation_data["taxonomic_scope"].dtype, pandas.CategoricalDtype)
+    assert list(annotation_data["taxonomic_scope"].cat.categories) == ["2|Bacteria"]
+    chunks = list(read_annotation_chunks(str(path), ["GO"], 4, parser=parser))
+    assert sum(len(chunk) for chunk in chunks) == 12
+    assert not any(chunk["query_name"].str.startswith("#").any() for chunk in chunks)
+
+
+@pytest.mark.parametrize("parser", ["c", "pyarrow"])
+@pytest.mark.parametrize("chunk_size", [None, 4])
+def test_v2_dash_is_missing(tmp_path, parser, chunk_size):
+    # "-" is the missing value of v2 files: no "-" features, and genes without an annotation
+    # are non-hits
+    from eggnog_mapper.aggregate import summarize_contigs
+    path = tmp_path / "v2.annotations"
+    _write_v2_annotations(path)
+    with open(path) as f:
+        lines = f.readlines()
+    # two genes of A_contig_1 have no GO terms
+    lines[4] = lines[4].replace("GO:0000001,GO:0000100", "-")
+    lines[12] = lines[12].replace("GO:0000000,GO:0000100", "-")
+    with open(path, "w") as f:
+        f.writelines(lines)
+    if chunk_size is None:
+        chunks = [read_annotations(str(path), ["GO", "EC"], parser=parser)]
+    else:
+        chunks = list(read_annotation_chunks(str(path), ["GO", "EC"], chunk_size, parser=parser))
+    annotation_data = pandas.concat(chunks, ignore_index=True)
+    assert annotation_data["EC"].isna().all()
+    assert annotation_data["GO"].isna().sum() == 2
+    features, non_hits = {}, {"GO": 0, "EC": 0}
+    for chunk in chunks:
+        aggregates = summarize_contigs(chunk, ["GO", "EC"], 0.5)
+        for cat in ["GO", "EC"]:
+            for feature, count in zip(aggregates.features[cat]["feature"], aggregates.features[cat]["count"]):
+                features[feature] = features.get(feature, 0) + count
+            non_hits[cat] += int(aggregates.non_hits[cat].sum())
+    assert "-" not in features
+    assert features["GO:0000100"] == 10
+    assert non_hits == {"GO": 2, "EC": 12}
+    assert "-" not in read_annotations(str(path))["GO"].tolist()
+
+
+def test_pyarrow_parser_matches(tmp_path):
+    path = tmp_path / "test.annotations"
+    _write_annotations(path)
+    for chunk_size in [0, 3]:
+        c_chunks = list(read_annotation_chunks(str(path), ["GO", "EC"], chunk_size))
+        arrow_chunks = list(read_annotation_chunks(str(path), ["GO", "EC"], chunk_size, parser="pyarrow"))
+        c_rows = pandas.concat(c_chunks, ignore_index=True).astype(object)
+        arrow_rows = pandas.concat(arrow_chunks, ignore_index=True).astype(object)
+        pandas.testing.assert_frame_equal(arrow_rows, c_rows)
+
+
+def test_missing_category_column(tmp_path):
+    path = tmp_path / "v2.annotations"
+    _write_v2_annotations(path)
+    with pytest.raises(ValueError, match="has no best_eggNOG_OG column"):
+        read_annotations(str(path), ["best_eggNOG_OG"])
+
+
+def _gzip_copy(path):
+    with open(path, "rb") as f, gzip.open(f"{path}.gz", "wb") as out:
+        out.write(f.read())
+    return f"{path}.gz"
+
+
+@pytest.mark.parametrize("parser", ["c", "pyarrow"])
+def test_read_compressed_annotations(tmp_path, parser):
+    path = tmp_path / "v2.annotations"
+    _write_v2_annotations(path)
+    gz_path = _gzip_copy(path)
+    assert is_annotation_stream(gz_path)
+    assert not is_annotation_stream(str(path))
+    assert not is_annotation_stream(str(tmp_path / "missing.annotations"))
+    expected = read_annotations(str(path), ["GO", "EC"], parser=parser)
+    pandas.testing.assert_frame_equal(read_annotations(gz_path, ["GO", "EC"], parser=parser), expected)
+    for chunk_size in [1, 4, 100]:
+        chunks = list(read_annotation_chunks(gz_path, ["GO", "EC"], chunk_size, parser=parser))
+        pandas.testing.assert_frame_equal(pandas.concat(chunks, ignore_index=True).astype(object), pandas.concat(read_annotation_chunks(str(path), ["GO", "EC"], chunk_size, parser=parser), ignore_index=True).astype(object))
+
+
+def test_read_annotations_from_stdin(tmp_path, monkeypatch):
+    path = tmp_path / "v2.annotations"
+    _write_v2_annotations(path)
+    # comment lines in the middle of the data are dropped too
+    with open(path) as f:
+        lines = f.readlines()
+    lines.insert(8, "## resumed\n")
+    data = "".join(lines).encode()
+    monkeypatch.setattr(sys, "stdin", io.TextIOWrapper(io.BufferedReader(io.BytesIO(data))))
+    # small reads, so lines are split across them
+    monkeypatch.setattr(annotations, "_STREAM_BLOCK", 7)
+    chunks = list(read_annotation_chunks("-", ["GO"], 2))
+    assert not sys.stdin.closed
+    assert [len(chunk) for chunk in chunks] == [3, 1, 5, 2, 1]
+    assert list(chunks[-1]["query_name"]) == ["A_contig_4_1"]
+    pandas.testing.assert_frame_equal(pandas.concat(chunks, ignore_index=True).drop(columns="contig_id").astype(object), read_annotations(str(path), ["GO"]).astype(object))
+
+
+@pytest.mark.skipif(not hasattr(os, "mkfifo"), reason="named pipes not supported")
+def test_read_annotations_from_named_pipe(tmp_path):
+    path = tmp_path / "test.annotations"
+    _write_annotations(path)
+    fifo = tmp_path / "annotations.fifo"
+    os.mkfifo(fifo)
+    assert is_annotation_stream(str(fifo))
+
+    def write():
+        with open(path, "rb") as f, open(fifo, "wb") as out:
+            out.write(f.read())
+    writer = threading.Thread(target=write)
+    writer.start()
+    chunks = list(read_annotation_chunks(str(fifo), ["GO"], 4))
+    writer.join()
+    assert sum(len(chunk) for chunk in chunks) == 12
+    pandas.testing.assert_frame_equal(pandas.concat(chunks, ignore_index=True).drop(columns="contig_id").astype(object), read_annotations(str(path), ["GO"]).astype(object))
@@ -0,0 +1,126 @@
+import os
+import numpy
+import pandas
+import pytest
+from tests.unit.test_aggregate import (
+    _write_inputs,
+    _assert_same_outputs
+)
+from eggnog_mapper.aggregate import summarize_contigs
+from eggnog_mapper.annotations import read_annotation_chunks
+from eggnog_mapper.go_ontology import load_go_closure
+from eggnog_mapper.contig_store import (
+    contig_store_path,
+    save_contig_store,
+    load_contig_store,
+    store_is_current,
+    ContigStoreWriter
+)
+from eggnog_to_feature_table import scan_and_summarize_output_columnar
+
+CATEGORIES = ["GO", "EC", "COG"]
+
+
+def _assert_same_aggregates(a, b, categories):
+    pandas.testing.assert_frame_equal(a.contigs, b.contigs)
+    for input_cat in categories:
+        assert numpy.array_equal(a.non_hits[input_cat], b.non_hits[input_cat])
+        pandas.testing.assert_frame_equal(a.features[input_cat], b.features[input_cat], check_dtype=False)
+
+
+def test_contig_store_path():
+    assert contig_store_path("/out", "/data/1234_sample.annotations") == "/out/1234_contig_store"
+
+
+def test_store_round_trip(tmp_path):
+    annotation_data = pandas.DataFrame({
+        "query_name": ["a_1_1", "a_1_2", "nounderscore", "b_1_1", "a_1_3"],
+        "taxonomic_scope": ["Bacteria", None, "Archaea", "Viruses", "NA"],
+        "GO": ["GO:1,GO:2", None, "GO:2", "GO:3", "GO:1"],
+        "COG": ["S", "EG", None, "KT", "C"]
+    })
+    annotation_file = tmp_path / "1234_sample.annotations"
+    annotation_file.write_text("placeholder\n")
+    aggregates = summarize_contigs(annotation_data, ["GO", "COG"], 0.4)
+    store_dir = str(tmp_path / "store")
+    save_contig_store(store_dir, aggregates, ["GO", "COG"], str(annotation_file), 0.4)
+    _assert_same_aggregates(load_contig_store(store_dir, ["GO", "COG"]), aggregates, ["GO", "COG"])
+    with pytest.raises(ValueError):
+        load_contig_store(store_dir, ["EC"])
+    with pytest.raises(ValueError):
+        load_contig_store(str(tmp_path / "missing"), ["GO"])
+
+
+def test_store_is_current(tmp_path):
+    annotation_file = tmp_path / "1234_sample.annotations"
+    annotation_file.write_text("placeholder\n")
+    aggregates = summarize_contigs(pandas.DataFrame({"query_name": ["a_1_1"], "taxonomic_scope": ["Bacteria"], "GO": ["GO:1"]}), ["GO"], 0.5)
+    store_dir = str(tmp_path / "store")
+    assert not store_is_current(store_dir, str(annotation_file), ["GO"], 0.5)
+    save_contig_store(store_dir, aggregates, ["GO"], str(annotation_file), 0.5)
+    assert store_is_current(store_dir, str(annotation_file), ["GO"], 0.5)
+    assert not store_is_current(store_dir, str(annotation_file), ["GO"], 0.6)
+    assert not store_is_current(store_dir, str(annotation_file), ["GO", "EC"], 0.5)
+    annotation_file.write_text("changed annotation\n")
+    assert not store_is_current(store_dir, str(annotation_file), ["GO"], 0.5)
+
+
+def test_store_is_current_with_go_propagation(tmp_path):
+    annotation_file = tmp_path / "1234_sample.annotations"
+    annotation_file.write_text("placeholder\n")
+    obo_file = tmp_path / "go.obo"
+    obo_file.write_text("[Term]\nid: GO:1\n")
+    closure = load_go_closure(str(obo_file))
+    categories = ["GO", "GO_propagated"]
+    aggregates = summarize_contigs(pandas.DataFrame({"query_name": ["a_1_1"], "taxonomic_scope": ["Bacteria"], "GO": ["GO:1"]}), categories, 0.5, closure)
+    store_dir = str(tmp_path / "store")
+    save_contig_store(store_dir, aggregates, categories, str(annotation_file), 0.5, str(obo_file))
+    assert store_is_current(store_dir, str(annotation_file), categories, 0.5, str(obo_file))
+    assert not store_is_current(store_dir, str(annotation_file), categories, 0.5)
+    obo_file.write_text("[Term]\nid: GO:1\n\n[Term]\nid: GO:2\nis_a: GO:1\n")
+    assert not store_is_current(store_dir, str(annotation_file), categories, 0.5, str(obo_file))
+    # the GO counts alone don't depend on the ontology
+    assert store_is_current(store_dir, str(annotation_file), ["GO"], 0.5)
+
+
+@pytest.mark.parametrize("cov_method,binary_output,processes", [("weighted", "No", 1), ("unweighted", "Yes", 2)])
+def test_outputs_from_store_match_annotations(tmp_path, cov_method, binary_output, processes):
+    annotation_data, coverages, contigs_allowed, contig_lengths, go_xrefs = _write_inputs(tmp_path)
+    annotation_file = str(tmp_path / "1234_sample.annotations")
+    prefixes = {cat: f"1234_len2000_cov5_{cat}_{cov_method}" for cat in CATEGORIES}
+    store_dir = str(tmp_path / "1234_contig_store")
+
+    cwd = os.getcwd()
+    try:
+        # the store is built chunk by chunk while a streamed first run writes its outputs
+        os.makedirs(tmp_path / "streamed")
+        os.chdir(tmp_path / "streamed")
+        with ContigStoreWriter(store_dir, CATEGORIES) as writer:
+            scan_and_summarize_output_columnar(prefixes, "1234_sample.annotations", cov_method, read_annotation_chunks(annotation_file, CATEGORIES, 7), coverages, contigs_allowed, "Yes", binary_output, contig_lengths, 0.5, 2000, 5, go_xrefs, processes, aggregates_sink=writer.add)
+            writer.finish(annotation_file, 0.5)
+        assert not [name for name in os.listdir(store_dir) if name.endswith(".part")]
+        _assert_same_aggregates(load_contig_store(store_dir, CATEGORIES), summarize_contigs(annotation_data, CATEGORIES, 0.5), CATEGORIES)
+
+        for name, chunks in [("annotations", annotation_data), ("store", [load_contig_store(store_dir, CATEGORIES)])]:
+            os.makedirs(tmp_path / name)
+            os.chdir(tmp_path / name)
+            scan_and_summarize_output_columnar(prefixes, "1234_sample.annotations", cov_method, chunks, coverages, contigs_allowed, "Yes", binary_output, contig_lengths, 0.5, 2000, 5, go_xrefs)
+    finally:
+        os.chdir(cwd)
+    files = _assert_same_outputs(tmp_path / "annotations", tmp_path / "store")
+    _assert_same_outputs(tmp_path / "annotations", tmp_path / "streamed")
+    assert f"1234_len2000_cov5_GO_{'binary' if binary_output == 'Yes' else cov_method}_fake2go_count_table.csv" in files
+
+
+def test_unfinished_store_is_removed(tmp_path):
+    annotation_file = tmp_path / "1234_sample.annotations"
+    annotation_file.write_text("placeholder\n")
+    aggregates = summarize_contigs(pandas.DataFrame({"query_name": ["a_1_1"], "taxonomic_scope": ["Bacteria"], "GO": ["GO:1"]}), ["GO"], 0.5)
+    store_dir = str(tmp_path / "store")
+    save_contig_store(store_dir, aggregates, ["GO"], str(annotation_file), 0.5)
+    with pytest.raises(RuntimeError):
+        with ContigStoreWriter(store_dir, ["GO"]) as writer:
+            writer.add(aggregates)
+            raise RuntimeError("summarizing failed")
+    assert not store_is_current(store_dir, str(annotation_file), ["GO"], 0.5)
+    assert not [name for name in os.listdir(store_dir) if name.endswith(".part")]
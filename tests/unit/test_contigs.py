@@ -1,9 +1,20 @@
+from eggnog_mapper import contigs
 from eggnog_mapper.contigs import (
+    load_contig_lengths,
+    length_cache_path,
+    open_fasta,
+    read_lengths_table,
+    scan_fasta_lengths,
     summarize_contig_lengths,
     filter_contig_lengths
 )
+import os
 from os import path
+import gzip
+import random
+import shutil
 import tempfile
+import pytest
 
 TEST_FASTA_FILE = path.join(path.dirname(__file__), "..", "data", "simple_file.fasta")
 TEST_CONTIG_LENS = {
@@ -16,7 +27,9 @@ TEST_OUTPUT_FILE = "_test_simple_contigs.tsv"
 def test_summarize_contig_length():
     with tempfile.TemporaryDirectory() as tmpdirname:
         test_outfile = path.join(tmpdirname, TEST_OUTPUT_FILE)
-        contig_lens = summarize_contig_lengths(TEST_FASTA_FILE, test_outfile)
+        # copied so that the length cache is written to the temp dir
+        test_fasta = shutil.copy(TEST_FASTA_FILE, tmpdirname)
+        contig_lens = summarize_contig_lengths(test_fasta, test_outfile)
         assert contig_lens == TEST_CONTIG_LENS
         with open(test_outfile, "r") as testfile:
             lines = testfile.readlines()
@@ -30,3 +43,123 @@ def test_summarize_contig_length():
 def test_filter_contig_lengths():
     filtered = filter_contig_lengths(TEST_CONTIG_LENS, 60)
     assert filtered == set(["foo", "bar"])
+
+
+def _write_random_fasta(file_path, seed=1):
+    """
+    Writes FASTA records with wrapped and unwrapped sequences, CRLF line ends, descriptions,
+    empty records and blank lines.
+    """
+    rng = random.Random(seed)
+    with open(file_path, "w", newline="") as f:
+        for i in range(50):
+            newline = "\r\n" if i % 7 == 3 else "\n"
+            description = f" description {i} > with symbols" if i % 3 == 0 else ""
+            f.write(f">contig_{i}{description}{newline}")
+            seq = "".join(rng.choice("ACGTN") for _ in range(rng.choice([0, 1, 59, 60, 61, 500])))
+            width = rng.choice([60, 80, len(seq) or 1])
+            for start in range(0, len(seq), width):
+                f.write(seq[start:start + width] + newline)
+            if i % 11 == 5:
+                f.write(newline)
+
+
+@pytest.mark.parametrize("block_size", [1, 2, 3, 7, 64, 1 << 20])
+def test_scan_fasta_lengths_matches_seqio(tmp_path, block_size):
+    SeqIO = pytest.importorskip("Bio.SeqIO")
+    fasta = tmp_path / "contigs.fa"
+    _write_random_fasta(fasta)
+    expected = [(rec.id, len(rec)) for rec in SeqIO.parse(str(fasta), "fasta")]
+    ids, lengths = scan_fasta_lengths(str(fasta), block_size=block_size)
+    assert list(zip(ids, lengths)) == expected
+
+
+def test_summarize_contig_length_gzip(tmp_path):
+    gzipped = tmp_path / "simple_file.fasta.gz"
+    with open(TEST_FASTA_FILE, "rb") as f_in, gzip.open(gzipped, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    outfile = tmp_path / TEST_OUTPUT_FILE
+    assert summarize_contig_lengths(str(gzipped), str(outfile)) == TEST_CONTIG_LENS
+    assert outfile.read_text() == "foo\t20\nbar\t40\nbaz\t60\n"
+
+
+def test_open_fasta_and_read_lengths_table(tmp_path):
+    gzipped = tmp_path / "simple_file.fasta.gz"
+    with open(TEST_FASTA_FILE, "rb") as f_in, gzip.open(gzipped, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    with open(TEST_FASTA_FILE, "rb") as f, open_fasta(str(gzipped)) as g:
+        assert g.read() == f.read()
+    table = tmp_path / "lengths.tsv"
+    table.write_text("contig_id\tlength\nfoo\t20\tignored\nbar\t40\tignored\n")
+    assert dict(read_lengths_table(str(table), skip_rows=1)) == {"foo": 20, "bar": 40}
+
+
+def test_scan_fasta_lengths_empty(tmp_path):
+    fasta = tmp_path / "empty.fa"
+    fasta.write_text("")
+    assert scan_fasta_lengths(str(fasta)) == ([], [])
+
+
+def test_scan_fasta_lengths_skips_leading_text(tmp_path):
+    fasta = tmp_path / "leading.fa"
+    fasta.write_text("comment line\n>a desc\nAC GT\n>b\n")
+    assert scan_fasta_lengths(str(fasta)) == (["a", "b"], [4, 0])
+
+
+def _set_mtime(file_path, mtime):
+    os.utime(file_path, (mtime, mtime))
+
+
+def _no_scan(*args, **kwargs):
+    raise AssertionError("the FASTA file shouldn't be scanned")
+
+
+def _raise_os_error(*args, **kwargs):
+    raise OSError("read-only")
+
+
+def test_load_contig_lengths_uses_fai(tmp_path, monkeypatch):
+    fasta = shutil.copy(TEST_FASTA_FILE, tmp_path)
+    _set_mtime(fasta, 1000)
+    fai = tmp_path / "simple_file.fasta.fai"
+    fai.write_text("foo\t20\t5\t20\t21\nbar\t40\t31\t40\t41\nNA\t60\t77\t60\t61\n")
+    monkeypatch.setattr(contigs, "scan_fasta_lengths", _no_scan)
+    assert load_contig_lengths(fasta) == ({"foo": 20, "bar": 40, "NA": 60}, "fai")
+
+
+def test_load_contig_lengths_ignores_stale_fai(tmp_path):
+    fasta = shutil.copy(TEST_FASTA_FILE, tmp_path)
+    fai = tmp_path / "simple_file.fasta.fai"
+    fai.write_text("foo\t1\t5\t1\t2\n")
+    _set_mtime(fai, 1000)
+    assert load_contig_lengths(fasta) == (TEST_CONTIG_LENS, "fasta")
+
+
+def test_load_contig_lengths_cache(tmp_path, monkeypatch):
+    fasta = shutil.copy(TEST_FASTA_FILE, tmp_path)
+    assert load_contig_lengths(fasta) == (TEST_CONTIG_LENS, "fasta")
+    assert os.path.exists(length_cache_path(fasta))
+    with monkeypatch.context() as m:
+        m.setattr(contigs, "scan_fasta_lengths", _no_scan)
+        assert load_contig_lengths(fasta) == (TEST_CONTIG_LENS, "cache")
+    # a changed FASTA file invalidates the cache
+    with open(fasta, "a") as f:
+        f.write(">qux\nACGT\n")
+    assert load_contig_lengths(fasta) == (dict(TEST_CONTIG_LENS, qux=4), "fasta")
+
+
+def test_summarize_contig_lengths_ignores_summary(tmp_path):
+    # the summary of another assembly with the same sample prefix isn't taken for this one
+    fasta = shutil.copy(TEST_FASTA_FILE, tmp_path)
+    _set_mtime(fasta, 1000)
+    summary = tmp_path / "simple_contig_length_summary.tsv"
+    summary.write_text("foo\t25\nqux\t50\n")
+    assert summarize_contig_lengths(fasta, str(summary)) == TEST_CONTIG_LENS
+    assert summary.read_text() == "foo\t20\nbar\t40\nbaz\t60\n"
+
+
+def test_summarize_contig_lengths_read_only_dir(tmp_path, monkeypatch):
+    fasta = shutil.copy(TEST_FASTA_FILE, tmp_path)
+    monkeypatch.setattr(contigs, "_write_lengths_table", _raise_os_error)
+    assert summarize_contig_lengths(fasta, None) == TEST_CONTIG_LENS
+    assert not os.path.exists(length_cache_path(fasta))
@@ -0,0 +1,59 @@
+from collections import Counter
+import numpy
+from eggnog_mapper.counts import FeatureCounts
+
+CONTIGS = [
+    {"a": 1, "b": 2},
+    {"c": 3, "a": 1},
+    {},
+    {"d": 0, "b": 4},
+    {"e": 2, "c": 1, "d": 5}
+]
+
+
+def _counter_sum(contigs):
+    # the running Counter sum that FeatureCounts replaces
+    total = Counter()
+    for contig in contigs:
+        total = Counter(contig) + total
+    return dict(total)
+
+
+def test_add_matches_counter_sum():
+    counts = FeatureCounts()
+    for contig in CONTIGS:
+        counts.add(contig)
+    expected = _counter_sum(CONTIGS)
+    assert counts.to_dict() == expected
+    assert list(counts.to_dict().keys()) == list(expected.keys())
+
+
+def test_add_contigs_matches_add():
+    contigs, features, values = [], [], []
+    for i, contig in enumerate(CONTIGS):
+        for feature, value in contig.items():
+            contigs.append(i)
+            features.append(feature)
+            values.append(value)
+    counts = FeatureCounts()
+    counts.add({"z": 7})
+    counts.add_contigs(numpy.array(contigs), numpy.array(features, dtype=object), numpy.array(values))
+    expected = _counter_sum([{"z": 7}] + CONTIGS)
+    assert list(counts.to_dict().items()) == list(expected.items())
+
+
+def test_float_counts():
+    counts = FeatureCounts()
+    counts.add({"a": 1, "b": 2})
+    counts.add({"a": 0.5})
+    assert counts.to_dict() == {"a": 1.5, "b": 2}
+
+
+def test_vocabulary_grows():
+    counts = FeatureCounts()
+    for i in range(3000):
+        counts.add({f"f{i}": 1, "shared": 1})
+    result = counts.to_dict()
+    assert len(counts) == 3001
+    assert result["shared"] == 3000
+    assert list(result.keys())[:2] == ["f2999", "shared"]
@@ -0,0 +1,60 @@
+import numpy
+import pytest
+from eggnog_mapper.coverage import (
+    ContigCoverages,
+    load_coverages
+)
+from eggnog_mapper.interning import ContigIndex
+from eggnog_to_feature_table import import_coverage_data
+
+
+def _write(path, text):
+    path.write_text(text)
+    return str(path)
+
+
+def test_load_coverages_ints(tmp_path):
+    coverages = load_coverages(_write(tmp_path / "cov.tsv", "a_1\t10\nb_1\t3\nc_1\t0\n"))
+    assert dict(coverages) == {"a_1": 10, "b_1": 3, "c_1": 0}
+    assert coverages.values.dtype == numpy.int64
+    assert isinstance(coverages["a_1"], int)
+    assert "b_1" in coverages and "d_1" not in coverages
+    with pytest.raises(KeyError):
+        coverages["d_1"]
+
+
+def test_load_coverages_floats_header_extra_columns(tmp_path):
+    text = "contig\tmean_depth\tlength\na_1\t10.5\t2000\nb_1\t3\t500\na_1\t7.25\t2000\n"
+    coverages = load_coverages(_write(tmp_path / "cov.tsv", text))
+    assert coverages.values.dtype == numpy.float64
+    # the last coverage of a repeated contig wins
+    assert dict(coverages) == {"a_1": 7.25, "b_1": 3.0}
+
+
+def test_load_coverages_empty(tmp_path):
+    assert len(load_coverages(_write(tmp_path / "cov.tsv", ""))) == 0
+
+
+def test_load_coverages_bad_value(tmp_path):
+    with pytest.raises(ValueError, match="isn't a number"):
+        load_coverages(_write(tmp_path / "cov.tsv", "a_1\t10\nb_1\tlots\n"))
+
+
+def test_lookup_and_reindex():
+    coverages = ContigCoverages.from_dict({"a_1": 4, "b_1": 6})
+    values, found = coverages.lookup(["b_1", "x_1", "a_1"])
+    assert values.tolist() == [6, 0, 4]
+    assert found.tolist() == [True, False, True]
+    assert dict(coverages.reindex(ContigIndex(["x_1", "b_1"]))) == {"b_1": 6}
+    assert coverages.below(5).tolist() == ["a_1"]
+    assert ContigCoverages.from_dict(coverages) is coverages
+
+
+def test_import_coverage_data_filters(tmp_path):
+    cov_file = _write(tmp_path / "cov.tsv", "a_1\t10\nb_1\t4.5\nc_1\t5\n")
+    filter_file = _write(tmp_path / "filter.txt", "c_1\n")
+    coverages, contig_filter = import_coverage_data(True, cov_file, filter_file, 5, False)
+    assert dict(coverages) == {"a_1": 10.0, "b_1": 4.5, "c_1": 5.0}
+    assert contig_filter == {"b_1", "c_1"}
+    coverages, contig_filter = import_coverage_data(False, cov_file, "NULL", 0, False)
+    assert len(coverages) == 0 and contig_filter == set()
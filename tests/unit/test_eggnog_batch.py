@@ -0,0 +1,103 @@
+import os
+import csv
+import pytest
+from tests.unit.test_aggregate import _write_annotation_file
+from eggnog_mapper.feature_matrix import read_feature_matrix
+from eggnog_batch import (
+    Sample,
+    read_manifest,
+    run_batch,
+    summarize_sample,
+    _get_args
+)
+from eggnog_to_feature_table import (
+    import_coverage_data,
+    scan_and_summarize_output_columnar
+)
+from annotations import read_annotations
+
+
+def _write_sample(tmp_path, sample_id, seed):
+    annotation_file = tmp_path / f"{sample_id}_sample.annotations"
+    contigs = _write_annotation_file(annotation_file, seed=seed)
+    with open(tmp_path / f"{sample_id}_contigs.fa", "w") as f:
+        for i, contig in enumerate(contigs):
+            f.write(f">{contig}\n{'A' * (1000 * (i % 4))}\n")
+    with open(tmp_path / f"{sample_id}_coverage.tsv", "w") as f:
+        for i, contig in enumerate(contigs):
+            if i % 9 != 4:
+                f.write(f"{contig}\t{i % 7}\n")
+    return {contig: 1000 * (i % 4) for i, contig in enumerate(contigs)}
+
+
+def test_read_manifest(tmp_path):
+    manifest = tmp_path / "manifest.tsv"
+    manifest.write_text("#annotation\tcoverage\tfasta\tsample_id\n\nA_x.annotations\tNULL\tA.fa\n/data/B.ann\tB.cov\tB.fa\tsampleB\n")
+    samples = read_manifest(str(manifest))
+    assert [s.sample_id for s in samples] == ["A", "sampleB"]
+    assert samples[0].annotation == str(tmp_path / "A_x.annotations")
+    assert samples[0].coverage == "NULL"
+    assert samples[1].annotation == "/data/B.ann"
+
+
+@pytest.mark.parametrize("content", ["a\tb\n", "A_1\tNULL\tA.fa\nA_2\tNULL\tA.fa\n"])
+def test_read_manifest_errors(tmp_path, content):
+    manifest = tmp_path / "manifest.tsv"
+    manifest.write_text(content)
+    with pytest.raises(ValueError):
+        read_manifest(str(manifest))
+
+
+@pytest.mark.parametrize("use_cov", [True, False])
+def test_batch_matches_single_sample_runs(tmp_path, use_cov):
+    """
+    Each column of the batch matrix holds the same counts as a single-sample run.
+    """
+    sample_ids = ["S1", "S2", "S3"]
+    contig_lengths = {sample_id: _write_sample(tmp_path, sample_id, seed) for seed, sample_id in enumerate(sample_ids)}
+    with open(tmp_path / "manifest.tsv", "w") as f:
+        for sample_id in sample_ids:
+            f.write(f"{sample_id}_sample.annotations\t{sample_id}_coverage.tsv\t{sample_id}_contigs.fa\n")
+    cov_method = "weighted" if use_cov else "unweighted"
+    argv = ["--manifest", str(tmp_path / "manifest.tsv"), "--output_prefix", str(tmp_path / "batch"), "--eggnog_category", "EC", "--processes", "2"]
+    assert run_batch(_get_args(argv + (["--use_cov"] if use_cov else []))) == 0
+    matrix = read_feature_matrix(str(tmp_path / f"batch_len2000_cov5_EC_{cov_method}_direct_count_matrix"))
+    assert matrix.samples == sample_ids
+
+    cwd = os.getcwd()
+    os.chdir(tmp_path)
+    try:
+        for j, sample_id in enumerate(sample_ids):
+            coverages, contig_filter = import_coverage_data(use_cov, f"{sample_id}_coverage.tsv", "NULL", 5, False)
+            lengths = contig_lengths[sample_id]
+            contigs_allowed = {c for c, length in lengths.items() if length >= 2000} - contig_filter
+            annotation_file = f"{sample_id}_sample.annotations"
+            prefix = f"{sample_id}_EC_{cov_method}"
+            scan_and_summarize_output_columnar({"EC": prefix}, annotation_file, cov_method, read_annotations(annotation_file, ["EC"]), coverages, contigs_allowed, "No", "No", lengths, 0.5, 2000, 5, None)
+            with open(f"{sample_id}_len2000_cov5_EC_{cov_method}_direct_count_table.csv") as f:
+                expected = {row[0]: float(row[1]) for row in csv.reader(f)}
+            column = matrix.counts[:, j].toarray().ravel()
+            assert {feature: value for feature, value in zip(matrix.features, column) if value} == pytest.approx(expected)
+    finally:
+        os.chdir(cwd)
+
+
+def test_summarize_sample_without_coverage(tmp_path):
+    _write_sample(tmp_path, "S1", 0)
+    sample = Sample("S1", str(tmp_path / "S1_sample.annotations"), "NULL", str(tmp_path / "S1_contigs.fa"))
+    with_coverage = sample._replace(coverage=str(tmp_path / "S1_coverage.tsv"))
+    argv = ["--manifest", "unused", "--eggnog_category", "EC", "--min_contig_coverage", "0"]
+    args = _get_args(argv)
+    counts = summarize_sample(sample, ["EC"], args)
+    # without --use_cov and a coverage filter, the coverage file isn't used
+    assert counts == summarize_sample(with_coverage, ["EC"], args)
+    assert counts[(2000, 0)]["EC"]
+
+    for extra in [[], ["--use_cov"]]:
+        args = _get_args(argv[:-2] + extra)
+        with pytest.raises(ValueError, match="Sample S1 has no coverage file"):
+            summarize_sample(sample, ["EC"], args)
+    with open(tmp_path / "manifest.tsv", "w") as f:
+        f.write("S1_sample.annotations\tNULL\tS1_contigs.fa\n")
+    with pytest.raises(SystemExit, match="Sample S1 has no coverage file"):
+        run_batch(_get_args(["--manifest", str(tmp_path / "manifest.tsv"), "--output_prefix", str(tmp_path / "batch"), "--eggnog_category", "EC"]))
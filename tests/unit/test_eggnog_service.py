@@ -0,0 +1,204 @@
+import io
+import os
+import sys
+import socket
+import filecmp
+import threading
+import pytest
+from tests.unit.test_eggnog_batch import _write_sample
+import eggnog_client
+from eggnog_client import (
+    SOCKET_ENV,
+    default_socket_path,
+    main as client_main,
+    reads_stream,
+    request,
+    submit_job
+)
+import eggnog_service
+from eggnog_service import (
+    MapperService,
+    private_socket_directory,
+    run_job,
+    _remove_stale_socket
+)
+from eggnog_to_feature_table import (
+    _get_args,
+    run_mapper
+)
+
+
+def _mapper_argv(tmp_path):
+    _write_sample(tmp_path, "1234", 3)
+    return [
+        "-i", str(tmp_path / "1234_sample.annotations"),
+        "--input_cov", str(tmp_path / "1234_coverage.tsv"),
+        "--input_contig_fasta", str(tmp_path / "1234_contigs.fa"),
+        "--eggnog_category", "EC",
+        "--use_cov"
+    ]
+
+
+def _run_in(directory, run):
+    os.makedirs(directory)
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        return run()
+    finally:
+        os.chdir(cwd)
+
+
+def _assert_same_files(dir_a, dir_b):
+    files = sorted(os.listdir(dir_a))
+    assert files == sorted(os.listdir(dir_b))
+    for file_name in files:
+        assert filecmp.cmp(dir_a / file_name, dir_b / file_name, shallow=False), file_name
+
+
+@pytest.fixture
+def service(tmp_path):
+    socket_path = str(tmp_path / "mapper.sock")
+    mapper_service = MapperService(socket_path, workers=2)
+    thread = threading.Thread(target=mapper_service.serve_forever)
+    thread.start()
+    yield socket_path
+    mapper_service.shutdown()
+    thread.join()
+    mapper_service.server_close()
+
+
+def test_run_job_matches_cli(tmp_path):
+    argv = _mapper_argv(tmp_path)
+    assert _run_in(tmp_path / "cli", lambda: run_mapper(_get_args(argv))) == 0
+    os.makedirs(tmp_path / "job")
+    cwd = os.getcwd()
+    try:
+        result = run_job(argv, str(tmp_path / "job"))
+    finally:
+        os.chdir(cwd)
+    assert result["exit_code"] == 0
+    assert "App end" in result["stdout"]
+    assert sorted(result["outputs"]) == sorted(str(tmp_path / "job" / name) for name in os.listdir(tmp_path / "job") if "_EC_" in name)
+    assert result["metrics"]["outputs"] == result["outputs"]
+    _assert_same_files(tmp_path / "cli", tmp_path / "job")
+
+
+def test_service_runs_jobs(tmp_path, service):
+    argv = _mapper_argv(tmp_path)
+    assert request(service, {"command": "ping"}) == {"status": "ok", "workers": 2}
+    assert os.stat(service).st_mode & 0o777 == 0o600
+
+    # two jobs at once, each in its own directory
+    results = {}
+    jobs = []
+    for name in ["a", "b"]:
+        os.makedirs(tmp_path / name)
+        jobs.append(threading.Thread(target=lambda name=name: results.update({name: submit_job(argv, str(tmp_path / name), service)})))
+    for job in jobs:
+        job.start()
+    for job in jobs:
+        job.join()
+    assert [results[name]["exit_code"] for name in ["a", "b"]] == [0, 0]
+    _assert_same_files(tmp_path / "a", tmp_path / "b")
+    assert all(os.path.exists(path) for path in results["a"]["outputs"])
+
+    result = submit_job(["--bogus"], str(tmp_path), service)
+    assert result["exit_code"] == 2
+    assert "unrecognized arguments: --bogus" in result["stderr"]
+    result = submit_job(argv[:-3] + ["--eggnog_category", "NOPE"], str(tmp_path), service)
+    assert result["exit_code"] == 1
+    assert "Bad category selection" in result["stderr"]
+
+
+def test_client_runs_locally_without_service(tmp_path, monkeypatch):
+    argv = _mapper_argv(tmp_path)
+    monkeypatch.setenv(SOCKET_ENV, str(tmp_path / "missing.sock"))
+    assert _run_in(tmp_path / "client", lambda: client_main(argv)) == 0
+    assert _run_in(tmp_path / "cli", lambda: run_mapper(_get_args(argv))) == 0
+    _assert_same_files(tmp_path / "cli", tmp_path / "client")
+
+
+def test_client_reads_stdin_locally(tmp_path, monkeypatch, service):
+    argv = _mapper_argv(tmp_path)
+    monkeypatch.setenv(SOCKET_ENV, service)
+    with open(argv[1], "rb") as f:
+        annotations = f.read()
+    monkeypatch.setattr(sys, "stdin", io.TextIOWrapper(io.BufferedReader(io.BytesIO(annotations))))
+
+    def no_service(*args, **kwargs):
+        raise AssertionError("the service can't read the client's standard input")
+
+    monkeypatch.setattr(eggnog_client, "submit_job", no_service)
+    stdin_argv = ["-i", "-"] + argv[2:]
+    assert reads_stream(stdin_argv)
+    assert not reads_stream(argv)
+    assert _run_in(tmp_path / "client", lambda: client_main(stdin_argv)) == 0
+    assert _run_in(tmp_path / "cli", lambda: run_mapper(_get_args(argv))) == 0
+    # the count tables of standard input are named after "stdin" instead of the sample id
+    files = sorted(os.listdir(tmp_path / "cli"))
+    client_files = sorted(os.listdir(tmp_path / "client"))
+    assert sorted(name.replace("stdin", "1234", 1) for name in client_files) == files
+    for name in files:
+        client_name = name if name in client_files else name.replace("1234", "stdin", 1)
+        with open(tmp_path / "cli" / name, "rb") as f, open(tmp_path / "client" / client_name, "rb") as g:
+            assert f.read() == g.read(), name
+
+
+@pytest.mark.skipif(not hasattr(os, "mkfifo"), reason="named pipes not supported")
+def test_reads_stream_named_pipe(tmp_path):
+    os.mkfifo(tmp_path / "annotations.fifo")
+    assert reads_stream(["-i", "annotations.fifo", "--use_cov"], str(tmp_path))
+    assert reads_stream([f"-i{tmp_path / 'annotations.fifo'}"])
+    assert not reads_stream(["-i", "missing.annotations"], str(tmp_path))
+    assert not reads_stream(["--use_cov"])
+
+
+def test_default_socket_path(monkeypatch, tmp_path):
+    monkeypatch.delenv(SOCKET_ENV, raising=False)
+    monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmp_path))
+    assert default_socket_path() == str(tmp_path / "eggnog_mapper" / "mapper.sock")
+    monkeypatch.delenv("XDG_RUNTIME_DIR")
+    assert os.path.basename(os.path.dirname(default_socket_path())) == f"eggnog_mapper-{os.getuid()}"
+    monkeypatch.setenv(SOCKET_ENV, str(tmp_path / "other.sock"))
+    assert default_socket_path() == str(tmp_path / "other.sock")
+
+
+def test_private_socket_directory(tmp_path):
+    private_socket_directory(str(tmp_path / "sockets"))
+    assert os.stat(tmp_path / "sockets").st_mode & 0o777 == 0o700
+    private_socket_directory(str(tmp_path / "sockets"))
+    os.chmod(tmp_path / "sockets", 0o777)
+    with pytest.raises(RuntimeError, match="only they can write to"):
+        private_socket_directory(str(tmp_path / "sockets"))
+    with pytest.raises(RuntimeError, match="only they can write to"):
+        MapperService(str(tmp_path / "sockets" / "mapper.sock"))
+    os.symlink(tmp_path, tmp_path / "link")
+    with pytest.raises(RuntimeError, match="only they can write to"):
+        private_socket_directory(str(tmp_path / "link"))
+
+
+def test_remove_stale_socket(tmp_path):
+    # only stale sockets of the current user are removed
+    (tmp_path / "file.sock").write_text("")
+    with pytest.raises(RuntimeError, match="isn't a socket of the current user"):
+        _remove_stale_socket(str(tmp_path / "file.sock"))
+    assert os.path.exists(tmp_path / "file.sock")
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(str(tmp_path / "stale.sock"))
+    stale.close()
+    _remove_stale_socket(str(tmp_path / "stale.sock"))
+    assert not os.path.exists(tmp_path / "stale.sock")
+
+
+def test_service_and_client_check_peer_user(tmp_path, monkeypatch, service):
+    monkeypatch.setattr(eggnog_service, "is_own_peer", lambda connection: False)
+    with pytest.raises(ConnectionError):
+        request(service, {"command": "ping"})
+    monkeypatch.undo()
+    monkeypatch.setattr(eggnog_client, "is_own_peer", lambda connection: False)
+    with pytest.raises(PermissionError, match="runs as another user"):
+        request(service, {"command": "ping"})
+    monkeypatch.setenv(SOCKET_ENV, service)
+    with pytest.raises(SystemExit, match="runs as another user"):
+        client_main(_mapper_argv(tmp_path))
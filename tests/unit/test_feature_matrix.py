@@ -0,0 +1,61 @@
+import numpy
+import pytest
+from eggnog_mapper.feature_matrix import (
+    FeatureMatrix,
+    read_feature_matrix
+)
+
+SAMPLE_COUNTS = [
+    {"GO:1": 3, "GO:2": 1},
+    {},
+    {"GO:3": 2, "GO:1": 5}
+]
+SAMPLES = ["s1", "s2", "s3"]
+
+
+def test_from_sample_counts():
+    matrix = FeatureMatrix.from_sample_counts(SAMPLE_COUNTS, SAMPLES)
+    assert matrix.features.tolist() == ["GO:1", "GO:2", "GO:3"]
+    assert matrix.samples == SAMPLES
+    assert matrix.counts.toarray().tolist() == [[3, 0, 5], [1, 0, 0], [0, 0, 2]]
+
+
+def test_from_sample_counts_empty():
+    matrix = FeatureMatrix.from_sample_counts([{}, {}], ["s1", "s2"])
+    assert matrix.counts.shape == (0, 2)
+
+
+def test_binary():
+    matrix = FeatureMatrix.from_sample_counts([{"a": 2.5, "b": 1}], ["s1"]).binary()
+    assert matrix.counts.toarray().tolist() == [[1], [1]]
+
+
+def test_to_long():
+    long_counts = FeatureMatrix.from_sample_counts(SAMPLE_COUNTS, SAMPLES).to_long()
+    rows = sorted(zip(long_counts["feature"], long_counts["sample"], long_counts["count"]))
+    assert rows == [("GO:1", "s1", 3), ("GO:1", "s3", 5), ("GO:2", "s1", 1), ("GO:3", "s3", 2)]
+
+
+def test_write_mtx_round_trip(tmp_path):
+    matrix = FeatureMatrix.from_sample_counts(SAMPLE_COUNTS, SAMPLES)
+    paths = matrix.write(str(tmp_path / "counts"), "mtx")
+    assert [p.split("/")[-1] for p in paths] == ["counts.mtx", "counts.features.txt", "counts.samples.txt"]
+    read_back = read_feature_matrix(str(tmp_path / "counts"))
+    assert read_back.features.tolist() == matrix.features.tolist()
+    assert read_back.samples == SAMPLES
+    assert numpy.array_equal(read_back.counts.toarray(), matrix.counts.toarray())
+
+
+@pytest.mark.parametrize("matrix_format,module", [("parquet", "pyarrow"), ("hdf5", "tables")])
+def test_write_long_formats(tmp_path, matrix_format, module):
+    pytest.importorskip(module)
+    import pandas
+    [path] = FeatureMatrix.from_sample_counts(SAMPLE_COUNTS, SAMPLES).write(str(tmp_path / "counts"), matrix_format)
+    long_counts = pandas.read_parquet(path) if matrix_format == "parquet" else pandas.read_hdf(path, "counts")
+    assert len(long_counts) == 4
+    assert long_counts["count"].sum() == 11
+
+
+def test_write_bad_format(tmp_path):
+    with pytest.raises(ValueError):
+        FeatureMatrix.from_sample_counts(SAMPLE_COUNTS, SAMPLES).write(str(tmp_path / "counts"), "xlsx")
@@ -0,0 +1,101 @@
+import os
+import json
+import math
+import numpy
+import pandas
+import pytest
+from tests.unit.test_aggregate import (
+    _write_inputs,
+    _assert_same_outputs
+)
+from eggnog_mapper import feature_stats as feature_stats_module
+from eggnog_mapper.annotations import read_annotation_chunks
+from eggnog_mapper.feature_stats import (
+    FeatureStats,
+    diversity,
+    stats_report,
+    write_stats
+)
+from eggnog_to_feature_table import (
+    scan_and_summarize_output,
+    scan_and_summarize_output_columnar
+)
+
+
+def test_diversity():
+    stats = diversity(numpy.array([2, 2, 0, 4]))
+    assert stats["total"] == 8
+    assert stats["richness"] == 3
+    assert math.isclose(stats["shannon"], -(0.25 * math.log(0.25) * 2 + 0.5 * math.log(0.5)))
+    assert math.isclose(stats["simpson"], 1 - (0.25 ** 2 * 2 + 0.5 ** 2))
+    assert diversity(numpy.array([5])) == {"total": 5, "richness": 1, "shannon": 0.0, "simpson": 0.0}
+    assert diversity(numpy.array([])) == {"total": 0, "richness": 0, "shannon": 0.0, "simpson": 0.0}
+    assert diversity(numpy.array([0.5, 1.0]))["total"] == 1.5
+
+
+@pytest.mark.parametrize("fold_entries", [1 << 20, 2])
+def test_feature_stats_crosstab(monkeypatch, fold_entries):
+    monkeypatch.setattr(feature_stats_module, "_FOLD_ENTRIES", fold_entries)
+    stats = FeatureStats()
+    stats.add("Bacteria", {"A": 2, "B": 1})
+    stats.add("NA", {})
+    stats.add_contigs(numpy.array(["Archaea", "Bacteria"], dtype=object), numpy.array([0, 0, 1]), numpy.array(["C", "A", "C"], dtype=object), numpy.array([3, 1, 4]))
+    assert stats.taxa.items == ["Bacteria", "Archaea"]
+    assert stats.crosstab().toarray().tolist() == [[2, 1, 4], [1, 0, 3]]
+    assert stats.to_long().values.tolist() == [
+        ["Bacteria", "C", 4], ["Bacteria", "A", 2], ["Bacteria", "B", 1],
+        ["Archaea", "C", 3], ["Archaea", "A", 1]
+    ]
+
+
+def test_stats_report(tmp_path):
+    stats = FeatureStats()
+    stats.add("Bacteria", {"A": 2, "B": 1})
+    stats.add("Archaea", {"C": 6})
+    totals = {"C": 6, "A": 2, "B": 1}
+    report = stats_report(totals, stats, top_n=2)
+    assert report["total"] == 9
+    assert report["richness"] == 3
+    assert report["top_features"] == [["C", 6], ["A", 2]]
+    assert [taxon["taxon"] for taxon in report["taxa"]] == ["Archaea", "Bacteria"]
+    assert report["taxa"][1]["top_features"] == [["A", 2], ["B", 1]]
+    assert report["taxa"][0]["shannon"] == 0.0
+
+    paths = write_stats(str(tmp_path / "1234_len2000_cov5_EC_unweighted"), totals, stats, 2)
+    assert [os.path.basename(path) for path in paths] == ["1234_len2000_cov5_EC_unweighted_stats.json", "1234_len2000_cov5_EC_unweighted_taxon_count_table.csv"]
+    with open(paths[0]) as f:
+        assert json.load(f) == report
+    with open(paths[1]) as f:
+        assert f.read() == "taxon,feature,count\nBacteria,A,2\nBacteria,B,1\nArchaea,C,6\n"
+    path = write_stats(str(tmp_path / "parquet"), totals, stats, 2, "parquet")[1]
+    assert pandas.read_parquet(path).values.tolist() == [["Bacteria", "A", 2], ["Bacteria", "B", 1], ["Archaea", "C", 6]]
+
+
+@pytest.mark.parametrize("chunk_size,processes", [(None, 1), (7, 1), (7, 2)])
+@pytest.mark.parametrize("cov_method", ["weighted", "unweighted"])
+def test_stats_columnar_matches_loop(tmp_path, chunk_size, processes, cov_method):
+    annotation_data, coverages, contigs_allowed, contig_lengths, go_xrefs = _write_inputs(tmp_path)
+    input_cats = ["GO", "EC", "COG"]
+    if chunk_size is not None:
+        annotation_chunks = read_annotation_chunks(str(tmp_path / "1234_sample.annotations"), input_cats, chunk_size)
+    else:
+        annotation_chunks = annotation_data
+    prefixes = {cat: f"1234_len2000_cov5_{cat}_{cov_method}" for cat in input_cats}
+    cwd = os.getcwd()
+    try:
+        os.makedirs(tmp_path / "loop")
+        os.chdir(tmp_path / "loop")
+        for cat in input_cats:
+            scan_and_summarize_output(prefixes[cat], "1234_sample.annotations", cat, cov_method, annotation_data, coverages, contigs_allowed, "No", "No", contig_lengths, 0.5, 2000, 5, go_xrefs, stats_top=3)
+        os.makedirs(tmp_path / "columnar")
+        os.chdir(tmp_path / "columnar")
+        scan_and_summarize_output_columnar(prefixes, "1234_sample.annotations", cov_method, annotation_chunks, coverages, contigs_allowed, "No", "No", contig_lengths, 0.5, 2000, 5, go_xrefs, processes, stats_top=3)
+    finally:
+        os.chdir(cwd)
+    files = _assert_same_outputs(tmp_path / "loop", tmp_path / "columnar")
+    for cat in input_cats:
+        assert f"1234_len2000_cov5_{cat}_{cov_method}_stats.json" in files
+        # the cross-tab adds up to the direct count table
+        crosstab = pandas.read_csv(tmp_path / "columnar" / f"1234_len2000_cov5_{cat}_{cov_method}_taxon_count_table.csv", keep_default_na=False)
+        counts = pandas.read_csv(tmp_path / "columnar" / f"1234_len2000_cov5_{cat}_{cov_method}_direct_count_table.csv", header=None, names=["feature", "count"])
+        assert crosstab.groupby("feature")["count"].sum().to_dict() == dict(zip(counts["feature"], counts["count"]))
@@ -0,0 +1,139 @@
+import os
+import gzip
+import numpy
+import pandas
+import pytest
+from tests.unit.test_aggregate import _write_inputs
+from eggnog_mapper.aggregate import summarize_contigs
+from eggnog_mapper.annotations import read_annotation_chunks
+from eggnog_mapper.gene_abundance import (
+    attach_gene_weights,
+    gene_weights,
+    load_gene_lengths,
+    load_gene_weights
+)
+from eggnog_mapper.interning import ContigValues
+from eggnog_to_feature_table import (
+    scan_and_summarize_output,
+    scan_and_summarize_output_columnar
+)
+
+PRODIGAL_FAA = """>k141_1_1 # 3 # 452 # 1 # ID=1_1;partial=10;start_type=Edge
+MKLLV
+AAGT*
+>k141_1_2 # 500 # 799 # -1 # ID=1_2;partial=00
+MSTR*
+>k141_7_1 # 1 # 90 # 1 # ID=2_1;partial=00
+M*
+"""
+
+GFF = """##gff-version  3
+# Sequence Data: seqnum=1;seqlen=5000;seqhdr="k141_1"
+k141_1\tProdigal_v2.6.3\tCDS\t3\t452\t40.1\t+\t0\tID=1_1;partial=10
+k141_1\tProdigal_v2.6.3\tCDS\t500\t799\t12.0\t-\t0\tID=1_2;partial=00
+k141_7\tProdigal_v2.6.3\tgene\t1\t90\t.\t+\t.\tID=gene_1
+k141_7\tProdigal_v2.6.3\tCDS\t1\t90\t3.2\t+\t0\tID=2_1;partial=00
+##FASTA
+>k141_1
+ACGT
+"""
+
+EXPECTED_LENGTHS = {"k141_1_1": 450, "k141_1_2": 300, "k141_7_1": 90}
+
+
+def test_load_gene_lengths(tmp_path):
+    faa_path = tmp_path / "genes.faa"
+    faa_path.write_text(PRODIGAL_FAA)
+    assert dict(load_gene_lengths(str(faa_path))) == EXPECTED_LENGTHS
+    with gzip.open(tmp_path / "genes.faa.gz", "wt") as f:
+        f.write(PRODIGAL_FAA)
+    assert dict(load_gene_lengths(str(tmp_path / "genes.faa.gz"))) == EXPECTED_LENGTHS
+    gff_path = tmp_path / "genes.gff"
+    gff_path.write_text(GFF)
+    assert dict(load_gene_lengths(str(gff_path))) == EXPECTED_LENGTHS
+    table_path = tmp_path / "lengths.tsv"
+    table_path.write_text("query_name\tlength\n" + "".join(f"{name}\t{length}\n" for name, length in EXPECTED_LENGTHS.items()))
+    assert dict(load_gene_lengths(str(table_path))) == EXPECTED_LENGTHS
+
+
+def test_prodigal_headers_across_blocks(tmp_path, monkeypatch):
+    from eggnog_mapper import gene_abundance
+    monkeypatch.setattr(gene_abundance, "BLOCK_SIZE", 16)
+    faa_path = tmp_path / "genes.faa"
+    faa_path.write_text(PRODIGAL_FAA)
+    assert dict(load_gene_lengths(str(faa_path))) == EXPECTED_LENGTHS
+
+
+def test_gene_weights():
+    abundances = ContigValues.from_items(["a_1", "a_2", "b_1", "c_1"], [10, 30, 0, 5])
+    lengths = ContigValues.from_items(["a_1", "a_2", "b_1"], [500, 1500, 1000])
+    rpk = dict(gene_weights(abundances, lengths, "rpk"))
+    # c_1 has no length
+    assert rpk == {"a_1": 20.0, "a_2": 20.0, "b_1": 0.0}
+    tpm = dict(gene_weights(abundances, lengths, "tpm"))
+    assert tpm == {"a_1": 500000.0, "a_2": 500000.0, "b_1": 0.0}
+    assert dict(gene_weights(abundances, lengths, "cov_length")) == {"a_1": 5000.0, "a_2": 45000.0, "b_1": 0.0}
+    with pytest.raises(ValueError, match="Unknown gene weighting"):
+        gene_weights(abundances, lengths, "fpkm")
+
+
+def test_summarize_contigs_weighted():
+    annotation_data = pandas.DataFrame({
+        "query_name": ["a_1", "a_2", "a_3", "b_1"],
+        "taxonomic_scope": ["Bacteria"] * 4,
+        "EC": ["1.1.1.1,2.2.2.2", "1.1.1.1", None, "2.2.2.2"]
+    })
+    weights = ContigValues.from_items(["a_1", "a_2", "b_1"], [1.5, 2.0, 0.25])
+    weighted = next(attach_gene_weights(annotation_data, weights))
+    # genes without a weight count 0
+    assert weighted["gene_weight"].tolist() == [1.5, 2.0, 0.0, 0.25]
+    aggregates = summarize_contigs(weighted, ["EC"], 0.5)
+    features = aggregates.features["EC"]
+    assert features.values.tolist() == [[0, "1.1.1.1", 3.5], [0, "2.2.2.2", 1.5], [1, "2.2.2.2", 0.25]]
+    assert aggregates.non_hits["EC"].tolist() == [1, 0]
+    assert aggregates.contigs["gene_count"].tolist() == [3, 1]
+
+
+def _read_table(path):
+    return dict(pandas.read_csv(path, header=None, dtype={0: str}).values.tolist())
+
+
+@pytest.mark.parametrize("chunk_size,processes", [(None, 1), (7, 1), (7, 2)])
+def test_weighted_columnar_matches_per_gene_sum(tmp_path, chunk_size, processes):
+    annotation_data, coverages, contigs_allowed, contig_lengths, go_xrefs = _write_inputs(tmp_path)
+    query_names = annotation_data["query_name"].tolist()
+    reads = numpy.arange(len(query_names)) % 11
+    with open(tmp_path / "reads.tsv", "w") as f:
+        f.writelines(f"{name}\t{count}\n" for name, count in zip(query_names, reads.tolist()))
+    with open(tmp_path / "lengths.tsv", "w") as f:
+        f.writelines(f"{name}\t{300 + 30 * i}\n" for i, name in enumerate(query_names))
+    weights = load_gene_weights(str(tmp_path / "reads.tsv"), str(tmp_path / "lengths.tsv"), "rpk")
+    input_cats = ["GO", "EC"]
+    if chunk_size is None:
+        annotation_chunks = annotation_data
+    else:
+        annotation_chunks = read_annotation_chunks(str(tmp_path / "1234_sample.annotations"), input_cats, chunk_size)
+    prefixes = {cat: f"1234_len2000_cov5_{cat}_rpk" for cat in input_cats}
+    cwd = os.getcwd()
+    try:
+        os.makedirs(tmp_path / "loop")
+        os.chdir(tmp_path / "loop")
+        for cat in input_cats:
+            scan_and_summarize_output(f"1234_len2000_cov5_{cat}_unweighted", "1234_sample.annotations", cat, "unweighted", annotation_data, coverages, contigs_allowed, "No", "No", contig_lengths, 0.5, 2000, 5, go_xrefs)
+        os.makedirs(tmp_path / "columnar")
+        os.chdir(tmp_path / "columnar")
+        scan_and_summarize_output_columnar(prefixes, "1234_sample.annotations", "rpk", attach_gene_weights(annotation_chunks, weights), coverages, contigs_allowed, "No", "No", contig_lengths, 0.5, 2000, 5, go_xrefs, processes)
+    finally:
+        os.chdir(cwd)
+    for cat in input_cats:
+        # the contig summaries are those of an unweighted run
+        with open(tmp_path / "loop" / f"1234_len2000_cov5_{cat}_unweighted_summary.tsv") as f, open(tmp_path / "columnar" / f"1234_len2000_cov5_{cat}_rpk_summary.tsv") as g:
+            assert f.read() == g.read()
+        expected = {}
+        for name, value in zip(query_names, annotation_data[cat].tolist()):
+            if name.rpartition("_")[0] in contigs_allowed and isinstance(value, str):
+                for feature in value.split(","):
+                    expected[feature] = expected.get(feature, 0) + weights.get(name, 0)
+        counts = _read_table(tmp_path / "columnar" / f"1234_len2000_cov5_{cat}_rpk_direct_count_table.csv")
+        assert counts.keys() == {feature for feature, total in expected.items() if total > 0}
+        assert all(numpy.isclose(counts[feature], expected[feature]) for feature in counts)
@@ -0,0 +1,201 @@
+import os
+import pickle
+import numpy
+import pandas
+import pytest
+from tests.unit.test_aggregate import (
+    _write_inputs,
+    _assert_same_outputs
+)
+from eggnog_mapper.aggregate import summarize_contigs
+from eggnog_mapper.annotations import read_annotation_chunks
+from eggnog_mapper.go_ontology import (
+    CLOSURE_ARRAYS,
+    CLOSURE_DIR,
+    GOClosure,
+    load_go_closure,
+    parse_obo
+)
+from eggnog_to_feature_table import (
+    add_propagated_category,
+    scan_and_summarize_output,
+    scan_and_summarize_output_columnar
+)
+
+# GO:1 and GO:2 are roots, GO:5 is under both through GO:3 (is_a) and GO:4 (part_of)
+TOY_OBO = """format-version: 1.2
+
+[Term]
+id: GO:1
+name: root one
+
+[Term]
+id: GO:2
+name: root two
+
+[Term]
+id: GO:3
+is_a: GO:1 ! root one
+
+[Term]
+id: GO:4
+alt_id: GO:40
+is_a: GO:1 ! root one
+relationship: part_of GO:2 ! root two
+
+[Term]
+id: GO:5
+is_a: GO:3
+relationship: part_of GO:4
+relationship: regulates GO:2
+
+[Term]
+id: GO:6
+relationship: regulates GO:5
+
+[Typedef]
+id: part_of
+name: part of
+"""
+
+
+def _write_obo(path, text=TOY_OBO):
+    path.write_text(text)
+    return str(path)
+
+
+def _ancestors(closure, go_id):
+    code = closure.term_codes([go_id])[0]
+    return closure.term_ids[closure.ancestors[closure.indptr[code]:closure.indptr[code + 1]]].tolist()
+
+
+def test_parse_obo(tmp_path):
+    term_ids, edges, alt_ids = parse_obo(_write_obo(tmp_path / "toy.obo"))
+    assert term_ids == ["GO:1", "GO:2", "GO:3", "GO:4", "GO:5", "GO:6"]
+    assert edges == [("GO:3", "GO:1"), ("GO:4", "GO:1"), ("GO:4", "GO:2"), ("GO:5", "GO:3"), ("GO:5", "GO:4")]
+    assert alt_ids == {"GO:40": "GO:4"}
+
+
+def test_closure(tmp_path):
+    closure = GOClosure.from_edges(*parse_obo(_write_obo(tmp_path / "toy.obo")))
+    assert _ancestors(closure, "GO:5") == ["GO:1", "GO:2", "GO:3", "GO:4", "GO:5"]
+    assert _ancestors(closure, "GO:40") == ["GO:1", "GO:2", "GO:4"]
+    # regulates isn't followed
+    assert _ancestors(closure, "GO:6") == ["GO:6"]
+    assert closure.term_codes(["GO:4", "GO:40", "GO:99"]).tolist() == [3, 3, -1]
+
+
+def test_propagate_counts_each_ancestor_once_per_gene(tmp_path):
+    closure = GOClosure.from_edges(*parse_obo(_write_obo(tmp_path / "toy.obo")))
+    genes, go_ids = closure.propagate(numpy.array([0, 0, 0, 2, 2]), numpy.array(["GO:5", "GO:99", "GO:3", "GO:40", "GO:99"], dtype=object))
+    assert genes.tolist() == [0] * 6 + [2] * 4
+    assert go_ids.tolist() == ["GO:1", "GO:2", "GO:3", "GO:4", "GO:5", "GO:99", "GO:1", "GO:2", "GO:4", "GO:99"]
+    assert closure.propagate_terms(["GO:3", "GO:4"]) == ["GO:1", "GO:2", "GO:3", "GO:4"]
+    assert closure.propagate_terms([]) == []
+
+
+def test_closure_cache(tmp_path):
+    obo_path = _write_obo(tmp_path / "toy.obo")
+    closure = load_go_closure(obo_path)
+    assert os.path.exists(tmp_path / CLOSURE_DIR / "manifest.json")
+    cached = load_go_closure(obo_path)
+    assert isinstance(cached.ancestors, numpy.memmap)
+    assert numpy.array_equal(cached.ancestors, closure.ancestors)
+    # workers reload the closure from the cache, once for every shard they're sent
+    unpickled = pickle.loads(pickle.dumps(cached))
+    assert _ancestors(unpickled, "GO:5") == _ancestors(closure, "GO:5")
+    assert pickle.loads(pickle.dumps(closure)) is unpickled
+
+    # a changed OBO file is compiled again
+    _write_obo(tmp_path / "toy.obo", TOY_OBO.replace("relationship: part_of GO:4\n", ""))
+    os.utime(obo_path, ns=(0, 0))
+    assert _ancestors(load_go_closure(obo_path), "GO:5") == ["GO:1", "GO:3", "GO:5"]
+    assert _ancestors(pickle.loads(pickle.dumps(closure)), "GO:5") == ["GO:1", "GO:3", "GO:5"]
+
+
+def test_closure_cache_written_by_parent_only(tmp_path):
+    obo_path = _write_obo(tmp_path / "toy.obo")
+    closure = GOClosure.from_edges(*parse_obo(obo_path), source=obo_path)
+    # a worker unpickling the closure with a cold cache parses the OBO, but leaves the cache
+    # to the parent
+    assert _ancestors(pickle.loads(pickle.dumps(closure)), "GO:5") == _ancestors(closure, "GO:5")
+    assert not os.path.exists(tmp_path / CLOSURE_DIR)
+
+    load_go_closure(obo_path)
+    array_path = tmp_path / CLOSURE_DIR / "toy.obo.ancestors.npy"
+    inode = os.stat(array_path).st_ino
+    mapped = load_go_closure(obo_path)
+    ancestors = numpy.array(mapped.ancestors)
+    # a rebuilt cache replaces the arrays, rather than rewriting them under the mapped closure
+    _write_obo(tmp_path / "toy.obo", TOY_OBO.replace("relationship: part_of GO:4\n", ""))
+    os.utime(obo_path, ns=(0, 0))
+    load_go_closure(obo_path)
+    assert os.stat(array_path).st_ino != inode
+    assert numpy.array_equal(mapped.ancestors, ancestors)
+    assert sorted(os.listdir(tmp_path / CLOSURE_DIR)) == sorted(["manifest.json"] + [f"toy.obo.{array}.npy" for array in CLOSURE_ARRAYS])
+
+
+def test_add_propagated_category():
+    assert add_propagated_category(["GO", "EC"], "go.obo") == ["GO", "GO_propagated", "EC"]
+    assert add_propagated_category(["GO", "EC"], None) == ["GO", "EC"]
+    assert add_propagated_category(["EC"], "go.obo") == ["EC"]
+
+
+def test_summarize_contigs_propagated(tmp_path):
+    closure = GOClosure.from_edges(*parse_obo(_write_obo(tmp_path / "toy.obo")))
+    annotation_data = {
+        "query_name": ["a_1_1", "a_1_2", "a_1_3"],
+        "taxonomic_scope": ["Bacteria"] * 3,
+        "GO": ["GO:5,GO:3", None, "GO:40"]
+    }
+    aggregates = summarize_contigs(pandas.DataFrame(annotation_data), ["GO", "GO_propagated"], 0.5, closure)
+    assert aggregates.non_hits["GO_propagated"].tolist() == [1]
+    features = aggregates.features["GO_propagated"]
+    assert dict(zip(features["feature"], features["count"])) == {"GO:1": 2, "GO:2": 2, "GO:3": 1, "GO:4": 2, "GO:5": 1}
+
+
+def _write_test_obo(path):
+    # GO:0-GO:24 in a binary tree with a few part_of links, GO:30 an alternative id of GO:3
+    # and GO:25-GO:29 left out of the ontology
+    lines = ["format-version: 1.2", ""]
+    for i in range(25):
+        lines += ["[Term]", f"id: GO:{i}"]
+        if i:
+            lines.append(f"is_a: GO:{i // 2}")
+        if i % 5 == 4:
+            lines.append(f"relationship: part_of GO:{i - 3}")
+        if i == 3:
+            lines.append("alt_id: GO:30")
+        lines.append("")
+    path.write_text("\n".join(lines))
+    return str(path)
+
+
+@pytest.mark.parametrize("chunk_size,processes", [(None, 1), (9, 1), (9, 2)])
+@pytest.mark.parametrize("cov_method,binary_output", [("weighted", "No"), ("unweighted", "Yes")])
+def test_propagated_columnar_matches_loop(tmp_path, chunk_size, processes, cov_method, binary_output):
+    annotation_data, coverages, contigs_allowed, contig_lengths, go_xrefs = _write_inputs(tmp_path)
+    closure = load_go_closure(_write_test_obo(tmp_path / "go.obo"))
+    input_cats = ["GO", "GO_propagated"]
+    if chunk_size is not None:
+        annotation_chunks = read_annotation_chunks(str(tmp_path / "1234_sample.annotations"), input_cats, chunk_size)
+    else:
+        annotation_chunks = annotation_data
+    prefixes = {cat: f"1234_len2000_cov5_{cat}_{cov_method}" for cat in input_cats}
+    cwd = os.getcwd()
+    try:
+        os.makedirs(tmp_path / "loop")
+        os.chdir(tmp_path / "loop")
+        for cat in input_cats:
+            scan_and_summarize_output(prefixes[cat], "1234_sample.annotations", cat, cov_method, annotation_data, coverages, contigs_allowed, "Yes", binary_output, contig_lengths, 0.5, 2000, 5, go_xrefs, go_closure=closure)
+        os.makedirs(tmp_path / "columnar")
+        os.chdir(tmp_path / "columnar")
+        scan_and_summarize_output_columnar(prefixes, "1234_sample.annotations", cov_method, annotation_chunks, coverages, contigs_allowed, "Yes", binary_output, contig_lengths, 0.5, 2000, 5, go_xrefs, processes, go_closure=closure)
+    finally:
+        os.chdir(cwd)
+    files = _assert_same_outputs(tmp_path / "loop", tmp_path / "columnar")
+    method = "binary" if binary_output == "Yes" else cov_method
+    assert f"1234_len2000_cov5_GO_propagated_{method}_fake2go_count_table.csv" in files
+    # every gene with a GO term in the ontology counts towards the root
+    with open(tmp_path / "columnar" / f"1234_len2000_cov5_GO_propagated_{method}_direct_count_table.csv") as f:
+        assert any(line.startswith("GO:0,") for line in f)
@@ -1,9 +1,31 @@
+import os
 import re
+import shutil
+import pytest
+import numpy
+import scipy.sparse
+from collections import defaultdict
+from eggnog_mapper.eggnog_xrefs import (
+    build_table,
+    _get_args
+)
 from eggnog_mapper.go_xref import (
     GO_Xrefs,
-    XREF_TYPES
+    XREF_TYPES,
+    INDEX_DIR,
+    PACKED_VERSION,
+    XrefProjector,
+    load_xref_table,
+    normalize_xrefs,
+    parse_xref_table,
+    read_packed_table,
+    shared_go_xrefs,
+    write_packed_table,
+    _read_manifest
 )
 
+GO_XREF_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "GO_xref")
+
 def test_go_xrefs():
     # make sure it loads, has the relevant keys, and each maps from
     # a GO id string to a list of strings.
@@ -16,3 +38,207 @@ def test_go_xrefs():
             assert isinstance(x_ref_list, list)
             for term in x_ref_list:
                 assert isinstance(term, str)
+
+
+def _read_xref_table_reference(path):
+    # the original line-by-line parser the compiled index replaces
+    xref_table = defaultdict(list)
+    with open(path) as f:
+        for line in f.readlines():
+            row = line.strip().split('\t')
+            xref_table[row[2]].append(row[0])
+    return xref_table
+
+
+def test_go_xrefs_match_line_parser():
+    xrefs = GO_Xrefs()
+    for xref in XREF_TYPES:
+        expected = _read_xref_table_reference(os.path.join(GO_XREF_DIR, f"{xref}.clean"))
+        table = xrefs.xrefs[xref]
+        assert list(table.keys()) == list(expected.keys())
+        for go_id, x_ref_list in expected.items():
+            assert table[go_id] == x_ref_list
+        assert table["GO:not_a_term"] == []
+        assert "GO:not_a_term" not in table
+
+
+def test_go_xrefs_load_lazily(tmp_path):
+    shutil.copy(os.path.join(GO_XREF_DIR, "ec2go.clean"), tmp_path)
+    xrefs = GO_Xrefs(str(tmp_path))
+    assert not os.path.exists(tmp_path / INDEX_DIR)
+    assert xrefs.xrefs["ec2go"]["GO:0008465"] == ["EC:1.1.1.29"]
+    assert sorted(_read_manifest(str(tmp_path / INDEX_DIR)).keys()) == ["ec2go"]
+
+
+def test_xref_index_reused_and_rebuilt(tmp_path):
+    shutil.copy(os.path.join(GO_XREF_DIR, "ec2go.clean"), tmp_path)
+    load_xref_table(str(tmp_path), "ec2go")
+    table = load_xref_table(str(tmp_path), "ec2go")
+    assert isinstance(table.go_ids, numpy.memmap)
+    mapped, go_ids = table, numpy.array(table.go_ids)
+    inode = os.stat(tmp_path / INDEX_DIR / "ec2go.go_ids.npy").st_ino
+
+    with open(tmp_path / "ec2go.clean", "a") as f:
+        f.write("EC:9.9.9.9\tGO:made up term\tGO:9999999\n")
+    table = load_xref_table(str(tmp_path), "ec2go")
+    assert table["GO:9999999"] == ["EC:9.9.9.9"]
+    assert load_xref_table(str(tmp_path), "ec2go")["GO:9999999"] == ["EC:9.9.9.9"]
+    # the index arrays are replaced, not rewritten under a process that still maps them
+    assert os.stat(tmp_path / INDEX_DIR / "ec2go.go_ids.npy").st_ino != inode
+    assert numpy.array_equal(mapped.go_ids, go_ids)
+    assert sorted(os.listdir(tmp_path / INDEX_DIR)) == sorted(["manifest.json"] + [f"ec2go.{array}.npy" for array in ["go_ids", "indptr", "targets", "target_ids"]])
+
+
+def test_shared_go_xrefs_reloaded_on_change(tmp_path):
+    shutil.copy(os.path.join(GO_XREF_DIR, "ec2go.clean"), tmp_path)
+    xrefs = shared_go_xrefs(str(tmp_path))
+    assert xrefs["ec2go"]["GO:0008465"] == ["EC:1.1.1.29"]
+    assert shared_go_xrefs(str(tmp_path)) is xrefs
+    assert GO_Xrefs(str(tmp_path)).xrefs is xrefs
+
+    with open(tmp_path / "ec2go.clean", "a") as f:
+        f.write("EC:9.9.9.9\tGO:made up term\tGO:9999999\n")
+    reloaded = shared_go_xrefs(str(tmp_path))
+    assert reloaded is not xrefs
+    assert reloaded["ec2go"]["GO:9999999"] == ["EC:9.9.9.9"]
+
+
+def _project_reference(go_counts, xref_table):
+    # the original one-term-at-a-time projection
+    projected = defaultdict(int)
+    for go_term, count in go_counts.items():
+        for x_ref in xref_table[go_term]:
+            projected[x_ref] += count
+    return dict(projected)
+
+
+def test_xref_projector_matches_reference():
+    xrefs = GO_Xrefs()
+    go_ids = list(xrefs.xrefs["pfam2go"].keys())[:200:3] + ["GO:not_a_term"] + list(xrefs.xrefs["ec2go"].keys())[:50]
+    go_counts = {go_id: i + 1 for i, go_id in enumerate(go_ids)}
+    projected = xrefs.xrefs.projector.project(list(go_counts.keys()), numpy.array(list(go_counts.values())))
+    assert list(projected.keys()) == XREF_TYPES
+    for xref in XREF_TYPES:
+        expected = _project_reference(go_counts, xrefs.xrefs[xref])
+        x_refs, counts = projected[xref]
+        assert list(zip(x_refs.tolist(), counts.tolist())) == list(expected.items())
+
+
+def test_xref_projector_multiple_samples():
+    table = defaultdict(list)
+    table.update({"GO:1": ["A", "B"], "GO:2": ["B"], "GO:3": ["C", "C"]})
+    projector = XrefProjector({"test2go": table})
+    go_ids = ["GO:2", "GO:9", "GO:1"]
+    counts = numpy.array([[1, 0], [5, 5], [2, 3]])
+    x_refs, projected = projector.project(go_ids, counts)["test2go"]
+    assert x_refs.tolist() == ["B", "A"]
+    assert projected.tolist() == [[3, 3], [2, 3]]
+    x_refs, projected = projector.project(go_ids, scipy.sparse.csr_matrix(counts))["test2go"]
+    assert scipy.sparse.issparse(projected)
+    assert projected.toarray().tolist() == [[3, 3], [2, 3]]
+    # a target repeated for a GO id counts once
+    x_refs, projected = projector.project(["GO:3", "GO:1"], numpy.array([1, 1]))["test2go"]
+    assert dict(zip(x_refs.tolist(), projected.tolist())) == {"C": 1, "A": 1, "B": 1}
+
+
+RAW_EC2GO = """!version date: 2022/06/28 10:02:25
+!description: Mapping of Enzyme Commission numbers to GO terms.
+!external resource: http://www.expasy.org/enzyme/
+!
+EC:1.1.1.1 > GO:alcohol dehydrogenase (NAD+) activity ; GO:0004022
+EC:1.1.1.1 > GO:alcohol dehydrogenase (NAD) activity ; GO:0004022
+EC:1.1.1.2  > GO:alcohol dehydrogenase (NADP+) activity ; go:0008106
+EC:1.1.1.3 > GO:homoserine dehydrogenase activity ; GO:4412
+EC:1.1.1.3 GO:homoserine dehydrogenase activity GO:0004412
+EC:1.1.1.1 > GO:alcohol dehydrogenase (NADP+) activity ; GO:0008106
+"""
+
+
+def test_normalize_xrefs():
+    table, stats = normalize_xrefs(RAW_EC2GO.splitlines())
+    assert table.values.tolist() == [["EC:1.1.1.1", "GO:0004022"], ["EC:1.1.1.2", "GO:0008106"], ["EC:1.1.1.1", "GO:0008106"]]
+    assert stats == {
+        "lines": 6, "rows": 3, "malformed": 2, "duplicates": 1,
+        "malformed_lines": [[8, "EC:1.1.1.3 > GO:homoserine dehydrogenase activity ; GO:4412"], [9, "EC:1.1.1.3 GO:homoserine dehydrogenase activity GO:0004412"]]
+    }
+    table, stats = normalize_xrefs(["Pfam:PF00001 7tm_1 \tGO:a\tGO:0004930", "Pfam:PF00001 7tm_1\tGO:b\t GO:0004930", "\tGO:c\tGO:0004930", "Pfam:PF00002"])
+    assert table.values.tolist() == [["Pfam:PF00001 7tm_1", "GO:0004930"]]
+    assert (stats["duplicates"], stats["malformed"]) == (1, 2)
+
+
+def test_parse_xref_table_drops_duplicates_and_malformed_lines(tmp_path, capsys):
+    with open(tmp_path / "ec2go.clean", "w") as f:
+        f.write("EC:1\tGO:a\tGO:0000001\nEC:2\tGO:a\tGO:0000001\nEC:1\tGO:a variant\tGO:0000001\nEC:3\tGO:b\n")
+    table = parse_xref_table(str(tmp_path / "ec2go.clean"))
+    assert dict(table) == {"GO:0000001": ["EC:1", "EC:2"]}
+    assert "Skipped 1 malformed lines" in capsys.readouterr().out
+    assert load_xref_table(str(tmp_path), "ec2go")["GO:0000001"] == ["EC:1", "EC:2"]
+
+
+def test_build_packed_table(tmp_path):
+    (tmp_path / "raw").mkdir()
+    (tmp_path / "raw" / "ec2go").write_text(RAW_EC2GO)
+    args = _get_args(["build", "--input", str(tmp_path / "raw"), "--output_dir", str(tmp_path / "xrefs")])
+    assert args.func(args) == 0
+    table, metadata = read_packed_table(str(tmp_path / "xrefs" / "ec2go.xref.npz"))
+    assert dict(table) == {"GO:0004022": ["EC:1.1.1.1"], "GO:0008106": ["EC:1.1.1.2", "EC:1.1.1.1"]}
+    assert metadata["format_version"] == PACKED_VERSION
+    assert metadata["source"] == "ec2go"
+    assert metadata["release"] == "2022/06/28 10:02:25"
+    assert metadata["header"]["external resource"] == "http://www.expasy.org/enzyme/"
+    assert (metadata["rows"], metadata["duplicates"], metadata["malformed"]) == (3, 1, 2)
+
+    # the packed table is loaded instead of a .clean file, without compiling an index
+    shutil.copy2(os.path.join(GO_XREF_DIR, "ec2go.clean"), tmp_path / "xrefs")
+    os.utime(tmp_path / "xrefs" / "ec2go.clean", ns=(0, 0))
+    xrefs = shared_go_xrefs(str(tmp_path / "xrefs"))
+    assert xrefs["ec2go"]["GO:0008106"] == ["EC:1.1.1.2", "EC:1.1.1.1"]
+    assert not os.path.exists(tmp_path / "xrefs" / INDEX_DIR)
+    build_table(str(tmp_path / "xrefs" / "ec2go.clean"), str(tmp_path / "xrefs"), release="2022-07-05")
+    reloaded = shared_go_xrefs(str(tmp_path / "xrefs"))
+    assert reloaded is not xrefs
+    assert reloaded["ec2go"]["GO:0008465"] == ["EC:1.1.1.29"]
+
+    args = _get_args(["build", "--input", str(tmp_path / "raw" / "ec2go"), "--output_dir", str(tmp_path / "strict"), "--strict"])
+    with pytest.raises(SystemExit, match="2 malformed lines"):
+        args.func(args)
+    assert not os.path.exists(tmp_path / "strict" / "ec2go.xref.npz")
+
+
+def test_changed_clean_table_replaces_packed_table(tmp_path, capsys):
+    shutil.copy(os.path.join(GO_XREF_DIR, "ec2go.clean"), tmp_path)
+    build_table(str(tmp_path / "ec2go.clean"), str(tmp_path))
+    os.utime(tmp_path / "ec2go.clean", ns=(0, 0))
+    assert load_xref_table(str(tmp_path), "ec2go")["GO:0008465"] == ["EC:1.1.1.29"]
+    assert not os.path.exists(tmp_path / INDEX_DIR)
+
+    # an edited .clean file is loaded in place of the older packed table
+    with open(tmp_path / "ec2go.clean", "a") as f:
+        f.write("EC:9.9.9.9\tGO:glycerate dehydrogenase activity\tGO:0008465\n")
+    xrefs = shared_go_xrefs(str(tmp_path))
+    assert xrefs["ec2go"]["GO:0008465"] == ["EC:1.1.1.29", "EC:9.9.9.9"]
+    assert "has changed since" in capsys.readouterr().out
+
+    # until the packed table is rebuilt
+    build_table(str(tmp_path / "ec2go.clean"), str(tmp_path))
+    assert load_xref_table(str(tmp_path), "ec2go")["GO:0008465"] == ["EC:1.1.1.29", "EC:9.9.9.9"]
+    assert "has changed since" not in capsys.readouterr().out
+
+
+def test_packed_tables_match_clean_tables(tmp_path):
+    for xref in XREF_TYPES:
+        metadata = build_table(os.path.join(GO_XREF_DIR, f"{xref}.clean"), str(tmp_path))
+        assert metadata["malformed"] == 0
+        expected = parse_xref_table(os.path.join(GO_XREF_DIR, f"{xref}.clean"))
+        table = read_packed_table(str(tmp_path / f"{xref}.xref.npz"))[0]
+        for array in ["go_ids", "indptr", "targets", "target_ids"]:
+            assert numpy.array_equal(getattr(table, array), getattr(expected, array))
+
+
+def test_packed_table_newer_version(tmp_path, monkeypatch):
+    from eggnog_mapper import go_xref
+    monkeypatch.setattr(go_xref, "PACKED_VERSION", PACKED_VERSION + 1)
+    write_packed_table(str(tmp_path / "ec2go.xref.npz"), parse_xref_table(os.path.join(GO_XREF_DIR, "ec2go.clean")), {})
+    monkeypatch.undo()
+    with pytest.raises(ValueError, match="format version"):
+        read_packed_table(str(tmp_path / "ec2go.xref.npz"))
@@ -0,0 +1,66 @@
+import numpy
+import pickle
+import pytest
+from eggnog_mapper.interning import (
+    ContigIndex,
+    ContigSet,
+    ContigValues,
+    Vocabulary
+)
+
+
+def test_contig_index_codes():
+    index = ContigIndex(["a_1", "b_1", "c_1"])
+    assert len(index) == 3
+    assert index.codes(["c_1", "x_1", "a_1"]).tolist() == [2, -1, 0]
+    assert index.code("b_1") == 1 and index.code("x_1") == -1
+    assert index.union(["a_1"]) is index
+    assert index.union(["d_1", "a_1", "d_1"]).ids.tolist() == ["a_1", "b_1", "c_1", "d_1"]
+
+
+def test_contig_values():
+    lengths = ContigValues.from_items(["a_1", "b_1", "a_1"], [100, 200, 300])
+    assert dict(lengths) == {"a_1": 300, "b_1": 200}
+    assert lengths == {"a_1": 300, "b_1": 200}
+    assert isinstance(lengths["a_1"], int)
+    with pytest.raises(KeyError):
+        lengths["x_1"]
+    values, found = lengths.take(numpy.array([1, -1, 0]))
+    assert values.tolist() == [200, 0, 300]
+    assert found.tolist() == [True, False, True]
+    ids, values = lengths.to_arrays()
+    assert ids.tolist() == ["a_1", "b_1"] and values.tolist() == [300, 200]
+
+
+def test_contig_values_on_shared_index():
+    index = ContigIndex(["a_1", "b_1", "c_1"])
+    coverages = ContigValues.from_mapping({"c_1": 2.5, "x_1": 1.0, "a_1": 4.0}, index)
+    assert coverages.index is index
+    assert dict(coverages) == {"a_1": 4.0, "c_1": 2.5}
+    assert "b_1" not in coverages and len(coverages) == 2
+    values, found = coverages.lookup(["b_1", "c_1"])
+    assert values.tolist() == [0.0, 2.5] and found.tolist() == [False, True]
+    assert ContigValues.from_mapping(coverages, index) is coverages
+    assert dict(coverages.reindex(ContigIndex(["c_1", "b_1"]))) == {"c_1": 2.5}
+
+
+def test_contig_set():
+    index = ContigIndex(["a_1", "b_1", "c_1", "d_1"])
+    allowed = ContigSet.all(index) - {"b_1", "x_1"}
+    assert isinstance(allowed, ContigSet)
+    assert allowed == {"a_1", "c_1", "d_1"}
+    assert "b_1" not in allowed and "x_1" not in allowed
+    allowed = allowed - ContigSet.from_set(["d_1"], index)
+    assert sorted(allowed) == ["a_1", "c_1"]
+    assert allowed.take(index.codes(["a_1", "b_1", "x_1"])).tolist() == [True, False, False]
+    assert allowed & {"a_1", "x_1"} == {"a_1"}
+    assert set(allowed.reindex(ContigIndex(["c_1", "d_1"]))) == {"c_1"}
+    assert set(pickle.loads(pickle.dumps(allowed))) == {"a_1", "c_1"}
+
+
+def test_vocabulary():
+    vocabulary = Vocabulary()
+    assert vocabulary.intern(["GO:1", "GO:2", "GO:1"]).tolist() == [0, 1, 0]
+    assert vocabulary.intern_array(numpy.array(["GO:3", "GO:2", "GO:3"], dtype=object)).tolist() == [2, 1, 2]
+    assert vocabulary.items == ["GO:1", "GO:2", "GO:3"]
+    assert len(vocabulary) == 3
@@ -0,0 +1,120 @@
+import io
+import json
+import argparse
+import pytest
+from eggnog_mapper import metrics
+from eggnog_mapper.metrics import Metrics
+
+
+class _Clock:
+    # stands in for the time module in metrics, moved forward by the tests instead of sleeping
+    def __init__(self):
+        self.now = 1000.0
+
+    def perf_counter(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = _Clock()
+    monkeypatch.setattr(metrics, "time", fake)
+    return fake
+
+
+def test_stages_are_exclusive(clock):
+    run_metrics = Metrics()
+    with metrics.recording(run_metrics):
+        with metrics.stage("outer"):
+            clock.sleep(2)
+            with metrics.stage("inner"):
+                clock.sleep(5)
+        with metrics.stage("inner"):
+            clock.sleep(1)
+    assert run_metrics.stages == {"inner": 6, "outer": 2}
+    assert list(run_metrics.stages) == ["inner", "outer"]
+
+
+def test_timed_and_counts(clock):
+    run_metrics = Metrics()
+
+    def slow_chunks():
+        for i in range(3):
+            clock.sleep(1)
+            yield i
+
+    with metrics.recording(run_metrics):
+        with metrics.stage("aggregate"):
+            for chunk in metrics.timed(slow_chunks(), "annotation_import"):
+                metrics.count("annotation_rows", 10)
+                clock.sleep(0.5)
+    assert run_metrics.stages == {"annotation_import": 3, "aggregate": 1.5}
+    report = run_metrics.report()
+    assert report["counters"] == {"annotation_rows": 30}
+    assert report["throughput"]["rows_per_second"] == round(30 / 4.5, 2)
+    assert report["peak_rss_bytes"] is None or report["peak_rss_bytes"] > 0
+
+
+def test_no_op_without_recording():
+    with metrics.stage("export"):
+        metrics.count("contigs", 5)
+        metrics.progress(100)
+    assert list(metrics.timed([1, 2], "x")) == [1, 2]
+
+
+def test_progress_is_throttled(clock):
+    stream = io.StringIO()
+    run_metrics = Metrics(progress_interval=10, progress_stream=stream)
+    for rows in range(100):
+        clock.sleep(0.0625)
+        run_metrics.progress(rows, 100)
+    assert stream.getvalue() == ""
+    clock.sleep(3.75)
+    run_metrics.progress(50, 100)
+    run_metrics.progress(51, 100)
+    assert stream.getvalue() == "-----> Processed 50 of 100 (50.0 %) annotation rows, 5 rows/s\n"
+    clock.sleep(9)
+    run_metrics.progress(60, 100)
+    assert stream.getvalue().count("\n") == 1
+    clock.sleep(1)
+    run_metrics.progress(70, 100)
+    assert stream.getvalue().count("\n") == 2
+
+
+def test_record_run(tmp_path):
+    metrics_out = tmp_path / "metrics.json"
+
+    def run(args):
+        with metrics.stage("aggregate"):
+            metrics.count("contigs", 2)
+        metrics.output("table.csv")
+        return 0
+
+    assert metrics.record_run(run, argparse.Namespace(metrics_out=str(metrics_out))) == 0
+    report = json.loads(metrics_out.read_text())
+    assert set(report) == {"total_seconds", "stages", "counters", "throughput", "peak_rss_bytes", "peak_rss_children_bytes", "outputs"}
+    assert report["counters"] == {"contigs": 2}
+    assert list(report["stages"]) == ["aggregate"]
+    assert report["outputs"] == ["table.csv"]
+
+
+def test_columnar_engine_reports_progress(tmp_path, monkeypatch, capsys):
+    import os
+    from tests.unit.test_aggregate import _write_inputs
+    from eggnog_mapper.annotations import read_annotation_chunks
+    from eggnog_to_feature_table import scan_and_summarize_output_columnar
+    # the metrics module as the mapper imports it
+    import metrics as mapper_metrics
+    annotation_data, coverages, contigs_allowed, contig_lengths, go_xrefs = _write_inputs(tmp_path)
+    monkeypatch.chdir(tmp_path)
+    run_metrics = mapper_metrics.Metrics(progress_interval=0)
+    with mapper_metrics.recording(run_metrics):
+        chunks = read_annotation_chunks("1234_sample.annotations", ["EC"], 7)
+        scan_and_summarize_output_columnar({"EC": "1234_EC_unweighted"}, "1234_sample.annotations", "unweighted", chunks, coverages, contigs_allowed, "No", "No", contig_lengths, 0.5, 2000, 5, None)
+    lines = capsys.readouterr().err.splitlines()
+    assert len(lines) > 1
+    assert all(line.startswith("-----> Processed ") for line in lines)
+    assert f"Processed {len(annotation_data):,} annotation rows" in lines[-1]
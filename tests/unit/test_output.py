@@ -0,0 +1,127 @@
+import gzip
+import pandas
+import pytest
+from eggnog_mapper import output as output_module
+from eggnog_mapper.output import (
+    SummaryTableWriter,
+    check_output_format,
+    table_path,
+    write_count_table
+)
+from eggnog_mapper.eggnog_to_feature_table import _munge_prepare_and_export_count_tables
+
+COUNTS = {"GO:0000001": 3, "GO:0000002": 1.5, "GO:0000003": 2}
+COLUMNS = ["contig_id", "contig_length", "feature_hit_freq", "consensus_taxonomy", "consensus_taxonomy_frequency"]
+LINES = ["1234_contig_1\t2500\t0.5\tBacteria\t1.0\n", "1234_contig_2\tNA\t1.0\tNA\tNA\n"]
+
+
+def test_table_path():
+    assert table_path("out/x", "csv") == "out/x.csv"
+    assert table_path("out/x", "csv.gz") == "out/x.csv.gz"
+    assert table_path("out/x", "csv.zst", "tsv") == "out/x.tsv.zst"
+    assert table_path("out/x", "parquet", "tsv") == "out/x.parquet"
+
+
+def test_check_output_format():
+    check_output_format("csv.gz")
+    with pytest.raises(ValueError, match="Unknown output format"):
+        check_output_format("xlsx")
+
+
+def test_write_count_table_csv(tmp_path):
+    path = write_count_table(str(tmp_path / "counts"), COUNTS)
+    # the same bytes as the DataFrame the tables used to be written from
+    expected = pandas.DataFrame.from_dict(COUNTS, orient="index").to_csv(None, index=True, header=False)
+    with open(path) as f:
+        assert f.read() == expected
+    path = write_count_table(str(tmp_path / "empty"), {})
+    with open(path) as f:
+        assert f.read() == ""
+
+
+def test_write_count_table_gzip(tmp_path):
+    first = write_count_table(str(tmp_path / "counts"), COUNTS, "csv.gz")
+    with open(first, "rb") as f:
+        written = f.read()
+    # no timestamp in the gzip header, so rewriting the table gives the same bytes
+    second = write_count_table(str(tmp_path / "counts"), COUNTS, "csv.gz")
+    with open(second, "rb") as f:
+        assert f.read() == written
+    with gzip.open(first, "rt") as f:
+        assert f.read() == "GO:0000001,3.0\nGO:0000002,1.5\nGO:0000003,2.0\n"
+
+
+def test_write_count_table_parquet(tmp_path):
+    pytest.importorskip("pyarrow")
+    path = write_count_table(str(tmp_path / "counts"), {"GO:0000001": 3, "GO:0000002": 1}, "parquet")
+    table = pandas.read_parquet(path)
+    assert table["feature"].tolist() == ["GO:0000001", "GO:0000002"]
+    assert table["count"].tolist() == [3, 1]
+
+
+def test_write_count_table_zstd(tmp_path):
+    zstandard = pytest.importorskip("zstandard")
+    path = write_count_table(str(tmp_path / "counts"), COUNTS, "csv.zst")
+    with zstandard.open(path, "rt") as f:
+        assert f.read().startswith("GO:0000001,3.0\n")
+
+
+@pytest.mark.parametrize("output_format", ["csv", "csv.gz"])
+def test_summary_table_writer_text(tmp_path, output_format):
+    with SummaryTableWriter(str(tmp_path / "x_summary"), COLUMNS, output_format) as writer:
+        writer.write(LINES[0])
+        writer.writelines(LINES[1:])
+    opener = gzip.open if output_format == "csv.gz" else open
+    with opener(writer.path, "rt") as f:
+        assert f.read() == "\t".join(COLUMNS) + "\n" + "".join(LINES)
+
+
+def test_summary_table_writer_parquet(tmp_path):
+    pytest.importorskip("pyarrow")
+    with SummaryTableWriter(str(tmp_path / "x_summary"), COLUMNS, "parquet") as writer:
+        writer.writelines(LINES)
+    table = pandas.read_parquet(writer.path)
+    assert list(table.columns) == COLUMNS
+    assert table["contig_id"].tolist() == ["1234_contig_1", "1234_contig_2"]
+    assert table["contig_length"].isna().tolist() == [False, True]
+    assert table["consensus_taxonomy_frequency"].tolist()[0] == 1.0
+    with SummaryTableWriter(str(tmp_path / "empty_summary"), COLUMNS, "parquet") as writer:
+        pass
+    assert list(pandas.read_parquet(writer.path).columns) == COLUMNS
+
+
+@pytest.mark.parametrize("output_format", ["csv", "parquet"])
+def test_summary_table_writer_removes_failed_table(tmp_path, output_format):
+    if output_format == "parquet":
+        pytest.importorskip("pyarrow")
+    with pytest.raises(RuntimeError):
+        with SummaryTableWriter(str(tmp_path / "x_summary"), COLUMNS, output_format) as writer:
+            writer.writelines(LINES)
+            raise RuntimeError("summarizing failed")
+    assert not list(tmp_path.iterdir())
+
+
+def test_summary_table_writer_parquet_row_groups(tmp_path, monkeypatch):
+    pyarrow_parquet = pytest.importorskip("pyarrow.parquet")
+    monkeypatch.setattr(output_module, "_PARQUET_BATCH_LINES", 2)
+    lines = LINES + ["1234_contig_3\t3000\t0.25\tArchaea\t0.5\n"]
+    with SummaryTableWriter(str(tmp_path / "x_summary"), COLUMNS, "parquet") as writer:
+        for line in lines:
+            writer.write(line)
+    parquet_file = pyarrow_parquet.ParquetFile(writer.path)
+    assert parquet_file.metadata.num_row_groups == 2
+    assert [str(field.type) for field in parquet_file.schema_arrow] == ["string", "int64", "double", "string", "double"]
+    table = pandas.read_parquet(writer.path)
+    assert table["contig_id"].tolist() == ["1234_contig_1", "1234_contig_2", "1234_contig_3"]
+    assert table["consensus_taxonomy"].isna().tolist() == [False, True, False]
+    assert table["feature_hit_freq"].tolist() == [0.5, 1.0, 0.25]
+
+
+def test_binary_count_table(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    _munge_prepare_and_export_count_tables({"GO:1": 5, "GO:2": 0.5}, "1234_sample.annotations", "GO", "weighted", "Yes", 2000, 5)
+    with open(tmp_path / "1234_len2000_cov5_GO_binary_direct_count_table.csv") as f:
+        assert f.read() == "GO:1,1\nGO:2,1\n"
+    # a table is written even if there are no features
+    _munge_prepare_and_export_count_tables({}, "1234_sample.annotations", "EC", "weighted", "Yes", 2000, 5)
+    assert (tmp_path / "1234_len2000_cov5_EC_binary_direct_count_table.csv").exists()
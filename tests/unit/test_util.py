@@ -1,4 +1,5 @@
-from eggnog_mapper.util import isfloat
+import pytest
+from eggnog_mapper.util import isfloat, int_list
 
 def test_isfloat_false():
     for test_case in ["foo", "", "NaN", list(), dict(), None]:
@@ -7,3 +8,13 @@ def test_isfloat_false():
 def test_isfloat_true():
     for test_case in [1.1, 1, 0, 0.00000001, -1.12345, "1", "1.1", "-1"]:
         assert isfloat(test_case) == True
+
+def test_int_list():
+    assert int_list("2000") == [2000]
+    assert int_list("1000,2000, 5000,") == [1000, 2000, 5000]
+    assert int_list("5,0,5") == [5, 0]
+
+def test_int_list_bad():
+    for test_case in ["", ",", "foo", "1.5"]:
+        with pytest.raises(ValueError):
+            int_list(test_case)